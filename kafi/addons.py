@@ -229,6 +229,10 @@ class AddOns(Functional):
             partition_int_offset_int_size_int_tuple_dict_dict[partition_int][offset_int] = (key_size_int, value_size_int)
             return partition_int_offset_int_size_int_tuple_dict_dict
         #
+        # Merge the (disjoint) partitions of the workers if run in parallel.
+        if "combine_fun" not in kwargs:
+            kwargs["combine_fun"] = lambda dict1, dict2: {**dict1, **dict2}
+        #
         (partition_int_offset_int_size_int_tuple_dict_dict, n_int) = self.foldl(topic_str, agg, {}, type="bytes", **kwargs)
         #
         return partition_int_offset_int_size_int_tuple_dict_dict, n_int
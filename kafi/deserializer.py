@@ -25,6 +25,8 @@ class Deserializer(SchemaRegistry):
         self.get_configs_from_kwargs(**kwargs)
         #
         self.schema_id_int_to_deserializer_dict = {}
+        # Resolved deserialization functions per (type, topic, key/value).
+        self.type_str_topic_str_key_bool_tuple_deserialize_fun_dict = {}
 
     def deserialize(self, payload_bytes, type_str, topic_str, key_bool):
         """Deserialize a payload according to its type (bytes/str/json/avro/jsonschema/protobuf).
@@ -37,22 +39,51 @@ class Deserializer(SchemaRegistry):
 
         Returns:
             any: deserialized payload (bytes, str, or dict depending on type_str)"""
+        deserialize_fun = self.get_deserialize_fun(type_str, topic_str, key_bool)
+        #
+        return deserialize_fun(payload_bytes)
+
+    def get_deserialize_fun(self, type_str, topic_str, key_bool):
+        """Resolve a type into a deserialization function (once per topic instead of once per payload).
+
+        Args:
+            type_str: target type, e.g. "avro", "json", "bytes"
+            topic_str: topic the messages come from
+            key_bool: True for the key deserialization function, False for the value deserialization function
+
+        Returns:
+            function: payload bytes -> deserialized payload (bytes, str, or dict depending on type_str)"""
+        type_str_topic_str_key_bool_tuple = (type_str.lower(), topic_str, key_bool)
+        if type_str_topic_str_key_bool_tuple in self.type_str_topic_str_key_bool_tuple_deserialize_fun_dict:
+            return self.type_str_topic_str_key_bool_tuple_deserialize_fun_dict[type_str_topic_str_key_bool_tuple]
+        #
+        # Payloads can also be memoryview slices (zero_copy consumers); only "bytes" and "str" use them without copying.
+        def to_bytes(payload_bytes):
+            return payload_bytes.tobytes() if isinstance(payload_bytes, memoryview) else payload_bytes
+        #
         if type_str.lower() == "bytes":
-            deserialized_payload = self.bytes_to_bytes(payload_bytes)
+            deserialize_fun = self.bytes_to_bytes
         elif type_str.lower() in ["str", "string"]:
-            deserialized_payload = self.bytes_to_str(payload_bytes)
+            deserialize_fun = self.bytes_to_str
         elif type_str.lower() == "json":
-            deserialized_payload = self.bytes_to_dict(payload_bytes)
+            def deserialize_fun(payload_bytes):
+                return self.bytes_to_dict(to_bytes(payload_bytes))
         elif type_str.lower() == "avro":
-            deserialized_payload = self.bytes_avro_to_dict(payload_bytes, topic_str, type_str, key_bool)
+            def deserialize_fun(payload_bytes):
+                return self.bytes_avro_to_dict(to_bytes(payload_bytes), topic_str, type_str, key_bool)
         elif type_str.lower() in ["jsonschema", "json_sr"]:
-            deserialized_payload = self.bytes_jsonschema_to_dict(payload_bytes, topic_str, type_str, key_bool)
+            def deserialize_fun(payload_bytes):
+                return self.bytes_jsonschema_to_dict(to_bytes(payload_bytes), topic_str, type_str, key_bool)
         elif type_str.lower() in ["protobuf", "pb"]:
-            deserialized_payload = self.bytes_protobuf_to_dict(payload_bytes, topic_str, type_str, key_bool)
+            def deserialize_fun(payload_bytes):
+                return self.bytes_protobuf_to_dict(to_bytes(payload_bytes), topic_str, type_str, key_bool)
         else:
-            raise Exception("Only \"str\", \"bytes\", \"json\", \"protobuf\" (\"pb\"), \"avro\" and \"jsonschema\" (\"json_sr\") supported.")
+            def deserialize_fun(payload_bytes):
+                raise Exception("Only \"str\", \"bytes\", \"json\", \"protobuf\" (\"pb\"), \"avro\" and \"jsonschema\" (\"json_sr\") supported.")
+        #
+        self.type_str_topic_str_key_bool_tuple_deserialize_fun_dict[type_str_topic_str_key_bool_tuple] = deserialize_fun
         #
-        return deserialized_payload
+        return deserialize_fun
 
     def bytes_to_str(self, bytes):
         """UTF-8-decode bytes into str (None stays None).
@@ -60,7 +91,7 @@ class Deserializer(SchemaRegistry):
         Returns:
             str: UTF-8-decoded str (None if bytes is None/falsy)"""
         if bytes:
-            return bytes.decode("utf-8")
+            return str(bytes, "utf-8")
         else:
             return bytes
 
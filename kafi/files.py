@@ -35,10 +35,8 @@ class Files(Pandas):
         #
         if suffix_str == ".bytes":
             m_list = self.cat(topic, n, type="bytes", **kwargs)
-            data_bytes = b""
-            for m in m_list:
-                value_bytes = m["value"]
-                data_bytes += value_bytes + b"\n"
+            # Join once instead of concatenating the values one by one (which is quadratic in the number of messages).
+            data_bytes = b"".join([value_bytes for m in m_list for value_bytes in (m["value"], b"\n")])
         else:
             df = self.topic_to_df(topic, n, **kwargs)
             data_bytesIO = io.BytesIO()
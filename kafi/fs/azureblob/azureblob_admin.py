@@ -49,15 +49,24 @@ class AzureBlobAdmin(FSAdmin):
         #
         return blobClient.exists()
 
+    def size_file(self, abs_path_file_str):
+        blobClient = self.containerClient.get_blob_client(abs_path_file_str)
+        #
+        return blobClient.get_blob_properties().size
+
     # Metadata
     
     def read_str(self, abs_path_file_str):
+        from azure.core.exceptions import ResourceNotFoundError
         from azure.storage.blob import BlobClient
         #
 
         blobClient = BlobClient.from_connection_string(conn_str=self.storage_obj.azure_blob_config_dict["connection.string"], container_name=self.storage_obj.azure_blob_config_dict["container.name"], blob_name=abs_path_file_str)
         #
-        storageStreamDownloader = blobClient.download_blob()
+        try:
+            storageStreamDownloader = blobClient.download_blob()
+        except ResourceNotFoundError:
+            return None
         blob_bytes = storageStreamDownloader.read()
         #
         blob_str = blob_bytes.decode("utf-8")
@@ -74,19 +83,41 @@ class AzureBlobAdmin(FSAdmin):
         #
         blobClient.upload_blob(data_bytes, overwrite=True)
 
+    def read_bytes_etag(self, abs_path_file_str):
+        from azure.core.exceptions import ResourceNotFoundError
+        #
+
+        blobClient = self.containerClient.get_blob_client(abs_path_file_str)
+        #
+        try:
+            storageStreamDownloader = blobClient.download_blob()
+        except ResourceNotFoundError:
+            return (None, None)
+        blob_bytes = storageStreamDownloader.read()
+        #
+        return (blob_bytes, storageStreamDownloader.properties.etag)
+
     #
 
-    def read_bytes(self, abs_path_file_str):
+    def read_bytes(self, abs_path_file_str, start_int=0):
         from azure.storage.blob import BlobClient
         #
 
         blobClient = BlobClient.from_connection_string(conn_str=self.storage_obj.azure_blob_config_dict["connection.string"], container_name=self.storage_obj.azure_blob_config_dict["container.name"], blob_name=abs_path_file_str)
         #
-        storageStreamDownloader = blobClient.download_blob()
+        storageStreamDownloader = blobClient.download_blob(offset=start_int if start_int > 0 else None)
         blob_bytes = storageStreamDownloader.read()
         #
         return blob_bytes
 
+    def read_bytes_chunks(self, abs_path_file_str, start_int, chunk_size_int):
+        blobClient = self.containerClient.get_blob_client(abs_path_file_str)
+        #
+        storageStreamDownloader = blobClient.download_blob(offset=start_int if start_int > 0 else None)
+        # The chunk size is determined by the max_chunk_get_size of the blob client.
+        for chunk_bytes in storageStreamDownloader.chunks():
+            yield chunk_bytes
+
     def write_bytes(self, abs_path_file_str, data_bytes):
         from azure.storage.blob import BlobClient
         #
@@ -94,3 +125,20 @@ class AzureBlobAdmin(FSAdmin):
         blobClient = BlobClient.from_connection_string(conn_str=self.storage_obj.azure_blob_config_dict["connection.string"], container_name=self.storage_obj.azure_blob_config_dict["container.name"], blob_name=abs_path_file_str)
         #
         blobClient.upload_blob(data_bytes)
+
+    def write_bytes_if_match(self, abs_path_file_str, data_bytes, etag):
+        from azure.core import MatchConditions
+        from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+        #
+
+        blobClient = self.containerClient.get_blob_client(abs_path_file_str)
+        # Conditional write (create the blob only if it does not exist yet, or replace it only if it has not been replaced since it has been read).
+        try:
+            if etag is None:
+                blob_property_dict = blobClient.upload_blob(data_bytes, overwrite=False)
+            else:
+                blob_property_dict = blobClient.upload_blob(data_bytes, overwrite=True, etag=etag, match_condition=MatchConditions.IfNotModified)
+        except (ResourceExistsError, ResourceModifiedError, ResourceNotFoundError):
+            return None
+        #
+        return blob_property_dict["etag"]
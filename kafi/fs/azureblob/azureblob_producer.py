@@ -8,4 +8,6 @@ class AzureBlobProducer(FSProducer):
     #
 
     def close(self):
+        self.write_indexes()
+        #
         return self.topic_str
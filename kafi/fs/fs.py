@@ -47,9 +47,60 @@ class FS(Storage):
                 self.bucket_name("test")
             else:
                 self.bucket_name(str(self.s3_config_dict["bucket.name"]))
+            #
+            if "multipart.part.size" not in self.s3_config_dict:
+                self.multipart_part_size(16777216)
+            else:
+                self.multipart_part_size(int(self.s3_config_dict["multipart.part.size"]))
         else:
             self.s3_config_dict = None
         #
+        # kafi
+        if "index.interval.bytes" not in self.kafi_config_dict:
+            self.index_interval_bytes(4096)
+        else:
+            self.index_interval_bytes(int(self.kafi_config_dict["index.interval.bytes"]))
+        #
+        if "batch.size" not in self.kafi_config_dict:
+            self.batch_size(16384)
+        else:
+            self.batch_size(int(self.kafi_config_dict["batch.size"]))
+        #
+        if "segment.bytes" not in self.kafi_config_dict:
+            self.segment_bytes(16777216)
+        else:
+            self.segment_bytes(int(self.kafi_config_dict["segment.bytes"]))
+        #
+        if "segment.rewrite.bytes" not in self.kafi_config_dict:
+            self.segment_rewrite_bytes(1048576)
+        else:
+            self.segment_rewrite_bytes(int(self.kafi_config_dict["segment.rewrite.bytes"]))
+        #
+        if "segment.rewrite.appends" not in self.kafi_config_dict:
+            self.segment_rewrite_appends(16)
+        else:
+            self.segment_rewrite_appends(int(self.kafi_config_dict["segment.rewrite.appends"]))
+        #
+        if "segment.ms" not in self.kafi_config_dict:
+            self.segment_ms(604800000)
+        else:
+            self.segment_ms(int(self.kafi_config_dict["segment.ms"]))
+        #
+        if "prefetch.depth" not in self.kafi_config_dict:
+            self.prefetch_depth(4)
+        else:
+            self.prefetch_depth(int(self.kafi_config_dict["prefetch.depth"]))
+        #
+        if "prefetch.max.bytes" not in self.kafi_config_dict:
+            self.prefetch_max_bytes(67108864)
+        else:
+            self.prefetch_max_bytes(int(self.kafi_config_dict["prefetch.max.bytes"]))
+        #
+        if "auto.commit.interval.ms" not in self.kafi_config_dict:
+            self.auto_commit_interval_ms(5000)
+        else:
+            self.auto_commit_interval_ms(int(self.kafi_config_dict["auto.commit.interval.ms"]))
+        #
         self.admin = self.get_admin()
 
     # azure_blob
@@ -57,6 +108,35 @@ class FS(Storage):
     def container_name(self, new_value=None): # str
         return self.get_set_config("container.name", new_value, dict=self.azure_blob_config_dict)
 
+    # kafi
+
+    def auto_commit_interval_ms(self, new_value=None): # int
+        return self.get_set_config("auto.commit.interval.ms", new_value)
+
+    def batch_size(self, new_value=None): # int
+        return self.get_set_config("batch.size", new_value)
+
+    def index_interval_bytes(self, new_value=None): # int
+        return self.get_set_config("index.interval.bytes", new_value)
+
+    def prefetch_depth(self, new_value=None): # int
+        return self.get_set_config("prefetch.depth", new_value)
+
+    def prefetch_max_bytes(self, new_value=None): # int
+        return self.get_set_config("prefetch.max.bytes", new_value)
+
+    def segment_bytes(self, new_value=None): # int
+        return self.get_set_config("segment.bytes", new_value)
+
+    def segment_rewrite_appends(self, new_value=None): # int
+        return self.get_set_config("segment.rewrite.appends", new_value)
+
+    def segment_rewrite_bytes(self, new_value=None): # int
+        return self.get_set_config("segment.rewrite.bytes", new_value)
+
+    def segment_ms(self, new_value=None): # int
+        return self.get_set_config("segment.ms", new_value)
+
     # local
     
     def root_dir(self, new_value=None): # str
@@ -66,3 +146,6 @@ class FS(Storage):
     
     def bucket_name(self, new_value=None): # str
         return self.get_set_config("bucket.name", new_value, dict=self.s3_config_dict)
+
+    def multipart_part_size(self, new_value=None): # int
+        return self.get_set_config("multipart.part.size", new_value, dict=self.s3_config_dict)
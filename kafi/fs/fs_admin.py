@@ -1,15 +1,35 @@
 import ast
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from fnmatch import fnmatch
+from itertools import takewhile
 import os
+import struct
 
 from kafi.storage_admin import StorageAdmin
+from kafi.fs.fs_segment import COMPRESSION_TYPE_STR_ID_INT_DICT, INDEX_SUFFIX_STR, create_segment_state_dict, decode_records, decode_segment, decode_segment_chunks, encode_records, encode_segment_header, find_position_by_offset, find_position_by_timestamp
 from kafi.helpers import get_millis, pattern_match
 
+# Constants
+
+READ_CHUNK_SIZE_INT = 1048576
+
+DELETE_RETENTION_MS_INT = 86400000
+
+#
+
 class FSAdmin(StorageAdmin):
     def __init__(self, fs_obj, **kwargs):
         super().__init__(fs_obj, **kwargs)
         #
         self.default_state_str = "stable"
+        # Object stores cannot append to files (the producer has to keep the bytes of the active segments to rewrite them).
+        self.append_bool = False
+        # Log compaction runs in a background thread (see compact_log_in_background()).
+        self.compaction_threadPoolExecutor = None
+        self.topic_str_compaction_future_dict = {}
+        # Last read or written version of each consumer group (group dict and ETag), so that committing offsets does not have to read the group first (see set_group_dict()).
+        self.group_str_group_dict_etag_tuple_dict = {}
 
     #
 
@@ -27,7 +47,8 @@ class FSAdmin(StorageAdmin):
         root_dir_str = self.storage_obj.root_dir()
         rel_file_str_list = self.list_files(os.path.join(root_dir_str, "groups"))
         #
-        all_group_str_list = [rel_file_str for rel_file_str in rel_file_str_list]
+        # Skip hidden (temporary) files.
+        all_group_str_list = [rel_file_str for rel_file_str in rel_file_str_list if not os.path.basename(rel_file_str).startswith(".")]
         all_group_str_set = set(all_group_str_list)
         all_group_str_list = list(all_group_str_set)
         #
@@ -65,6 +86,8 @@ class FSAdmin(StorageAdmin):
         #
         metadata_dict = {"topic": topic_str, "partitions": partitions_int, "config": config_dict}
         self.set_metadata(topic_str, metadata_dict)
+        #
+        self.set_manifest(topic_str, create_manifest_dict())
     
     #
 
@@ -95,6 +118,8 @@ class FSAdmin(StorageAdmin):
         topic_str_list = self.list_topics(pattern_str_or_str_list)
         #
         topic_str_partition_int_timestamp_int_dict_dict = self.get_topic_str_partition_int_timestamp_int_dict_dict(topic_str_list, partitions_timestamps)
+        # The manifests read by the caller (if any) or read once per topic here (and reused by replace_not_found()).
+        topic_str_manifest_dict_dict = dict(kwargs["manifests"]) if "manifests" in kwargs else {}
         #
         topic_str_offsets_dict_dict = {}
         for topic_str in topic_str_list:
@@ -105,27 +130,26 @@ class FSAdmin(StorageAdmin):
             topic_str_offsets_dict_dict[topic_str] = {partition_int: -1 for partition_int in range(partitions_int)}
             offsets_dict = topic_str_offsets_dict_dict[topic_str]
             #
-            abs_topic_dir_str = self.get_topic_abs_path_str(topic_str)
+            if topic_str not in topic_str_manifest_dict_dict:
+                topic_str_manifest_dict_dict[topic_str] = self.get_manifest(topic_str)
+            manifest_dict = topic_str_manifest_dict_dict[topic_str]
             #
             for partition_int in range(partitions_int):
-                rel_file_str = self.find_partition_file_str_by_timestamp(topic_str, partition_int, topic_str_partition_int_timestamp_int_dict_dict[topic_str][partition_int])
+                timestamp_int = topic_str_partition_int_timestamp_int_dict_dict[topic_str][partition_int]
+                rel_file_str = self.find_partition_file_str_by_timestamp(topic_str, partition_int, timestamp_int, manifest_dict=manifest_dict)
+                # Skip the records before the log start offset (see delete_records()).
+                low_offset_int = get_watermark_offsets(manifest_dict, partition_int)[0]
                 #
                 if rel_file_str == -1:
                     offsets_dict[partition_int] = -1
                 else:
-                    messages_bytes = self.read_bytes(os.path.join(abs_topic_dir_str, "partitions", rel_file_str))
-                    #
-                    message_bytes_list = messages_bytes.split(b"\n")[:-1]
-                    #
-                    for message_bytes in message_bytes_list:
-                        m = ast.literal_eval(message_bytes.decode("utf-8"))
-                        #
-                        if m["timestamp"][1] >= offsets_dict[partition_int]:
+                    for m in self.read_partition_file(topic_str, rel_file_str, timestamp_int=timestamp_int):
+                        if m["offset"] >= low_offset_int and m["timestamp"][1] >= timestamp_int:
                             offsets_dict[partition_int] = m["offset"]
                             break
         #
         if replace_not_found_bool:
-            topic_str_offsets_dict_dict = self.replace_not_found(topic_str_offsets_dict_dict)
+            topic_str_offsets_dict_dict = self.replace_not_found(topic_str_offsets_dict_dict, manifests=topic_str_manifest_dict_dict)
         #
         return topic_str_offsets_dict_dict
 
@@ -154,34 +178,104 @@ class FSAdmin(StorageAdmin):
     #
 
     def watermarks(self, pattern, **kwargs):
+        # The manifests read by the caller (if any).
+        topic_str_manifest_dict_dict = kwargs["manifests"] if "manifests" in kwargs else {}
+        #
         topic_str_list = self.list_topics(pattern)
         filtered_topic_str_list = self.storage_obj.filter_topics(topic_str_list, pattern)
         #
-        def get_watermark_offsets(topic_str, partition_int):
-            topic_abs_dir_str = self.get_topic_abs_path_str(topic_str)
-            rel_file_str_list = self.list_files(os.path.join(topic_abs_dir_str, "partitions"))
-            partition_rel_file_str_list = [rel_file_str for rel_file_str in rel_file_str_list if int(rel_file_str.split(",")[0]) == partition_int]
-            partition_rel_file_str_list.sort()
-            low_offset_int = 0
-            high_offset_int = 0
-            if len(partition_rel_file_str_list) > 0:
-                first_partition_rel_file_str = partition_rel_file_str_list[0]
-                last_partition_rel_file_str = partition_rel_file_str_list[-1]
-                #
-                low_offset_int = int(first_partition_rel_file_str.split(",")[1])
-                high_offset_int = int(last_partition_rel_file_str.split(",")[2]) + 1
-            #
-            return (low_offset_int, high_offset_int)
-        #
-
         topic_str_partition_int_offsets_tuple_dict_dict = {}
         for topic_str in filtered_topic_str_list:
             partitions_int = self.get_partitions(topic_str)
-            partition_int_offsets_tuple_dict = {partition_int: get_watermark_offsets(topic_str, partition_int) for partition_int in range(partitions_int)}
+            # One read of the manifest per topic instead of one listing of the partition files per partition.
+            manifest_dict = topic_str_manifest_dict_dict[topic_str] if topic_str in topic_str_manifest_dict_dict else self.get_manifest(topic_str)
+            partition_int_offsets_tuple_dict = {partition_int: get_watermark_offsets(manifest_dict, partition_int) for partition_int in range(partitions_int)}
             topic_str_partition_int_offsets_tuple_dict_dict[topic_str] = partition_int_offsets_tuple_dict
         #
         return topic_str_partition_int_offsets_tuple_dict_dict
 
+    #
+
+    def delete_records(self, pattern_or_offsets, **kwargs):
+        if isinstance(pattern_or_offsets, dict):
+            topic_str_offsets_dict_dict = pattern_or_offsets
+        else:
+            pattern = pattern_or_offsets
+            topic_str_list = self.list_topics(pattern)
+            # Delete all records of the topics.
+            topic_str_offsets_dict_dict = {topic_str: {partition_int: -1 for partition_int in range(self.get_partitions(topic_str))} for topic_str in topic_str_list}
+        #
+        topic_str_low_offsets_dict_dict = {}
+        for topic_str, offsets_dict in topic_str_offsets_dict_dict.items():
+            def delete_records_from_manifest(manifest_dict):
+                obsolete_abs_path_file_str_list = []
+                for partition_int, offset_int in offsets_dict.items():
+                    high_offset_int = get_watermark_offsets(manifest_dict, partition_int)[1]
+                    # Offset -1 (OFFSET_END) = delete all records of the partition.
+                    log_start_offset_int = high_offset_int if offset_int < 0 else min(offset_int, high_offset_int)
+                    #
+                    obsolete_abs_path_file_str_list += self.delete_segments(topic_str, manifest_dict, partition_int, log_start_offset_int=log_start_offset_int)
+                #
+                return obsolete_abs_path_file_str_list
+            #
+            (manifest_dict, obsolete_abs_path_file_str_list) = self.update_manifest(topic_str, delete_records_from_manifest)
+            self.delete_partition_files(obsolete_abs_path_file_str_list)
+            #
+            topic_str_low_offsets_dict_dict[topic_str] = {partition_int: get_watermark_offsets(manifest_dict, partition_int)[0] for partition_int in offsets_dict.keys()}
+        #
+        return topic_str_low_offsets_dict_dict
+
+    def enforce_retention(self, pattern):
+        topic_str_list = self.list_topics(pattern)
+        #
+        topic_str_low_offsets_dict_dict = {}
+        for topic_str in topic_str_list:
+            (retention_ms_int, retention_bytes_int) = get_retention_tuple(self.get_config(topic_str))
+            #
+            def enforce_retention_on_manifest(manifest_dict):
+                obsolete_abs_path_file_str_list = []
+                if retention_ms_int >= 0 or retention_bytes_int >= 0:
+                    for partition_int in list(manifest_dict["partitions"].keys()):
+                        obsolete_abs_path_file_str_list += self.delete_segments(topic_str, manifest_dict, partition_int, retention_ms_int=retention_ms_int, retention_bytes_int=retention_bytes_int)
+                #
+                return obsolete_abs_path_file_str_list
+            #
+            (manifest_dict, obsolete_abs_path_file_str_list) = self.update_manifest(topic_str, enforce_retention_on_manifest)
+            self.delete_partition_files(obsolete_abs_path_file_str_list)
+            #
+            topic_str_low_offsets_dict_dict[topic_str] = {partition_int: get_watermark_offsets(manifest_dict, partition_int)[0] for partition_int in range(self.get_partitions(topic_str))}
+        #
+        return topic_str_low_offsets_dict_dict
+
+    def compact_log(self, pattern):
+        topic_str_list = self.list_topics(pattern)
+        #
+        topic_str_removed_int_dict_dict = {}
+        for topic_str in topic_str_list:
+            config_dict = self.get_config(topic_str)
+            if not is_compacted(config_dict):
+                continue
+            #
+            manifest_dict = self.get_manifest(topic_str)
+            #
+            topic_str_removed_int_dict_dict[topic_str] = {partition_int: self.compact_partition(topic_str, partition_int, manifest_dict, config_dict) for partition_int in list(manifest_dict["partitions"].keys())}
+        #
+        return topic_str_removed_int_dict_dict
+
+    def compact_log_in_background(self, topic_str):
+        # At most one compaction per topic is pending at any time.
+        future = self.topic_str_compaction_future_dict.get(topic_str)
+        if future is not None and not future.done():
+            return future
+        #
+        if self.compaction_threadPoolExecutor is None:
+            self.compaction_threadPoolExecutor = ThreadPoolExecutor(max_workers=1)
+        #
+        future = self.compaction_threadPoolExecutor.submit(self.compact_log, topic_str)
+        self.topic_str_compaction_future_dict[topic_str] = future
+        #
+        return future
+
     #
     # File-based topics
     #
@@ -203,75 +297,318 @@ class FSAdmin(StorageAdmin):
         #
         return file_abs_file_str
 
-    def find_partition_file_str_by_offset(self, topic_str, partition_int, to_find_offset_int):
-        # Get sorted list of all relative file names rel_file_str_list for the partition files for partition_int of topic_str.
-        topic_abs_dir_str = self.get_topic_abs_path_str(topic_str)
-        rel_file_str_list1 = self.list_files(os.path.join(topic_abs_dir_str, "partitions"))
-        rel_file_str_list = [rel_file_str for rel_file_str in rel_file_str_list1 if int(rel_file_str.split(",")[0]) == partition_int]
-        if rel_file_str_list == []:
+    def find_partition_file_str_by_offset(self, topic_str, partition_int, to_find_offset_int, manifest_dict=None):
+        manifest_dict = self.get_manifest(topic_str) if manifest_dict is None else manifest_dict
+        segment_tuple_list = get_segment_tuple_list(manifest_dict, partition_int)
+        if segment_tuple_list == []:
             return None
-        rel_file_str_list.sort()
-        # Now find the first file in which the message with offset to_find_offset_int is contained :)
-        rel_file_str_start_offset_int_end_offset_int_tuple_dict = {rel_file_str: (int(rel_file_str.split(",")[1]), int(rel_file_str.split(",")[2])) for rel_file_str in rel_file_str_list}
-        found_rel_file_str = None
-        for rel_file_str, start_offset_int_end_offset_int_tuple in rel_file_str_start_offset_int_end_offset_int_tuple_dict.items():
-            (start_offset_int, end_offset_int) = start_offset_int_end_offset_int_tuple
-            #
-            if to_find_offset_int >= start_offset_int and to_find_offset_int <= end_offset_int:
-                found_rel_file_str = rel_file_str
-                break
+        # Find the last segment starting at or before to_find_offset_int and check that it contains the offset (or else take the next segment if the offset is in a gap left by compaction).
+        i = bisect_right(segment_tuple_list, to_find_offset_int, key=lambda segment_tuple: segment_tuple[0]) - 1
+        if i < 0:
+            return None
+        if to_find_offset_int > segment_tuple_list[i][1]:
+            if i + 1 == len(segment_tuple_list):
+                return None
+            i += 1
         #
-        return found_rel_file_str
+        return get_partition_rel_file_str(partition_int, segment_tuple_list[i])
 
-    def find_partition_file_str_by_timestamp(self, topic_str, partition_int, to_find_timestamp_int):
-        # Get sorted list of all relative file names rel_file_str_list for the partition files for partition_int of topic_str.
-        topic_abs_dir_str = self.get_topic_abs_path_str(topic_str)
-        rel_file_str_list1 = self.list_files(os.path.join(topic_abs_dir_str, "partitions"))
-        rel_file_str_list = [rel_file_str for rel_file_str in rel_file_str_list1 if int(rel_file_str.split(",")[0]) == partition_int]
-        if rel_file_str_list == []:
+    def find_partition_file_str_by_timestamp(self, topic_str, partition_int, to_find_timestamp_int, manifest_dict=None):
+        manifest_dict = self.get_manifest(topic_str) if manifest_dict is None else manifest_dict
+        segment_tuple_list = get_segment_tuple_list(manifest_dict, partition_int)
+        if segment_tuple_list == []:
             return -1
-        #
-        # Now find the first file in which the message with timestamp to_find_timestamp_int is contained :)
-        rel_file_str_list.sort()
-        rel_file_str_start_timestamp_int_end_timestamp_int_tuple_dict = {rel_file_str: (int(rel_file_str.split(",")[3]), int(rel_file_str.split(",")[4])) for rel_file_str in rel_file_str_list}
         # If to_find_timestamp < the minimum timestamp of the files => return the first file
-        min_start_timestamp_int = rel_file_str_start_timestamp_int_end_timestamp_int_tuple_dict[rel_file_str_list[0]][0]
-        if to_find_timestamp_int < min_start_timestamp_int:
-            return rel_file_str_list[0]
+        if to_find_timestamp_int < segment_tuple_list[0][2]:
+            return get_partition_rel_file_str(partition_int, segment_tuple_list[0])
         # If to_find_timestamp > the maximum timestamp of the files => return -1
-        max_end_timestamp_int = rel_file_str_start_timestamp_int_end_timestamp_int_tuple_dict[rel_file_str_list[-1]][1]
-        if to_find_timestamp_int > max_end_timestamp_int:
+        if to_find_timestamp_int > segment_tuple_list[-1][3]:
             return -1
+        # Find the first segment whose end timestamp is >= to_find_timestamp_int (segments are appended in timestamp order).
+        i = bisect_left(segment_tuple_list, to_find_timestamp_int, key=lambda segment_tuple: segment_tuple[3])
+        #
+        return get_partition_rel_file_str(partition_int, segment_tuple_list[i])
+
+    def get_partition_files(self, topic_str, partition_int_list, manifest_dict=None):
+        manifest_dict = self.get_manifest(topic_str) if manifest_dict is None else manifest_dict
+        #
+        partition_int_rel_file_str_list_dict = {partition_int: [get_partition_rel_file_str(partition_int, segment_tuple) for segment_tuple in get_segment_tuple_list(manifest_dict, partition_int)] for partition_int in partition_int_list}
+        #
+        return partition_int_rel_file_str_list_dict
+
+    def list_partition_files(self, topic_str):
+        topic_abs_dir_str = self.get_topic_abs_path_str(topic_str)
+        #
+        rel_file_str_list = self.list_files(os.path.join(topic_abs_dir_str, "partitions"))
+        # Skip the sidecar index files and hidden (temporary) files.
+        partition_rel_file_str_list = [rel_file_str for rel_file_str in rel_file_str_list if not rel_file_str.endswith(INDEX_SUFFIX_STR) and not os.path.basename(rel_file_str).startswith(".")]
+        #
+        return partition_rel_file_str_list
+
+    def read_partition_file(self, topic_str, rel_file_str, offset_int=None, timestamp_int=None, copy_bool=True):
+        partition_int = int(rel_file_str.split(",")[0])
+        #
+        abs_path_file_str = os.path.join(self.get_topic_abs_path_str(topic_str), "partitions", rel_file_str)
+        position_int = self.find_partition_file_position(topic_str, rel_file_str, offset_int, timestamp_int)
+        # Stream the partition file and decode its messages while it is still being read (e.g. to only read as far as needed for offsets_for_times()).
+        if position_int is None:
+            return decode_segment_chunks(self.read_bytes_chunks(abs_path_file_str, 0, READ_CHUNK_SIZE_INT), topic_str, partition_int)
+        else:
+            return decode_segment_chunks(self.read_bytes_chunks(abs_path_file_str, position_int, READ_CHUNK_SIZE_INT), topic_str, partition_int, ranged_bool=True)
+
+    def read_partition_file_bytes(self, topic_str, rel_file_str, offset_int=None, timestamp_int=None):
+        abs_path_file_str = os.path.join(self.get_topic_abs_path_str(topic_str), "partitions", rel_file_str)
+        position_int = self.find_partition_file_position(topic_str, rel_file_str, offset_int, timestamp_int)
+        # Return the bytes and whether they are only a range of records (starting at a position from the sparse index) instead of the whole partition file.
+        if position_int is None:
+            return (self.read_bytes(abs_path_file_str), False)
+        else:
+            return (self.read_bytes(abs_path_file_str, position_int), True)
+
+    def find_partition_file_position(self, topic_str, rel_file_str, offset_int=None, timestamp_int=None):
+        abs_path_file_str = os.path.join(self.get_topic_abs_path_str(topic_str), "partitions", rel_file_str)
+        #
+        rel_file_str_split_list = rel_file_str.split(",")
+        start_offset_int = int(rel_file_str_split_list[1])
+        start_timestamp_int = int(rel_file_str_split_list[3])
+        # Only consult the sparse index if we do not start reading at the beginning of the partition file anyway.
+        position_int = None
+        if (offset_int is not None and offset_int > start_offset_int) or (timestamp_int is not None and timestamp_int > start_timestamp_int):
+            index_abs_path_file_str = abs_path_file_str + INDEX_SUFFIX_STR
+            if self.exists_file(index_abs_path_file_str):
+                index_bytes = self.read_bytes(index_abs_path_file_str)
+                #
+                if offset_int is not None:
+                    position_int = find_position_by_offset(index_bytes, offset_int - start_offset_int)
+                else:
+                    position_int = find_position_by_timestamp(index_bytes, timestamp_int)
+        #
+        return position_int
+
+    def decode_partition_file_bytes(self, topic_str, rel_file_str, partition_file_bytes, ranged_bool, copy_bool=True):
+        partition_int = int(rel_file_str.split(",")[0])
+        #
+        if ranged_bool:
+            m_iterator = decode_records(partition_file_bytes, 0, topic_str, partition_int, copy_bool)
+        else:
+            m_iterator = decode_segment(partition_file_bytes, topic_str, partition_int, copy_bool)
+        #
+        if self.append_bool:
+            # Skip records appended to the active segment by a producer which has not committed them to the manifest (yet) - the end offset of a partition file is part of its name.
+            end_offset_int = get_partition_int_segment_tuple(rel_file_str)[1][1]
+            m_iterator = takewhile(lambda m: m["offset"] <= end_offset_int, m_iterator)
         #
-        found_rel_file_str = None
-        previous_end_timestamp_int = None
-        for rel_file_str, start_timestamp_int_end_timestamp_int_tuple in rel_file_str_start_timestamp_int_end_timestamp_int_tuple_dict.items():
-            (start_timestamp_int, end_timestamp_int) = start_timestamp_int_end_timestamp_int_tuple
+        return m_iterator
+
+    def write_partition_file(self, abs_path_file_str, previous_abs_path_file_str, segment_bytes_list, appended_bytes):
+        # Rewrite the whole active segment under its new name (the previous one is deleted by the producer after the manifest has been updated). Returns None if a partition file with this name already exists (i.e. another producer has written the same offsets in the meantime).
+        if self.write_bytes_if_match(abs_path_file_str, b"".join(segment_bytes_list), None) is None:
+            return None
+        #
+        obsolete_abs_path_file_str_list = [previous_abs_path_file_str] if previous_abs_path_file_str is not None else []
+        #
+        return obsolete_abs_path_file_str_list
+
+    def revert_partition_file(self, abs_path_file_str, previous_abs_path_file_str, previous_size_int):
+        # Undo write_partition_file() (if the manifest could not be updated): the previous version of the active segment has not been touched.
+        self.delete_file(abs_path_file_str)
+
+    # Manifest
+
+    def get_manifest(self, topic_str):
+        (manifest_dict, _) = self.get_manifest_etag(topic_str)
+        #
+        return manifest_dict
+
+    def get_manifest_etag(self, topic_str):
+        # The manifest together with its ETag (the version of the manifest file, for commit_manifest()).
+        topic_abs_dir_str = self.get_topic_abs_path_str(topic_str)
+        #
+        (manifest_bytes, etag) = self.read_bytes_etag(os.path.join(topic_abs_dir_str, "manifest"))
+        manifest_dict = ast.literal_eval(manifest_bytes.decode("utf-8")) if manifest_bytes is not None else None
+        if manifest_dict is None or "partitions" not in manifest_dict:
+            # Topics written before the (current version of the) manifest was introduced: rebuild it once from the partition files.
+            return self.rebuild_manifest(topic_str, etag)
+        #
+        return (manifest_dict, etag)
+
+    def set_manifest(self, topic_str, manifest_dict):
+        topic_abs_dir_str = self.get_topic_abs_path_str(topic_str)
+        #
+        self.write_dict_to_file(os.path.join(topic_abs_dir_str, "manifest"), manifest_dict)
+
+    def commit_manifest(self, topic_str, manifest_dict, etag):
+        # Replace the manifest only if nobody else has replaced it since it has been read with the given ETag (compare-and-swap; None = the manifest must not exist yet). Returns the new ETag, or None if the manifest has been replaced in the meantime.
+        topic_abs_dir_str = self.get_topic_abs_path_str(topic_str)
+        #
+        return self.write_bytes_if_match(os.path.join(topic_abs_dir_str, "manifest"), str(manifest_dict).encode("utf-8"), etag)
+
+    def update_manifest(self, topic_str, update_fun):
+        # Optimistic read-modify-write cycle of the manifest (safe for several processes without a lock): update_fun changes the manifest in place and is re-applied to the current manifest until the manifest could be committed. Returns the updated manifest and the result of the last call of update_fun.
+        while True:
+            (manifest_dict, etag) = self.get_manifest_etag(topic_str)
+            manifest_str = str(manifest_dict)
             #
-            if to_find_timestamp_int >= start_timestamp_int and to_find_timestamp_int <= end_timestamp_int:
-                found_rel_file_str = rel_file_str
-                break
+            result = update_fun(manifest_dict)
             #
-            if previous_end_timestamp_int is not None and to_find_timestamp_int >= previous_end_timestamp_int and to_find_timestamp_int <= end_timestamp_int:
-                found_rel_file_str = rel_file_str
-                break
+            if str(manifest_dict) == manifest_str or self.commit_manifest(topic_str, manifest_dict, etag) is not None:
+                return (manifest_dict, result)
+
+    def rebuild_manifest(self, topic_str, etag=None):
+        rel_file_str_list = self.list_partition_files(topic_str)
+        rel_file_str_list.sort()
+        #
+        topic_abs_dir_str = self.get_topic_abs_path_str(topic_str)
+        #
+        manifest_dict = create_manifest_dict()
+        for rel_file_str in rel_file_str_list:
+            (partition_int, segment_tuple) = get_partition_int_segment_tuple(rel_file_str)
+            size_int = self.size_file(os.path.join(topic_abs_dir_str, "partitions", rel_file_str))
+            generation_int = get_generation_int(rel_file_str)
             #
-            previous_end_timestamp_int = end_timestamp_int
+            segment_tuple_list = manifest_dict["partitions"].setdefault(partition_int, [])
+            if segment_tuple_list != [] and segment_tuple_list[-1][0] == segment_tuple[0]:
+                # Keep only the latest generation of a compacted segment (if the previous one has not been deleted yet).
+                if generation_int < get_generation_int(get_partition_rel_file_str(partition_int, segment_tuple_list[-1])):
+                    continue
+                segment_tuple_list.pop()
+            #
+            segment_tuple_list.append(segment_tuple + (size_int, generation_int) if generation_int > 0 else segment_tuple + (size_int,))
+        #
+        new_etag = self.commit_manifest(topic_str, manifest_dict, etag)
+        if new_etag is None:
+            # Someone else has rebuilt (or updated) the manifest in the meantime.
+            return self.get_manifest_etag(topic_str)
         #
-        return found_rel_file_str
+        return (manifest_dict, new_etag)
+
+    # Retention
 
-    def get_partition_files(self, topic_str, partition_int_list):
+    def delete_segments(self, topic_str, manifest_dict, partition_int, log_start_offset_int=None, retention_ms_int=-1, retention_bytes_int=-1):
+        # Remove whole segments from the manifest (in place) which are before the (new) log start offset, older than retention.ms or exceed retention.bytes. The data of the remaining segments is never rewritten, only the log start offset is moved forward. Returns the partition files to delete after the manifest has been written.
         topic_abs_dir_str = self.get_topic_abs_path_str(topic_str)
         #
-        rel_file_str_list = self.list_files(os.path.join(topic_abs_dir_str, "partitions"))
+        segment_tuple_list = get_segment_tuple_list(manifest_dict, partition_int)
         #
-        def sort(list):
-            list.sort()
-            return list
+        current_log_start_offset_int = manifest_dict["log_start_offsets"].get(partition_int, 0)
+        if log_start_offset_int is not None:
+            current_log_start_offset_int = max(current_log_start_offset_int, log_start_offset_int)
         #
-        partition_int_rel_file_str_list_dict = {partition_int: sort([rel_file_str for rel_file_str in rel_file_str_list if int(rel_file_str.split(",")[0]) == partition_int]) for partition_int in partition_int_list}
+        now_int = get_millis()
+        size_int = sum(segment_tuple[4] for segment_tuple in segment_tuple_list)
         #
-        return partition_int_rel_file_str_list_dict
+        count_int = 0
+        # Never delete the last segment (it might be the active segment of a producer).
+        while count_int < len(segment_tuple_list) - 1:
+            (_, end_offset_int, _, end_timestamp_int, segment_size_int) = segment_tuple_list[count_int]
+            #
+            if end_offset_int < current_log_start_offset_int or (retention_ms_int >= 0 and end_timestamp_int < now_int - retention_ms_int) or (retention_bytes_int >= 0 and size_int - segment_size_int >= retention_bytes_int):
+                size_int -= segment_size_int
+                count_int += 1
+            else:
+                break
+        #
+        deleted_segment_tuple_list = segment_tuple_list[:count_int]
+        remaining_segment_tuple_list = segment_tuple_list[count_int:]
+        #
+        if remaining_segment_tuple_list != []:
+            manifest_dict["partitions"][partition_int] = remaining_segment_tuple_list
+            current_log_start_offset_int = max(current_log_start_offset_int, remaining_segment_tuple_list[0][0])
+        manifest_dict["log_start_offsets"][partition_int] = current_log_start_offset_int
+        #
+        obsolete_abs_path_file_str_list = [os.path.join(topic_abs_dir_str, "partitions", get_partition_rel_file_str(partition_int, segment_tuple)) for segment_tuple in deleted_segment_tuple_list]
+        #
+        return obsolete_abs_path_file_str_list
+
+    # Compaction
+
+    def compact_partition(self, topic_str, partition_int, manifest_dict, config_dict):
+        # Rewrite the closed segments of a partition keeping only the latest record per key (and dropping tombstones after delete.retention.ms). The offsets of the segments are not changed, segments left empty are removed. The rewritten segments get a new name (the next generation) so that readers of the previous versions are not affected. Returns the number of removed records.
+        topic_abs_dir_str = self.get_topic_abs_path_str(topic_str)
+        #
+        delete_retention_ms_int = int(config_dict["delete.retention.ms"]) if "delete.retention.ms" in config_dict else DELETE_RETENTION_MS_INT
+        compression_type_str = str(config_dict["compression.type"]).lower() if "compression.type" in config_dict else "none"
+        #
+        segment_tuple_list = get_segment_tuple_list(manifest_dict, partition_int)
+        # The last segment might be the active segment of a producer and is never rewritten (but its keys are taken into account).
+        if len(segment_tuple_list) < 2:
+            return 0
+        #
+        key_bytes_offset_int_dict = {}
+        for segment_tuple in segment_tuple_list:
+            try:
+                for m in self.read_partition_file(topic_str, get_partition_rel_file_str(partition_int, segment_tuple)):
+                    if m["key"] is not None:
+                        key_bytes_offset_int_dict[m["key"]] = m["offset"]
+            except Exception as e:
+                # The active segment might have been renamed by a producer in the meantime.
+                if segment_tuple is not segment_tuple_list[-1]:
+                    raise e
+        #
+        now_int = get_millis()
+        #
+        removed_int = 0
+        segment_tuple_change_tuple_list = []
+        for segment_tuple in segment_tuple_list[:-1]:
+            m_list = list(self.read_partition_file(topic_str, get_partition_rel_file_str(partition_int, segment_tuple)))
+            #
+            compacted_m_list = [m for m in m_list if m["key"] is None or (key_bytes_offset_int_dict[m["key"]] == m["offset"] and (m["value"] is not None or m["timestamp"][1] >= now_int - delete_retention_ms_int))]
+            if len(compacted_m_list) == len(m_list):
+                continue
+            removed_int += len(m_list) - len(compacted_m_list)
+            #
+            if compacted_m_list == []:
+                segment_tuple_change_tuple_list.append((segment_tuple, None))
+                continue
+            #
+            segment_state_dict = create_segment_state_dict(segment_tuple[0])
+            (records_bytes, index_bytes, _) = encode_records(compacted_m_list, segment_state_dict, self.storage_obj.index_interval_bytes(), None, compression_type_str, self.storage_obj.batch_size())
+            #
+            generation_int = segment_tuple[5] + 1 if len(segment_tuple) > 5 else 1
+            compacted_segment_tuple = segment_tuple[:4] + (segment_state_dict["position"], generation_int)
+            #
+            abs_path_file_str = os.path.join(topic_abs_dir_str, "partitions", get_partition_rel_file_str(partition_int, compacted_segment_tuple))
+            if self.write_bytes_if_match(abs_path_file_str, encode_segment_header(COMPRESSION_TYPE_STR_ID_INT_DICT[compression_type_str]) + records_bytes, None) is None:
+                # The segment has already been compacted by someone else (e.g. another process).
+                continue
+            if len(index_bytes) > 0:
+                self.write_bytes(abs_path_file_str + INDEX_SUFFIX_STR, index_bytes)
+            #
+            segment_tuple_change_tuple_list.append((segment_tuple, compacted_segment_tuple))
+        #
+        if segment_tuple_change_tuple_list == []:
+            return 0
+        # Replace the segments in the current manifest (which might have been changed by producers, retention etc. in the meantime).
+        def replace_segments_in_manifest(current_manifest_dict):
+            obsolete_abs_path_file_str_list = []
+            current_segment_tuple_list = get_segment_tuple_list(current_manifest_dict, partition_int)
+            #
+            for segment_tuple, compacted_segment_tuple in segment_tuple_change_tuple_list:
+                if segment_tuple in current_segment_tuple_list:
+                    i = current_segment_tuple_list.index(segment_tuple)
+                    if compacted_segment_tuple is None:
+                        current_segment_tuple_list.pop(i)
+                    else:
+                        current_segment_tuple_list[i] = compacted_segment_tuple
+                    obsolete_abs_path_file_str_list.append(os.path.join(topic_abs_dir_str, "partitions", get_partition_rel_file_str(partition_int, segment_tuple)))
+                elif compacted_segment_tuple is not None:
+                    # The segment has been deleted in the meantime (e.g. by retention).
+                    obsolete_abs_path_file_str_list.append(os.path.join(topic_abs_dir_str, "partitions", get_partition_rel_file_str(partition_int, compacted_segment_tuple)))
+            #
+            return obsolete_abs_path_file_str_list
+        #
+        (_, obsolete_abs_path_file_str_list) = self.update_manifest(topic_str, replace_segments_in_manifest)
+        self.delete_partition_files(obsolete_abs_path_file_str_list)
+        #
+        return removed_int
+
+    def delete_partition_files(self, abs_path_file_str_list):
+        for abs_path_file_str in abs_path_file_str_list:
+            self.delete_file(abs_path_file_str)
+            #
+            index_abs_path_file_str = abs_path_file_str + INDEX_SUFFIX_STR
+            if self.exists_file(index_abs_path_file_str):
+                self.delete_file(index_abs_path_file_str)
 
     #
 
@@ -283,6 +620,7 @@ class FSAdmin(StorageAdmin):
             group_abs_path_file_str = os.path.join(root_dir_str, "groups", f"{group_str}")
             #
             self.delete_file(group_abs_path_file_str)
+            self.group_str_group_dict_etag_tuple_dict.pop(group_str, None)
         #
         return group_str_list
 
@@ -327,13 +665,11 @@ class FSAdmin(StorageAdmin):
     # Metadata/Groups
 
     def read_dict_from_file(self, abs_path_file_str):
-        if self.exists_file(abs_path_file_str):
-            data_str = self.read_str(abs_path_file_str)
-            #
-            if data_str is not None:
-                data_dict = ast.literal_eval(data_str)
-            else:
-                data_dict = {}
+        # read_str() returns None if the file does not exist (saves an extra round trip for exists_file() on S3/Azure Blob).
+        data_str = self.read_str(abs_path_file_str)
+        #
+        if data_str is not None:
+            data_dict = ast.literal_eval(data_str)
         else:
             data_dict = {}
         #
@@ -373,7 +709,8 @@ class FSAdmin(StorageAdmin):
     def get_group_state(self, group_str):
         group_dict = self.get_group_dict(group_str)
         #
-        state_str = group_dict["state"]
+        # Groups committed before any state has been set (the state is not encoded then) have the empty state.
+        state_str = group_dict.get("state", "")
         #
         return state_str
 
@@ -381,7 +718,9 @@ class FSAdmin(StorageAdmin):
         root_dir_str = self.storage_obj.root_dir()
         abs_path_file_str = os.path.join(root_dir_str, "groups", f"{group_str}")
         #
-        group_dict = self.read_dict_from_file(abs_path_file_str)
+        (group_bytes, etag) = self.read_bytes_etag(abs_path_file_str)
+        group_dict = decode_group_dict(group_bytes) if group_bytes is not None else {}
+        self.group_str_group_dict_etag_tuple_dict[group_str] = (copy_group_dict(group_dict), etag)
         #
         return group_dict
 
@@ -389,27 +728,153 @@ class FSAdmin(StorageAdmin):
         root_dir_str = self.storage_obj.root_dir()
         abs_path_file_str = os.path.join(root_dir_str, "groups", f"{group_str}")
         #
-        group_dict = self.read_dict_from_file(abs_path_file_str)
-        #
-        if "offsets" not in group_dict:
-            group_dict["offsets"] = {}
+        # Merge into the last read or written version of the group and replace it only if it is still the current one (compare-and-swap) - committing offsets is then a single (small) write. If someone else has changed the group in the meantime, read it again and retry.
+        if group_str not in self.group_str_group_dict_etag_tuple_dict:
+            self.get_group_dict(group_str)
         #
-        if "offsets" in new_group_dict:
-            for topic_str, offsets_dict in new_group_dict["offsets"].items():
-                if topic_str not in group_dict["offsets"]:
-                    group_dict["offsets"][topic_str] = {}
-                #
-                for partition_int, offset_int in offsets_dict.items():
-                    group_dict["offsets"][topic_str][partition_int] = offset_int
-        #
-        if "last_update" in new_group_dict:
-            group_dict["last_update"] = new_group_dict["last_update"]
-        else:
-            group_dict["last_update"] = get_millis()
-        #
-        if "state" in new_group_dict:
-            group_dict["state"] = new_group_dict["state"]
-        #
-        self.write_dict_to_file(abs_path_file_str, group_dict)
-        #
-        return group_dict
+        while True:
+            (group_dict, etag) = self.group_str_group_dict_etag_tuple_dict[group_str]
+            group_dict = copy_group_dict(group_dict)
+            #
+            if "offsets" not in group_dict:
+                group_dict["offsets"] = {}
+            #
+            if "offsets" in new_group_dict:
+                for topic_str, offsets_dict in new_group_dict["offsets"].items():
+                    if topic_str not in group_dict["offsets"]:
+                        group_dict["offsets"][topic_str] = {}
+                    #
+                    for partition_int, offset_int in offsets_dict.items():
+                        group_dict["offsets"][topic_str][partition_int] = offset_int
+            #
+            if "last_update" in new_group_dict:
+                group_dict["last_update"] = new_group_dict["last_update"]
+            else:
+                group_dict["last_update"] = get_millis()
+            #
+            if "state" in new_group_dict:
+                group_dict["state"] = new_group_dict["state"]
+            #
+            new_etag = self.write_bytes_if_match(abs_path_file_str, encode_group_dict(group_dict), etag)
+            if new_etag is not None:
+                self.group_str_group_dict_etag_tuple_dict[group_str] = (copy_group_dict(group_dict), new_etag)
+                return group_dict
+            #
+            self.get_group_dict(group_str)
+
+#
+
+def create_manifest_dict():
+    # Manifest of a topic: partition -> sorted list of segment tuples (start offset, end offset, start timestamp, end timestamp, size in bytes), and partition -> log start offset (see delete_records()).
+    return {"partitions": {}, "log_start_offsets": {}}
+
+
+def get_segment_tuple_list(manifest_dict, partition_int):
+    return manifest_dict["partitions"].get(partition_int, [])
+
+
+def get_partition_rel_file_str(partition_int, segment_tuple):
+    (start_offset_int, end_offset_int, start_timestamp_int, end_timestamp_int) = segment_tuple[:4]
+    # Compacted segments carry their generation as an additional (sixth) element.
+    if len(segment_tuple) > 5:
+        return f"{partition_int:09},{start_offset_int:021},{end_offset_int:021},{start_timestamp_int},{end_timestamp_int},{segment_tuple[5]}"
+    #
+    return f"{partition_int:09},{start_offset_int:021},{end_offset_int:021},{start_timestamp_int},{end_timestamp_int}"
+
+
+def get_partition_int_segment_tuple(rel_file_str):
+    rel_file_str_split_list = rel_file_str.split(",")
+    #
+    return (int(rel_file_str_split_list[0]), (int(rel_file_str_split_list[1]), int(rel_file_str_split_list[2]), int(rel_file_str_split_list[3]), int(rel_file_str_split_list[4])))
+
+
+def get_generation_int(rel_file_str):
+    rel_file_str_split_list = rel_file_str.split(",")
+    #
+    return int(rel_file_str_split_list[5]) if len(rel_file_str_split_list) > 5 else 0
+
+
+def get_watermark_offsets(manifest_dict, partition_int):
+    segment_tuple_list = get_segment_tuple_list(manifest_dict, partition_int)
+    log_start_offset_int = manifest_dict["log_start_offsets"].get(partition_int, 0)
+    #
+    if segment_tuple_list == []:
+        return (log_start_offset_int, log_start_offset_int)
+    #
+    return (max(segment_tuple_list[0][0], log_start_offset_int), segment_tuple_list[-1][1] + 1)
+
+
+def get_retention_tuple(config_dict):
+    # retention.ms/retention.bytes from the topic configuration (-1 = unlimited, or if cleanup.policy does not include "delete").
+    if "delete" not in get_cleanup_policy_str_list(config_dict):
+        return (-1, -1)
+    #
+    retention_ms_int = int(config_dict["retention.ms"]) if "retention.ms" in config_dict else -1
+    retention_bytes_int = int(config_dict["retention.bytes"]) if "retention.bytes" in config_dict else -1
+    #
+    return (retention_ms_int, retention_bytes_int)
+
+
+def get_cleanup_policy_str_list(config_dict):
+    # cleanup.policy from the topic configuration ("delete", "compact" or "compact,delete").
+    cleanup_policy_str = str(config_dict["cleanup.policy"]).lower() if "cleanup.policy" in config_dict else "delete"
+    #
+    return [cleanup_policy_str1.strip() for cleanup_policy_str1 in cleanup_policy_str.split(",")]
+
+
+def is_compacted(config_dict):
+    return "compact" in get_cleanup_policy_str_list(config_dict)
+
+#
+
+# Consumer groups are stored in a compact binary format: magic bytes, version (int8), last update (int64), length of the state (int16) followed by the state, number of topics (int32); then per topic the length of the topic name (int16), the number of partitions (int32) and the topic name, followed by one (partition (int32), offset (int64)) pair per partition.
+
+GROUP_MAGIC_BYTES = b"KGRP"
+GROUP_VERSION_INT = 1
+
+group_header_struct = struct.Struct(">bqhi")
+group_topic_struct = struct.Struct(">hi")
+group_offset_struct = struct.Struct(">iq")
+
+
+def encode_group_dict(group_dict):
+    state_bytes = group_dict["state"].encode("utf-8") if "state" in group_dict else b""
+    #
+    bytes_list = [GROUP_MAGIC_BYTES, group_header_struct.pack(GROUP_VERSION_INT, group_dict.get("last_update", 0), len(state_bytes), len(group_dict["offsets"])), state_bytes]
+    for topic_str, offsets_dict in group_dict["offsets"].items():
+        topic_bytes = topic_str.encode("utf-8")
+        bytes_list.append(group_topic_struct.pack(len(topic_bytes), len(offsets_dict)))
+        bytes_list.append(topic_bytes)
+        bytes_list += [group_offset_struct.pack(partition_int, offset_int) for partition_int, offset_int in offsets_dict.items()]
+    #
+    return b"".join(bytes_list)
+
+
+def decode_group_dict(group_bytes):
+    # Groups written before the binary format was introduced are repr() dicts.
+    if not group_bytes.startswith(GROUP_MAGIC_BYTES):
+        return ast.literal_eval(group_bytes.decode("utf-8"))
+    #
+    position_int = len(GROUP_MAGIC_BYTES)
+    (_, last_update_int, state_length_int, topics_int) = group_header_struct.unpack_from(group_bytes, position_int)
+    position_int += group_header_struct.size
+    #
+    group_dict = {"offsets": {}, "last_update": last_update_int}
+    if state_length_int > 0:
+        group_dict["state"] = group_bytes[position_int:position_int + state_length_int].decode("utf-8")
+        position_int += state_length_int
+    #
+    for _ in range(topics_int):
+        (topic_length_int, partitions_int) = group_topic_struct.unpack_from(group_bytes, position_int)
+        position_int += group_topic_struct.size
+        topic_str = group_bytes[position_int:position_int + topic_length_int].decode("utf-8")
+        position_int += topic_length_int
+        #
+        group_dict["offsets"][topic_str] = dict(group_offset_struct.iter_unpack(group_bytes[position_int:position_int + partitions_int * group_offset_struct.size]))
+        position_int += partitions_int * group_offset_struct.size
+    #
+    return group_dict
+
+
+def copy_group_dict(group_dict):
+    return {**group_dict, "offsets": {topic_str: dict(offsets_dict) for topic_str, offsets_dict in group_dict["offsets"].items()}} if "offsets" in group_dict else dict(group_dict)
@@ -1,7 +1,10 @@
-import ast
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import os
 
 from kafi.storage_consumer import StorageConsumer
+from kafi.fs.fs_admin import get_partition_int_segment_tuple, get_segment_tuple_list, get_watermark_offsets
+from kafi.helpers import get_millis
 
 # Constants
 
@@ -25,124 +28,291 @@ class FSConsumer(StorageConsumer):
         group_dict["state"] = "stable"
         # Persist the new or updated consumer group.
         self.storage_obj.admin.set_group_dict(self.group_str, group_dict)
+        #
+        # Cached manifests of the topics (only re-read if the consumer has reached the end of a partition known to the cached manifest).
+        self.topic_str_manifest_dict_dict = {}
+        #
+        # Thread pool for prefetching partition files (created on first use).
+        self.prefetch_threadPoolExecutor = None
+        # The partition files prefetched (and the partition file partially decoded) per topic, kept across consume_impl() calls (see consume_impl()).
+        self.topic_str_prefetch_state_dict = {}
+        #
+        # If zero_copy == True, keys and values are returned as memoryview slices of the (memory-mapped) partition files instead of bytes (for key/value type "bytes"; "str" is decoded from them directly).
+        self.zero_copy_bool = kwargs["zero_copy"] if "zero_copy" in kwargs else False
+        #
+        # If enable.auto.commit == True, commit the offsets at most every auto.commit.interval.ms (and on close()) instead of after each message.
+        self.auto_commit_interval_ms_int = int(self.consumer_config_dict["auto.commit.interval.ms"]) if "auto.commit.interval.ms" in self.consumer_config_dict else fs_obj.auto_commit_interval_ms()
+        self.last_auto_commit_int = get_millis()
+        self.uncommitted_bool = False
             
     #
 
     def close(self):
+        for prefetch_state_dict in self.topic_str_prefetch_state_dict.values():
+            prefetch_state_dict["message_generator_generator"].close()
+        self.topic_str_prefetch_state_dict = {}
+        #
+        if self.prefetch_threadPoolExecutor is not None:
+            self.prefetch_threadPoolExecutor.shutdown(cancel_futures=True)
+            self.prefetch_threadPoolExecutor = None
+        #
         new_group_dict = {"state": "empty"}
+        # Commit the offsets not yet auto-committed together with the new state.
+        if self.enable_auto_commit_bool and self.uncommitted_bool:
+            new_group_dict["offsets"] = self.topic_str_next_offsets_dict_dict
         self.storage_obj.admin.set_group_dict(self.group_str, new_group_dict)
         #
         return self.topic_str_list
 
     #
+
+    def seek(self, topic_str, partition_int, offset_int):
+        self.topic_str_next_offsets_dict_dict[topic_str][partition_int] = offset_int
+        # Drop the partition files prefetched from the previous position.
+        prefetch_state_dict = self.topic_str_prefetch_state_dict.pop(topic_str, None)
+        if prefetch_state_dict is not None:
+            prefetch_state_dict["message_generator_generator"].close()
+
+    #
   
     def consume_impl(self, **kwargs):
         n_int = kwargs["n"] if "n" in kwargs and kwargs["n"] != ALL_MESSAGES else 1
         #
         auto_offset_reset_str = self.consumer_config_dict["auto.offset.reset"]
         #
-        rel_file_str_list = []
         m_list = []
         message_counter_int = 0
-        # Consume the topics sequentially. TODO: Do it in parallel?
+        group_dict = None
+        # Consume the topics sequentially (the partition files of each topic are prefetched in parallel, see prefetch_partition_files()).
         for topic_str in self.topic_str_list:
             partition_int_list = self.topic_str_partition_int_list_dict[topic_str]
-            # Get the start offsets.
-            start_offsets_dict = {partition_int: offset_int for partition_int, offset_int in self.topic_str_next_offsets_dict_dict[topic_str].items() if partition_int in partition_int_list}
-            # If any start offset is not explicitly set, turn to the consumer group.
-            if any(start_offsets_dict[partition_int] == OFFSET_INVALID for partition_int in partition_int_list):
-                group_dict = self.storage_obj.admin.get_group_dict(self.group_str)["offsets"]
-                group_offsets_dict = group_dict.get(topic_str, {})
-                #
-                for partition_int, offset_int in group_offsets_dict.items():
-                    if offset_int != OFFSET_INVALID:
-                        start_offsets_dict[partition_int] = offset_int
-            # If there is still any offset not explicitly set, turn to auto.offset.reset.
-            if any(start_offsets_dict[partition_int] == OFFSET_INVALID for partition_int in partition_int_list):
-                # If auto.offset.reset == "latest", get the watermarks to be able to obtain the latest offsets for each partition (do it once here already for all partitions to save Kafka API calls).
-                if auto_offset_reset_str.lower() == "latest":
-                    partition_int_offset_tuple_dict = self.watermarks(topic_str, **kwargs)[topic_str]
-                # Iterate through the offsets of the partitions.
-                for partition_int, offset_int in start_offsets_dict.items():
-                    # If the partition does not have a committed offset yet, make use of auto.offset.reset.
-                    if offset_int == OFFSET_INVALID:
-                        if auto_offset_reset_str.lower() == "latest":
-                            # ...and if auto.offset.reset == latest, start offset = last offset.
-                            start_offsets_dict[partition_int] = partition_int_offset_tuple_dict[partition_int][1]
-                        elif auto_offset_reset_str.lower() == "earliest":
-                            # ...or if auto.offset.reset == earliest, start offset = 0.
-                            start_offsets_dict[partition_int] = 0
-                        else:
-                            raise Exception("Only \"earliest\" and \"latest\" supported for \"auto.offset.reset\".")
-            # Set the next offsets dict for the topic (for further foldl() calls).
-            self.topic_str_next_offsets_dict_dict[topic_str] = start_offsets_dict.copy()
-            #
-            # Get partition files for the partitions to be consumed.
-            partition_int_rel_file_str_list_dict = self.storage_obj.admin.get_partition_files(topic_str, [partition_int for partition_int in partition_int_list])
-            #
-            # Get first partition files for all partitions.
-            partition_int_first_partition_rel_file_str_dict = {partition_int: self.storage_obj.admin.find_partition_file_str_by_offset(topic_str, partition_int, offset_int) for partition_int, offset_int in start_offsets_dict.items()}
-            #
-            # Filter out partitions not corresponding to any file listed by get_partition_files() above.
-            partition_int_first_partition_rel_file_str_dict = {partition_int: first_partition_rel_file_str for partition_int, first_partition_rel_file_str in partition_int_first_partition_rel_file_str_dict.items() if first_partition_rel_file_str is not None}
+            # Continue with the partition files prefetched (and the partition file partially decoded) by the previous call unless the consumer has been moved in the meantime (seek(), rewind(), last_n).
+            prefetch_state_dict = self.topic_str_prefetch_state_dict.pop(topic_str, None)
+            if prefetch_state_dict is not None and prefetch_state_dict["next_offsets"] != self.topic_str_next_offsets_dict_dict[topic_str]:
+                prefetch_state_dict["message_generator_generator"].close()
+                prefetch_state_dict = None
+            # ...or unless any of its (closed) segments has been deleted or compacted in the meantime (the active segments are only renamed by producers, see get_current_partition_file_str()).
+            if prefetch_state_dict is not None:
+                manifest_dict = self.get_manifest(topic_str, refresh=True)
+                if any(segment_tuple not in get_segment_tuple_list(manifest_dict, partition_int) for partition_int, segment_tuple_list in prefetch_state_dict["segment_tuple_lists"].items() for segment_tuple in segment_tuple_list):
+                    prefetch_state_dict["message_generator_generator"].close()
+                    prefetch_state_dict = None
+                else:
+                    # Do not return the records before the (new) low watermark from the partition files already read.
+                    for partition_int, offset_int in prefetch_state_dict["start_offsets"].items():
+                        prefetch_state_dict["start_offsets"][partition_int] = max(offset_int, get_watermark_offsets(manifest_dict, partition_int)[0])
             #
-            # Get all partition files to be consumed for all partitions.
-            partition_int_to_be_consume_rel_file_str_list_dict = {partition_int: [rel_file_str for rel_file_str in rel_file_str_list if partition_int in partition_int_first_partition_rel_file_str_dict and rel_file_str >= partition_int_first_partition_rel_file_str_dict[partition_int]] for partition_int, rel_file_str_list in partition_int_rel_file_str_list_dict.items()}
+            if prefetch_state_dict is None:
+                # Get the start offsets.
+                start_offsets_dict = {partition_int: offset_int for partition_int, offset_int in self.topic_str_next_offsets_dict_dict[topic_str].items() if partition_int in partition_int_list}
+                # If any start offset is not explicitly set, turn to the consumer group.
+                if any(start_offsets_dict[partition_int] == OFFSET_INVALID for partition_int in partition_int_list):
+                    # Read the consumer group at most once per call (only needed until all start offsets are set).
+                    if group_dict is None:
+                        group_dict = self.storage_obj.admin.get_group_dict(self.group_str)
+                    group_offsets_dict = group_dict["offsets"].get(topic_str, {})
+                    #
+                    for partition_int, offset_int in group_offsets_dict.items():
+                        if offset_int != OFFSET_INVALID:
+                            start_offsets_dict[partition_int] = offset_int
+                # If there is still any offset not explicitly set, turn to auto.offset.reset.
+                if any(start_offsets_dict[partition_int] == OFFSET_INVALID for partition_int in partition_int_list):
+                    # If auto.offset.reset == "latest", get the watermarks to be able to obtain the latest offsets for each partition (do it once here already for all partitions to save Kafka API calls).
+                    if auto_offset_reset_str.lower() == "latest":
+                        manifest_dict = self.get_manifest(topic_str, refresh=True)
+                        partition_int_offset_tuple_dict = {partition_int: get_watermark_offsets(manifest_dict, partition_int) for partition_int in partition_int_list}
+                    # Iterate through the offsets of the partitions.
+                    for partition_int, offset_int in start_offsets_dict.items():
+                        # If the partition does not have a committed offset yet, make use of auto.offset.reset.
+                        if offset_int == OFFSET_INVALID:
+                            if auto_offset_reset_str.lower() == "latest":
+                                # ...and if auto.offset.reset == latest, start offset = last offset.
+                                start_offsets_dict[partition_int] = partition_int_offset_tuple_dict[partition_int][1]
+                            elif auto_offset_reset_str.lower() == "earliest":
+                                # ...or if auto.offset.reset == earliest, start offset = 0 (moved to the low watermark below).
+                                start_offsets_dict[partition_int] = 0
+                            else:
+                                raise Exception("Only \"earliest\" and \"latest\" supported for \"auto.offset.reset\".")
+                # Get the manifest of the topic (from the cache if no partition has been consumed up to its end yet).
+                manifest_dict = self.get_manifest(topic_str, start_offsets_dict)
+                # Start at the low watermark if the records before the start offset have been deleted (retention/delete_records()).
+                for partition_int, offset_int in start_offsets_dict.items():
+                    start_offsets_dict[partition_int] = max(offset_int, get_watermark_offsets(manifest_dict, partition_int)[0])
+                # Set the next offsets dict for the topic (for further foldl() calls).
+                self.topic_str_next_offsets_dict_dict[topic_str] = start_offsets_dict.copy()
+                #
+                # Get partition files for the partitions to be consumed.
+                partition_int_rel_file_str_list_dict = self.storage_obj.admin.get_partition_files(topic_str, [partition_int for partition_int in partition_int_list], manifest_dict=manifest_dict)
+                #
+                # Get first partition files for all partitions.
+                partition_int_first_partition_rel_file_str_dict = {partition_int: self.storage_obj.admin.find_partition_file_str_by_offset(topic_str, partition_int, offset_int, manifest_dict=manifest_dict) for partition_int, offset_int in start_offsets_dict.items()}
+                #
+                # Filter out partitions not corresponding to any file listed by get_partition_files() above.
+                partition_int_first_partition_rel_file_str_dict = {partition_int: first_partition_rel_file_str for partition_int, first_partition_rel_file_str in partition_int_first_partition_rel_file_str_dict.items() if first_partition_rel_file_str is not None}
+                #
+                # Get all partition files to be consumed for all partitions.
+                partition_int_to_be_consume_rel_file_str_list_dict = {partition_int: [rel_file_str for rel_file_str in rel_file_str_list if partition_int in partition_int_first_partition_rel_file_str_dict and rel_file_str >= partition_int_first_partition_rel_file_str_dict[partition_int]] for partition_int, rel_file_str_list in partition_int_rel_file_str_list_dict.items()}
+                #
+                # Create list of partition files to read.
+                rel_file_str_list = []
+                file_counter_int = 0
+                max_num_files_int = max([len(to_be_consume_rel_file_str_list) for to_be_consume_rel_file_str_list in partition_int_to_be_consume_rel_file_str_list_dict.values()])
+                #
+                for file_counter_int in range(max_num_files_int):
+                    for partition_int in partition_int_list:
+                        if partition_int in partition_int_to_be_consume_rel_file_str_list_dict:
+                            if len(partition_int_to_be_consume_rel_file_str_list_dict[partition_int]) > file_counter_int:
+                                rel_file_str_list.append(partition_int_to_be_consume_rel_file_str_list_dict[partition_int][file_counter_int])
+                #
+                #
+                prefetch_state_dict = {"start_offsets": start_offsets_dict,
+                                       "message_generator_generator": self.prefetch_partition_files(topic_str, rel_file_str_list, start_offsets_dict),
+                                       "message_generator": None,
+                                       "next_offsets": None,
+                                       "segment_tuple_lists": {partition_int: get_segment_tuple_list(manifest_dict, partition_int)[:-1] for partition_int in partition_int_list}}
             #
-            # Create list of partition files to read.
-            file_counter_int = 0
-            max_num_files_int = max([len(to_be_consume_rel_file_str_list) for to_be_consume_rel_file_str_list in partition_int_to_be_consume_rel_file_str_list_dict.values()])
             #
-            for file_counter_int in range(max_num_files_int):
-                for partition_int in partition_int_list:
-                    if partition_int in partition_int_to_be_consume_rel_file_str_list_dict:
-                        if len(partition_int_to_be_consume_rel_file_str_list_dict[partition_int]) > file_counter_int:
-                            rel_file_str_list.append(partition_int_to_be_consume_rel_file_str_list_dict[partition_int][file_counter_int])
+            start_offsets_dict = prefetch_state_dict["start_offsets"]
+            message_generator_generator = prefetch_state_dict["message_generator_generator"]
+            message_generator = prefetch_state_dict["message_generator"]
             #
-            abs_topic_dir_str = self.storage_obj.admin.get_topic_abs_path_str(topic_str)
             break_bool = False
-            for rel_file_str in rel_file_str_list:
-                if break_bool:
-                    break
-                #
-                messages_bytes = self.storage_obj.admin.read_bytes(os.path.join(abs_topic_dir_str, "partitions", rel_file_str))
-                #
-                message_bytes_list = messages_bytes.split(b"\n")[:-1]
-                #
-                for message_bytes in message_bytes_list:
-                    m = ast.literal_eval(message_bytes.decode("utf-8"))
-                    #
-                    partition_int = m["partition"]
-                    offset_int = m["offset"]
-                    self.topic_str_next_offsets_dict_dict[topic_str][partition_int] = offset_int + 1
-                    if self.enable_auto_commit_bool:
-                        # Commit immediately after reading the message if enable.auto.commit == True
-                        self.commit()
-                    #
-                    if self.topic_str_end_offsets_dict_dict is not None and topic_str in self.topic_str_end_offsets_dict_dict:
-                        end_offsets_dict = self.topic_str_end_offsets_dict_dict[topic_str]
-                        if offset_int > end_offsets_dict[partition_int]:
-                            break_bool = True
+            try:
+                while True:
+                    if message_generator is None:
+                        message_generator = next(message_generator_generator, None)
+                        if message_generator is None:
                             break
                     #
-                    if offset_int >= start_offsets_dict[partition_int]:
-                        m_list.append(m)
+                    for m in message_generator:
+                        partition_int = m["partition"]
+                        offset_int = m["offset"]
+                        self.topic_str_next_offsets_dict_dict[topic_str][partition_int] = offset_int + 1
+                        self.uncommitted_bool = True
                         #
-                        message_counter_int += 1
-                    #
-                    if self.topic_str_end_offsets_dict_dict is not None and topic_str in self.topic_str_end_offsets_dict_dict:
-                        end_offsets_dict = self.topic_str_end_offsets_dict_dict[topic_str]
-                        offsets_dict = self.topic_str_next_offsets_dict_dict[topic_str]
-                        if all(offsets_dict[partition_int] > end_offset_int for partition_int, end_offset_int in end_offsets_dict.items() if partition_int in offsets_dict):
+                        if self.topic_str_end_offsets_dict_dict is not None and topic_str in self.topic_str_end_offsets_dict_dict:
+                            end_offsets_dict = self.topic_str_end_offsets_dict_dict[topic_str]
+                            if offset_int > end_offsets_dict[partition_int]:
+                                break_bool = True
+                                break
+                        #
+                        if offset_int >= start_offsets_dict[partition_int]:
+                            m_list.append(m)
+                            #
+                            message_counter_int += 1
+                        #
+                        if self.topic_str_end_offsets_dict_dict is not None and topic_str in self.topic_str_end_offsets_dict_dict:
+                            end_offsets_dict = self.topic_str_end_offsets_dict_dict[topic_str]
+                            offsets_dict = self.topic_str_next_offsets_dict_dict[topic_str]
+                            if all(offsets_dict[partition_int] > end_offset_int for partition_int, end_offset_int in end_offsets_dict.items() if partition_int in offsets_dict):
+                                break_bool = True
+                                break
+                        #
+                        if n_int != ALL_MESSAGES and message_counter_int >= n_int:
                             break_bool = True
                             break
-                    #
-                    if n_int != ALL_MESSAGES and message_counter_int >= n_int:
-                        break_bool = True
+                    # Stop before waiting for the next (prefetched) partition file.
+                    if break_bool:
                         break
+                    message_generator = None
+            except Exception as e:
+                message_generator_generator.close()
+                raise e
+            #
+            if break_bool:
+                # Keep the prefetched partition files and the rest of the current one for the next call.
+                prefetch_state_dict["message_generator"] = message_generator
+                prefetch_state_dict["next_offsets"] = self.topic_str_next_offsets_dict_dict[topic_str].copy()
+                self.topic_str_prefetch_state_dict[topic_str] = prefetch_state_dict
+            else:
+                message_generator_generator.close()
+        #
+        if self.enable_auto_commit_bool and self.uncommitted_bool and get_millis() - self.last_auto_commit_int >= self.auto_commit_interval_ms_int:
+            self.commit()
         #
         return m_list
 
+    def prefetch_partition_files(self, topic_str, rel_file_str_list, start_offsets_dict):
+        # Download up to prefetch.depth partition files (and at most prefetch.max.bytes of not yet consumed partition files) ahead in background threads while the current one is decoded. The partition files are yielded in the order of rel_file_str_list, i.e. the order of the messages within each partition is preserved.
+        prefetch_depth_int = self.storage_obj.prefetch_depth()
+        prefetch_max_bytes_int = self.storage_obj.prefetch_max_bytes()
+        #
+        def skip_deleted_partition_file(rel_file_str):
+            # Do not return the records before the (new) low watermark from the following partition files.
+            partition_int = int(rel_file_str.split(",")[0])
+            low_offset_int = get_watermark_offsets(self.get_manifest(topic_str), partition_int)[0]
+            start_offsets_dict[partition_int] = max(start_offsets_dict[partition_int], low_offset_int)
+        #
+        def read_partition_file_bytes(rel_file_str):
+            # Seek into the partition file via its sparse index if the start offset is within it.
+            try:
+                return self.storage_obj.admin.read_partition_file_bytes(topic_str, rel_file_str, offset_int=start_offsets_dict[int(rel_file_str.split(",")[0])])
+            except Exception as e:
+                current_rel_file_str = self.get_current_partition_file_str(topic_str, rel_file_str)
+                if current_rel_file_str is None:
+                    # The partition file has been deleted in the meantime (retention/delete_records()).
+                    skip_deleted_partition_file(rel_file_str)
+                    return (b"", True)
+                elif current_rel_file_str == rel_file_str:
+                    raise e
+                #
+                return self.storage_obj.admin.read_partition_file_bytes(topic_str, current_rel_file_str, offset_int=start_offsets_dict[int(rel_file_str.split(",")[0])])
+        #
+        if prefetch_depth_int <= 0:
+            # Without prefetching, stream the partition files one after another.
+            topic_abs_dir_str = self.storage_obj.admin.get_topic_abs_path_str(topic_str)
+            for rel_file_str in rel_file_str_list:
+                if not self.storage_obj.admin.exists_file(os.path.join(topic_abs_dir_str, "partitions", rel_file_str)):
+                    current_rel_file_str = self.get_current_partition_file_str(topic_str, rel_file_str)
+                    if current_rel_file_str is None:
+                        skip_deleted_partition_file(rel_file_str)
+                        continue
+                    rel_file_str = current_rel_file_str
+                #
+                yield self.storage_obj.admin.read_partition_file(topic_str, rel_file_str, offset_int=start_offsets_dict[int(rel_file_str.split(",")[0])], copy_bool=not self.zero_copy_bool)
+            return
+        #
+        if self.prefetch_threadPoolExecutor is None:
+            self.prefetch_threadPoolExecutor = ThreadPoolExecutor(max_workers=prefetch_depth_int)
+        #
+        def get_prefetched_bytes_int(rel_file_str_future_tuple_deque):
+            return sum(len(future.result()[0]) for _, future in rel_file_str_future_tuple_deque if future.done() and future.exception() is None)
+        #
+        rel_file_str_future_tuple_deque = deque()
+        next_int = 0
+        try:
+            while next_int < len(rel_file_str_list) or len(rel_file_str_future_tuple_deque) > 0:
+                while next_int < len(rel_file_str_list) and len(rel_file_str_future_tuple_deque) < prefetch_depth_int and get_prefetched_bytes_int(rel_file_str_future_tuple_deque) < prefetch_max_bytes_int:
+                    rel_file_str = rel_file_str_list[next_int]
+                    rel_file_str_future_tuple_deque.append((rel_file_str, self.prefetch_threadPoolExecutor.submit(read_partition_file_bytes, rel_file_str)))
+                    next_int += 1
+                #
+                (rel_file_str, future) = rel_file_str_future_tuple_deque.popleft()
+                (partition_file_bytes, ranged_bool) = future.result()
+                #
+                yield self.storage_obj.admin.decode_partition_file_bytes(topic_str, rel_file_str, partition_file_bytes, ranged_bool, copy_bool=not self.zero_copy_bool)
+        finally:
+            for _, future in rel_file_str_future_tuple_deque:
+                future.cancel()
+
+    def get_current_partition_file_str(self, topic_str, rel_file_str):
+        # The last partition file of a partition is the active segment of a producer and renamed whenever messages are appended to it. If it has been renamed since the manifest was cached, look up its current name in the re-read manifest. Returns None if the partition file has been deleted since the manifest was cached.
+        (partition_int, segment_tuple) = get_partition_int_segment_tuple(rel_file_str)
+        #
+        manifest_dict = self.get_manifest(topic_str, refresh=True)
+        current_rel_file_str = self.storage_obj.admin.find_partition_file_str_by_offset(topic_str, partition_int, segment_tuple[0], manifest_dict=manifest_dict)
+        #
+        return current_rel_file_str
+
+    def get_manifest(self, topic_str, offsets_dict={}, refresh=False):
+        manifest_dict = self.topic_str_manifest_dict_dict.get(topic_str)
+        #
+        if refresh or manifest_dict is None or any(offset_int >= get_watermark_offsets(manifest_dict, partition_int)[1] for partition_int, offset_int in offsets_dict.items()):
+            manifest_dict = self.storage_obj.admin.get_manifest(topic_str)
+            self.topic_str_manifest_dict_dict[topic_str] = manifest_dict
+        #
+        return manifest_dict
+
     #
 
     def offsets(self):
@@ -172,5 +342,7 @@ class FSConsumer(StorageConsumer):
             new_group_dict = {"offsets": topic_str_offsets_dict_dict}
         #
         self.storage_obj.admin.set_group_dict(self.group_str, new_group_dict)
+        self.last_auto_commit_int = get_millis()
+        self.uncommitted_bool = False
         #
         return topic_str_offsets_dict_dict
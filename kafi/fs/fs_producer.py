@@ -1,6 +1,9 @@
+import ast
 import os
 
 from kafi.storage_producer import StorageProducer
+from kafi.fs.fs_admin import get_partition_rel_file_str, get_retention_tuple, get_segment_tuple_list, get_watermark_offsets, is_compacted
+from kafi.fs.fs_segment import COMPRESSION_TYPE_STR_ID_INT_DICT, INDEX_SUFFIX_STR, create_segment_state_dict, encode_records, encode_segment_header
 from kafi.helpers import get_millis, default_partitioner
 
 # Constants
@@ -20,21 +23,40 @@ class FSProducer(StorageProducer):
         #
         if not fs_obj.exists(self.topic_str):
             fs_obj.create(self.topic_str)
+        #
+        # The active segments of the partitions (new messages are appended to them until they are rolled).
+        self.partition_int_active_segment_dict_dict = {}
+        # segment.bytes/segment.ms from the topic configuration, or from the kafi section of the storage configuration.
+        config_dict = fs_obj.admin.get_config(self.topic_str)
+        self.segment_bytes_int = int(config_dict["segment.bytes"]) if "segment.bytes" in config_dict else fs_obj.segment_bytes()
+        self.segment_ms_int = int(config_dict["segment.ms"]) if "segment.ms" in config_dict else fs_obj.segment_ms()
+        # Without appends (S3, Azure Blob Storage), the active segment is uploaded as a whole on every produce - keep it small (segment.rewrite.bytes) and roll it after a few appends (segment.rewrite.appends) to bound the uploaded bytes (and the memory for the active segments).
+        if not fs_obj.admin.append_bool:
+            self.segment_bytes_int = min(self.segment_bytes_int, int(config_dict["segment.rewrite.bytes"]) if "segment.rewrite.bytes" in config_dict else fs_obj.segment_rewrite_bytes())
+            self.segment_rewrite_appends_int = int(config_dict["segment.rewrite.appends"]) if "segment.rewrite.appends" in config_dict else fs_obj.segment_rewrite_appends()
+        else:
+            self.segment_rewrite_appends_int = None
+        # compression.type from the topic configuration.
+        self.compression_type_str = str(config_dict["compression.type"]).lower() if "compression.type" in config_dict else "none"
+        if self.compression_type_str not in COMPRESSION_TYPE_STR_ID_INT_DICT:
+            raise Exception("Only \"none\", \"gzip\", \"lz4\" and \"zstd\" supported for \"compression.type\".")
+        # retention.ms/retention.bytes from the topic configuration (enforced whenever the producer updates the manifest).
+        (self.retention_ms_int, self.retention_bytes_int) = get_retention_tuple(config_dict)
+        # cleanup.policy=compact from the topic configuration (the closed segments are compacted in the background whenever a new segment is started).
+        self.compacted_bool = is_compacted(config_dict)
 
     #
 
     def produce_impl(self, m_list, **kwargs):
-        partition_int_offsets_tuple_dict = self.storage_obj.watermarks(self.topic_str)[self.topic_str]
-        last_offsets_dict = {partition_int: offsets_tuple[1] for partition_int, offsets_tuple in partition_int_offsets_tuple_dict.items()}
-        #
         partition_int_m_list_dict = {partition_int: [] for partition_int in range(self.partitions_int)}
-        partition_int_offset_counter_int_dict = {partition_int: last_offset_int if last_offset_int > 0 else 0 for partition_int, last_offset_int in last_offsets_dict.items()}
         #
         counter_int = 0
         for m in m_list:
             timestamp = m["timestamp"]
             if timestamp == CURRENT_TIME:
                 timestamp = (TIMESTAMP_CREATE_TIME, get_millis())
+            elif not isinstance(timestamp, tuple):
+                timestamp = (TIMESTAMP_CREATE_TIME, timestamp)
             #
             partition_int = self.partitioner_fun(m, counter_int, self.partitions_int, self.projection_fun)
             #
@@ -44,27 +66,177 @@ class FSProducer(StorageProducer):
                             "timestamp": timestamp,
                             "headers": m["headers"],
                             "partition": partition_int,
-                            "offset": partition_int_offset_counter_int_dict[partition_int]}
+                            "offset": None}
             #
             partition_int_m_list_dict[partition_int].append(m)
+        #
+        partition_int_m_list_dict = {partition_int: m_list for partition_int, m_list in partition_int_m_list_dict.items() if m_list != []}
+        if partition_int_m_list_dict == {}:
+            return
+        # Optimistic concurrency control (several producers - also in different processes - can write to the same topic without a lock): the offsets are assigned from the current manifest, the partition files are written under new names (never replacing existing files), and the manifest is only replaced if nobody else has replaced it in the meantime. Otherwise, the changes are applied to the new manifest if nobody else has written to the same partitions, or the partition files are reverted and the messages are written again with new offsets.
+        while True:
+            (manifest_dict, etag) = self.storage_obj.admin.get_manifest_etag(self.topic_str)
+            #
+            # The active segments of the partitions are restored if the messages have to be written again.
+            partition_int_active_segment_dict_dict = {partition_int: copy_active_segment_dict(active_segment_dict) for partition_int, active_segment_dict in self.partition_int_active_segment_dict_dict.items()}
+            #
+            obsolete_abs_path_file_str_list = []
+            partition_int_segment_tuple_change_list_dict = {}
+            revert_tuple_list = []
+            written_bool = self.write_partitions(partition_int_m_list_dict, manifest_dict, obsolete_abs_path_file_str_list, partition_int_segment_tuple_change_list_dict, revert_tuple_list)
             #
-            partition_int_offset_counter_int_dict[partition_int] += 1
+            committed_bool = False
+            while written_bool:
+                # Update the manifest only after the partition files have been written so that readers never see segments which do not exist yet.
+                (new_manifest_dict, expired_abs_path_file_str_list) = self.apply_segment_tuple_changes(manifest_dict, partition_int_segment_tuple_change_list_dict)
+                if self.storage_obj.admin.commit_manifest(self.topic_str, new_manifest_dict, etag) is not None:
+                    committed_bool = True
+                    break
+                #
+                (current_manifest_dict, etag) = self.storage_obj.admin.get_manifest_etag(self.topic_str)
+                # Others have only changed other partitions or other segments (e.g. delete_records(), compaction)? Then apply the changes to the current manifest.
+                if any(get_segment_tuple_list(current_manifest_dict, partition_int)[-1:] != get_segment_tuple_list(manifest_dict, partition_int)[-1:] for partition_int in partition_int_m_list_dict.keys()):
+                    break
+                manifest_dict = current_manifest_dict
+            #
+            if committed_bool:
+                break
+            #
+            for abs_path_file_str, previous_abs_path_file_str, previous_size_int in reversed(revert_tuple_list):
+                if previous_size_int is None:
+                    self.storage_obj.admin.delete_file(abs_path_file_str)
+                else:
+                    self.storage_obj.admin.revert_partition_file(abs_path_file_str, previous_abs_path_file_str, previous_size_int)
+            self.partition_int_active_segment_dict_dict = partition_int_active_segment_dict_dict
+        # Only delete the previous versions of the active segments and the expired segments afterwards.
+        for obsolete_abs_path_file_str in obsolete_abs_path_file_str_list:
+            self.storage_obj.admin.delete_file(obsolete_abs_path_file_str)
+        self.storage_obj.admin.delete_partition_files(expired_abs_path_file_str_list)
         #
-        topic_abs_dir_str = self.storage_obj.admin.get_topic_abs_path_str(self.topic_str)
+        if self.compacted_bool and any(previous_segment_tuple is None for segment_tuple_change_list in partition_int_segment_tuple_change_list_dict.values() for previous_segment_tuple, _ in segment_tuple_change_list):
+            self.storage_obj.admin.compact_log_in_background(self.topic_str)
+
+    def write_partitions(self, partition_int_m_list_dict, manifest_dict, obsolete_abs_path_file_str_list, partition_int_segment_tuple_change_list_dict, revert_tuple_list):
         for partition_int, m_list in partition_int_m_list_dict.items():
-            if len(m_list) > 0:
-                start_timestamp_int = m_list[0]["timestamp"][1]
-                end_timestamp_int = m_list[-1]["timestamp"][1]
-                #
-                messages_bytes = b""
-                for m in m_list:
-                    start_offset_int = last_offsets_dict[partition_int]
-                    end_offset_int = start_offset_int + len(m_list) - 1
-                    #
-                    abs_path_file_str = os.path.join(topic_abs_dir_str, "partitions", f"{partition_int:09},{start_offset_int:021},{end_offset_int:021},{start_timestamp_int},{end_timestamp_int}")
-                    #
-                    message_bytes = str(m).encode("utf-8") + b"\n"
-                    #
-                    messages_bytes += message_bytes
-                #
-                self.storage_obj.admin.write_bytes(abs_path_file_str, messages_bytes)
+            segment_tuple_list = get_segment_tuple_list(manifest_dict, partition_int)
+            # Only append to the active segment if nobody else has written to the partition since (or else start a new segment).
+            active_segment_dict = self.partition_int_active_segment_dict_dict.get(partition_int)
+            if active_segment_dict is not None and segment_tuple_list[-1:] != [active_segment_dict["segment_tuple"]]:
+                del self.partition_int_active_segment_dict_dict[partition_int]
+            #
+            high_offset_int = get_watermark_offsets(manifest_dict, partition_int)[1]
+            for i, m in enumerate(m_list):
+                m["offset"] = high_offset_int + i
+            #
+            while len(m_list) > 0:
+                count_int = self.append_to_active_segment(partition_int, m_list, obsolete_abs_path_file_str_list, partition_int_segment_tuple_change_list_dict, revert_tuple_list)
+                if count_int is None:
+                    # Another producer has written the same offsets in the meantime.
+                    return False
+                m_list = m_list[count_int:]
+        #
+        return True
+
+    def apply_segment_tuple_changes(self, manifest_dict, partition_int_segment_tuple_change_list_dict):
+        new_manifest_dict = ast.literal_eval(str(manifest_dict))
+        #
+        for partition_int, segment_tuple_change_list in partition_int_segment_tuple_change_list_dict.items():
+            segment_tuple_list = new_manifest_dict["partitions"].setdefault(partition_int, [])
+            for previous_segment_tuple, segment_tuple in segment_tuple_change_list:
+                if previous_segment_tuple in segment_tuple_list:
+                    segment_tuple_list[segment_tuple_list.index(previous_segment_tuple)] = segment_tuple
+                else:
+                    segment_tuple_list.append(segment_tuple)
+        #
+        expired_abs_path_file_str_list = []
+        if self.retention_ms_int >= 0 or self.retention_bytes_int >= 0:
+            for partition_int in partition_int_segment_tuple_change_list_dict.keys():
+                expired_abs_path_file_str_list += self.storage_obj.admin.delete_segments(self.topic_str, new_manifest_dict, partition_int, retention_ms_int=self.retention_ms_int, retention_bytes_int=self.retention_bytes_int)
+        #
+        return (new_manifest_dict, expired_abs_path_file_str_list)
+
+    def append_to_active_segment(self, partition_int, m_list, obsolete_abs_path_file_str_list, partition_int_segment_tuple_change_list_dict, revert_tuple_list):
+        topic_abs_dir_str = self.storage_obj.admin.get_topic_abs_path_str(self.topic_str)
+        #
+        # Roll the active segment if it is full or too old.
+        active_segment_dict = self.partition_int_active_segment_dict_dict.get(partition_int)
+        if active_segment_dict is not None:
+            if active_segment_dict["state"]["position"] >= self.segment_bytes_int or get_millis() - active_segment_dict["created"] >= self.segment_ms_int or (self.segment_rewrite_appends_int is not None and active_segment_dict["appends"] >= self.segment_rewrite_appends_int):
+                # Without appends, the sparse index is only written once the segment is rolled.
+                if not self.storage_obj.admin.append_bool:
+                    self.write_index(active_segment_dict)
+                active_segment_dict = None
+        #
+        if active_segment_dict is None:
+            segment_header_bytes = encode_segment_header(COMPRESSION_TYPE_STR_ID_INT_DICT[self.compression_type_str])
+            #
+            active_segment_dict = {"segment_tuple": None,
+                                   "created": get_millis(),
+                                   "state": create_segment_state_dict(m_list[0]["offset"]),
+                                   "segment_bytes_list": None if self.storage_obj.admin.append_bool else [segment_header_bytes],
+                                   "index_bytes": b"",
+                                   "appends": 0,
+                                   "partition": partition_int}
+            self.partition_int_active_segment_dict_dict[partition_int] = active_segment_dict
+        else:
+            segment_header_bytes = b""
+        #
+        (records_bytes, index_bytes, count_int) = encode_records(m_list, active_segment_dict["state"], self.storage_obj.index_interval_bytes(), self.segment_bytes_int, self.compression_type_str, self.storage_obj.batch_size())
+        #
+        previous_segment_tuple = active_segment_dict["segment_tuple"]
+        start_offset_int = m_list[0]["offset"] if previous_segment_tuple is None else previous_segment_tuple[0]
+        start_timestamp_int = m_list[0]["timestamp"][1] if previous_segment_tuple is None else previous_segment_tuple[2]
+        segment_tuple = (start_offset_int, m_list[count_int - 1]["offset"], start_timestamp_int, m_list[count_int - 1]["timestamp"][1], active_segment_dict["state"]["position"])
+        #
+        abs_path_file_str = os.path.join(topic_abs_dir_str, "partitions", get_partition_rel_file_str(partition_int, segment_tuple))
+        previous_abs_path_file_str = os.path.join(topic_abs_dir_str, "partitions", get_partition_rel_file_str(partition_int, previous_segment_tuple)) if previous_segment_tuple is not None else None
+        #
+        if active_segment_dict["segment_bytes_list"] is not None:
+            active_segment_dict["segment_bytes_list"].append(records_bytes)
+        partition_obsolete_abs_path_file_str_list = self.storage_obj.admin.write_partition_file(abs_path_file_str, previous_abs_path_file_str, active_segment_dict["segment_bytes_list"], segment_header_bytes + records_bytes)
+        if partition_obsolete_abs_path_file_str_list is None:
+            return None
+        obsolete_abs_path_file_str_list += partition_obsolete_abs_path_file_str_list
+        # The partition file can be reverted by the producer (if the manifest cannot be updated).
+        revert_tuple_list.append((abs_path_file_str, previous_abs_path_file_str, previous_segment_tuple[4] if previous_segment_tuple is not None else 0))
+        #
+        # The (small) sparse index is rewritten under the new name of the active segment (without appends, only when the segment is rolled - the active segment is small then and read from its beginning).
+        if self.storage_obj.admin.append_bool and len(active_segment_dict["index_bytes"]) > 0:
+            obsolete_abs_path_file_str_list.append(previous_abs_path_file_str + INDEX_SUFFIX_STR)
+        active_segment_dict["index_bytes"] += index_bytes
+        if self.storage_obj.admin.append_bool and len(active_segment_dict["index_bytes"]) > 0:
+            self.storage_obj.admin.write_bytes(abs_path_file_str + INDEX_SUFFIX_STR, active_segment_dict["index_bytes"])
+            revert_tuple_list.append((abs_path_file_str + INDEX_SUFFIX_STR, None, None))
+        #
+        partition_int_segment_tuple_change_list_dict.setdefault(partition_int, []).append((previous_segment_tuple, segment_tuple))
+        active_segment_dict["segment_tuple"] = segment_tuple
+        active_segment_dict["appends"] += 1
+        #
+        return count_int
+
+    def write_index(self, active_segment_dict):
+        if active_segment_dict["segment_tuple"] is None or len(active_segment_dict["index_bytes"]) == 0:
+            return
+        #
+        partition_int = active_segment_dict["partition"]
+        abs_path_file_str = os.path.join(self.storage_obj.admin.get_topic_abs_path_str(self.topic_str), "partitions", get_partition_rel_file_str(partition_int, active_segment_dict["segment_tuple"]))
+        # The segment might have been deleted in the meantime (retention).
+        if self.storage_obj.admin.exists_file(abs_path_file_str):
+            self.storage_obj.admin.write_bytes(abs_path_file_str + INDEX_SUFFIX_STR, active_segment_dict["index_bytes"])
+
+    def write_indexes(self):
+        # Write the sparse indexes of the active segments (without appends, they are only written when the segments are rolled).
+        if not self.storage_obj.admin.append_bool:
+            for active_segment_dict in self.partition_int_active_segment_dict_dict.values():
+                self.write_index(active_segment_dict)
+
+#
+
+def copy_active_segment_dict(active_segment_dict):
+    return {"segment_tuple": active_segment_dict["segment_tuple"],
+            "created": active_segment_dict["created"],
+            "state": dict(active_segment_dict["state"]),
+            "segment_bytes_list": list(active_segment_dict["segment_bytes_list"]) if active_segment_dict["segment_bytes_list"] is not None else None,
+            "index_bytes": active_segment_dict["index_bytes"],
+            "appends": active_segment_dict["appends"],
+            "partition": active_segment_dict["partition"]}
@@ -0,0 +1,372 @@
+import ast
+import struct
+import zlib
+
+import lz4.frame
+
+from kafi.helpers import compress, decompress
+
+# Constants
+
+SEGMENT_MAGIC_BYTES = b"KAFI"
+SEGMENT_VERSION_INT = 1
+SEGMENT_HEADER_SIZE_INT = len(SEGMENT_MAGIC_BYTES) + 2
+
+INDEX_SUFFIX_STR = ".index"
+
+TIMESTAMP_CREATE_TIME = 1
+
+NULL_LENGTH_INT = -1
+
+# Compressed record batches are marked by the highest bit of their length prefix (plain records are always shorter than 2 GiB).
+BATCH_FLAG_INT = 0x80000000
+
+# Compression types (with the same ids as in Kafka's record batch attributes).
+COMPRESSION_TYPE_STR_ID_INT_DICT = {"none": 0, "gzip": 1, "lz4": 3, "zstd": 4}
+
+#
+
+record_length_struct = struct.Struct(">I")
+record_prefix_struct = struct.Struct(">qbq")
+length_struct = struct.Struct(">i")
+# Compressed record batch header (after the length prefix): compression type id (int8), number of records (int32).
+batch_header_struct = struct.Struct(">bi")
+# Sparse index entry: relative offset (uint32), byte position (uint32), max. timestamp of all records before this position (int64).
+index_entry_struct = struct.Struct(">IIq")
+
+#
+
+def encode_segment_header(attributes_int=0):
+    # Segment header: magic bytes, format version and an attributes byte (the compression type id of the record batches of the segment, 0 for uncompressed records).
+    return SEGMENT_MAGIC_BYTES + bytes([SEGMENT_VERSION_INT, attributes_int])
+
+
+def is_binary_segment(segment_bytes):
+    # False for legacy repr() segments.
+    return bytes(segment_bytes[:len(SEGMENT_MAGIC_BYTES)]) == SEGMENT_MAGIC_BYTES
+
+
+def get_timestamp_int(timestamp):
+    # Millis of a (type, millis) timestamp tuple or a plain millis timestamp.
+    return timestamp[1] if isinstance(timestamp, tuple) else timestamp
+
+
+def encode_record(m):
+    # Layout (big endian): record length (uint32), offset (int64), timestamp type (int8), timestamp (int64), key length (int32, -1 for None), key, value length (int32, -1 for None), value, number of headers (int32, -1 for None), and per header: name length (int32), name (UTF-8), value length (int32, -1 for None), value.
+    timestamp = m["timestamp"]
+    (timestamp_type_int, timestamp_int) = timestamp if isinstance(timestamp, tuple) else (TIMESTAMP_CREATE_TIME, timestamp)
+    #
+    part_bytes_list = [b"", record_prefix_struct.pack(m["offset"], timestamp_type_int, timestamp_int)]
+    append_bytes(part_bytes_list, m["key"])
+    append_bytes(part_bytes_list, m["value"])
+    #
+    headers_str_bytes_tuple_list = m["headers"]
+    if headers_str_bytes_tuple_list is None:
+        part_bytes_list.append(length_struct.pack(NULL_LENGTH_INT))
+    else:
+        part_bytes_list.append(length_struct.pack(len(headers_str_bytes_tuple_list)))
+        for header_key_str, header_value_bytes in headers_str_bytes_tuple_list:
+            append_bytes(part_bytes_list, header_key_str.encode("utf-8"))
+            append_bytes(part_bytes_list, header_value_bytes)
+    #
+    body_length_int = sum(len(part_bytes) for part_bytes in part_bytes_list)
+    part_bytes_list[0] = record_length_struct.pack(body_length_int)
+    #
+    return b"".join(part_bytes_list)
+
+
+def append_bytes(part_bytes_list, bytes_or_str):
+    # Length-prefixed field (str is UTF-8-encoded, None is encoded as length -1).
+    if bytes_or_str is None:
+        part_bytes_list.append(length_struct.pack(NULL_LENGTH_INT))
+    else:
+        field_bytes = bytes_or_str.encode("utf-8") if isinstance(bytes_or_str, str) else bytes_or_str
+        part_bytes_list.append(length_struct.pack(len(field_bytes)))
+        part_bytes_list.append(field_bytes)
+
+
+def decode_record(segment_memoryview, position_int, topic_str, partition_int, copy_bool=True):
+    # Decode the record at position_int (pointing at its length prefix). Returns the message and the position of the next record. If copy_bool == False, the key and value are memoryview slices of the segment.
+    (body_length_int,) = record_length_struct.unpack_from(segment_memoryview, position_int)
+    position_int += record_length_struct.size
+    next_position_int = position_int + body_length_int
+    #
+    (offset_int, timestamp_type_int, timestamp_int) = record_prefix_struct.unpack_from(segment_memoryview, position_int)
+    position_int += record_prefix_struct.size
+    #
+    (key_bytes, position_int) = read_bytes(segment_memoryview, position_int, copy_bool)
+    (value_bytes, position_int) = read_bytes(segment_memoryview, position_int, copy_bool)
+    #
+    (headers_int,) = length_struct.unpack_from(segment_memoryview, position_int)
+    position_int += length_struct.size
+    if headers_int == NULL_LENGTH_INT:
+        headers_str_bytes_tuple_list = None
+    else:
+        headers_str_bytes_tuple_list = []
+        for _ in range(headers_int):
+            (header_key_bytes, position_int) = read_bytes(segment_memoryview, position_int)
+            (header_value_bytes, position_int) = read_bytes(segment_memoryview, position_int)
+            headers_str_bytes_tuple_list.append((header_key_bytes.decode("utf-8"), header_value_bytes))
+    #
+    m = {"topic": topic_str,
+         "value": value_bytes,
+         "key": key_bytes,
+         "timestamp": (timestamp_type_int, timestamp_int),
+         "headers": headers_str_bytes_tuple_list,
+         "partition": partition_int,
+         "offset": offset_int}
+    #
+    return (m, next_position_int)
+
+
+def read_bytes(segment_memoryview, position_int, copy_bool=True):
+    # Length-prefixed field at position_int (a memoryview slice if copy_bool == False) and the position after it.
+    (length_int,) = length_struct.unpack_from(segment_memoryview, position_int)
+    position_int += length_struct.size
+    #
+    if length_int == NULL_LENGTH_INT:
+        return (None, position_int)
+    #
+    field_memoryview = segment_memoryview[position_int:position_int + length_int]
+    #
+    return (bytes(field_memoryview) if copy_bool else field_memoryview, position_int + length_int)
+
+#
+
+def encode_segment(m_list, index_interval_bytes_int):
+    # Uncompressed segment (header plus records) and its sparse index.
+    segment_state_dict = create_segment_state_dict(m_list[0]["offset"])
+    #
+    (records_bytes, index_bytes, _) = encode_records(m_list, segment_state_dict, index_interval_bytes_int)
+    #
+    return (encode_segment_header() + records_bytes, index_bytes)
+
+
+def create_segment_state_dict(base_offset_int):
+    # Encoding state of a new (empty) segment, passed to encode_records() for each batch appended to it.
+    return {"base_offset": base_offset_int, "position": SEGMENT_HEADER_SIZE_INT, "last_index_position": SEGMENT_HEADER_SIZE_INT, "max_timestamp": -1}
+
+
+def encode_records(m_list, segment_state_dict, index_interval_bytes_int, max_position_int=None, compression_type_str="none", batch_size_int=16384):
+    # Records to be appended to a segment and the sparse index entries for them (an entry whenever at least index_interval_bytes_int bytes have been written since the last one, like Kafka's index.interval.bytes). Stops once the segment has reached max_position_int (at least one message is always encoded). Returns the records, the index entries and the number of encoded messages; segment_state_dict is updated in place.
+    base_offset_int = segment_state_dict["base_offset"]
+    position_int = segment_state_dict["position"]
+    last_index_position_int = segment_state_dict["last_index_position"]
+    max_timestamp_int = segment_state_dict["max_timestamp"]
+    #
+    record_bytes_list = []
+    index_entry_bytes_list = []
+    #
+    count_int = 0
+    if compression_type_str == "none":
+        for m in m_list:
+            if max_position_int is not None and count_int > 0 and position_int >= max_position_int:
+                break
+            #
+            if position_int - last_index_position_int >= index_interval_bytes_int:
+                index_entry_bytes_list.append(index_entry_struct.pack(m["offset"] - base_offset_int, position_int, max_timestamp_int))
+                last_index_position_int = position_int
+            #
+            record_bytes = encode_record(m)
+            record_bytes_list.append(record_bytes)
+            #
+            position_int += len(record_bytes)
+            max_timestamp_int = max(max_timestamp_int, get_timestamp_int(m["timestamp"]))
+            count_int += 1
+    else:
+        # Compress up to batch_size_int bytes of records at a time (index entries can only point to the start of a batch).
+        while count_int < len(m_list):
+            if max_position_int is not None and count_int > 0 and position_int >= max_position_int:
+                break
+            #
+            if position_int - last_index_position_int >= index_interval_bytes_int:
+                index_entry_bytes_list.append(index_entry_struct.pack(m_list[count_int]["offset"] - base_offset_int, position_int, max_timestamp_int))
+                last_index_position_int = position_int
+            #
+            batch_record_bytes_list = []
+            batch_size_int1 = 0
+            while count_int < len(m_list) and batch_size_int1 < batch_size_int:
+                m = m_list[count_int]
+                #
+                record_bytes = encode_record(m)
+                batch_record_bytes_list.append(record_bytes)
+                #
+                batch_size_int1 += len(record_bytes)
+                max_timestamp_int = max(max_timestamp_int, get_timestamp_int(m["timestamp"]))
+                count_int += 1
+            #
+            batch_bytes = encode_batch(batch_record_bytes_list, compression_type_str)
+            record_bytes_list.append(batch_bytes)
+            #
+            position_int += len(batch_bytes)
+    #
+    segment_state_dict["position"] = position_int
+    segment_state_dict["last_index_position"] = last_index_position_int
+    segment_state_dict["max_timestamp"] = max_timestamp_int
+    #
+    return (b"".join(record_bytes_list), b"".join(index_entry_bytes_list), count_int)
+
+
+def encode_batch(record_bytes_list, compression_type_str):
+    # Layout (big endian): batch length (uint32, with the highest bit set), compression type id (int8), number of records (int32), compressed records.
+    compressed_bytes = compress_bytes(b"".join(record_bytes_list), compression_type_str)
+    #
+    batch_header_bytes = batch_header_struct.pack(COMPRESSION_TYPE_STR_ID_INT_DICT[compression_type_str], len(record_bytes_list))
+    #
+    return record_length_struct.pack(BATCH_FLAG_INT | (len(batch_header_bytes) + len(compressed_bytes))) + batch_header_bytes + compressed_bytes
+
+
+def compress_bytes(uncompressed_bytes, compression_type_str):
+    if compression_type_str == "gzip":
+        return zlib.compress(uncompressed_bytes)
+    elif compression_type_str == "lz4":
+        return lz4.frame.compress(uncompressed_bytes)
+    elif compression_type_str == "zstd":
+        return compress(uncompressed_bytes)
+    else:
+        raise Exception("Only \"none\", \"gzip\", \"lz4\" and \"zstd\" supported for \"compression.type\".")
+
+
+def decompress_bytes(compressed_bytes, compression_type_id_int):
+    if compression_type_id_int == COMPRESSION_TYPE_STR_ID_INT_DICT["gzip"]:
+        return zlib.decompress(compressed_bytes)
+    elif compression_type_id_int == COMPRESSION_TYPE_STR_ID_INT_DICT["lz4"]:
+        return lz4.frame.decompress(compressed_bytes)
+    elif compression_type_id_int == COMPRESSION_TYPE_STR_ID_INT_DICT["zstd"]:
+        return decompress(compressed_bytes)
+    else:
+        raise Exception(f"Unknown compression type id {compression_type_id_int}.")
+
+
+def get_entry_length_int(length_int):
+    # Length of a record or record batch without its length prefix.
+    return length_int & ~BATCH_FLAG_INT
+
+
+def decode_batch(segment_memoryview, position_int, topic_str, partition_int, copy_bool=True):
+    # Decode all records of the compressed record batch at position_int. Returns the messages and the position of the next record or record batch.
+    (length_int,) = record_length_struct.unpack_from(segment_memoryview, position_int)
+    position_int += record_length_struct.size
+    next_position_int = position_int + get_entry_length_int(length_int)
+    #
+    (compression_type_id_int, _) = batch_header_struct.unpack_from(segment_memoryview, position_int)
+    position_int += batch_header_struct.size
+    #
+    records_bytes = decompress_bytes(segment_memoryview[position_int:next_position_int], compression_type_id_int)
+    #
+    return (list(decode_records(records_bytes, 0, topic_str, partition_int, copy_bool)), next_position_int)
+
+
+def decode_entry(segment_memoryview, position_int, topic_str, partition_int):
+    # Decode the record or compressed record batch at position_int.
+    (length_int,) = record_length_struct.unpack_from(segment_memoryview, position_int)
+    #
+    if length_int & BATCH_FLAG_INT:
+        return decode_batch(segment_memoryview, position_int, topic_str, partition_int)
+    else:
+        (m, next_position_int) = decode_record(segment_memoryview, position_int, topic_str, partition_int)
+        return ([m], next_position_int)
+
+
+def decode_segment(segment_bytes, topic_str, partition_int, copy_bool=True):
+    # Lazily decode a binary or legacy repr() segment. If copy_bool == False, keys and values are memoryview slices of segment_bytes.
+    if is_binary_segment(segment_bytes):
+        return decode_records(segment_bytes, SEGMENT_HEADER_SIZE_INT, topic_str, partition_int, copy_bool)
+    else:
+        return (ast.literal_eval(message_bytes.decode("utf-8")) for message_bytes in bytes(segment_bytes).split(b"\n")[:-1])
+
+
+def decode_records(records_bytes, position_int, topic_str, partition_int, copy_bool=True):
+    # Lazily decode the records from position_int on (a record boundary, e.g. a position from the sparse index).
+    records_memoryview = memoryview(records_bytes)
+    records_length_int = len(records_memoryview)
+    #
+    while position_int + record_length_struct.size <= records_length_int:
+        # Stop at an incomplete record at the end (e.g. while a producer is appending to the active segment).
+        (length_int,) = record_length_struct.unpack_from(records_memoryview, position_int)
+        if position_int + record_length_struct.size + get_entry_length_int(length_int) > records_length_int:
+            break
+        #
+        if length_int & BATCH_FLAG_INT:
+            (m_list, position_int) = decode_batch(records_memoryview, position_int, topic_str, partition_int, copy_bool)
+            yield from m_list
+        else:
+            (m, position_int) = decode_record(records_memoryview, position_int, topic_str, partition_int, copy_bool)
+            yield m
+
+
+def decode_segment_chunks(chunk_bytes_iterator, topic_str, partition_int, ranged_bool=False):
+    # Incrementally decode a segment while it is still being read (e.g. streamed from S3 or Azure Blob Storage). ranged_bool: the chunks start at a record boundary instead of at the segment header.
+    # The chunks are only joined once enough bytes for the next record (or the segment header) have been read, i.e. records larger than a chunk are not copied again with every chunk.
+    chunk_bytes_list = []
+    buffer_length_int = 0
+    needed_length_int = 0 if ranged_bool else SEGMENT_HEADER_SIZE_INT
+    position_int = 0 if ranged_bool else None
+    buffer_bytes = b""
+    #
+    for chunk_bytes in chunk_bytes_iterator:
+        chunk_bytes_list.append(chunk_bytes)
+        buffer_length_int += len(chunk_bytes)
+        if buffer_length_int < needed_length_int:
+            continue
+        #
+        buffer_bytes = b"".join(chunk_bytes_list)
+        # Check the segment header first (legacy repr() segments are decoded as a whole).
+        if position_int is None:
+            if not is_binary_segment(buffer_bytes):
+                yield from decode_segment(buffer_bytes + b"".join(chunk_bytes_iterator), topic_str, partition_int)
+                return
+            #
+            position_int = SEGMENT_HEADER_SIZE_INT
+        # Decode all complete records in the buffer and keep the rest for the next chunks.
+        buffer_memoryview = memoryview(buffer_bytes)
+        needed_length_int = record_length_struct.size
+        while position_int + record_length_struct.size <= buffer_length_int:
+            (length_int,) = record_length_struct.unpack_from(buffer_memoryview, position_int)
+            if position_int + record_length_struct.size + get_entry_length_int(length_int) > buffer_length_int:
+                needed_length_int = record_length_struct.size + get_entry_length_int(length_int)
+                break
+            #
+            (m_list, position_int) = decode_entry(buffer_memoryview, position_int, topic_str, partition_int)
+            #
+            yield from m_list
+        #
+        buffer_memoryview.release()
+        buffer_bytes = buffer_bytes[position_int:]
+        chunk_bytes_list = [buffer_bytes]
+        buffer_length_int = len(buffer_bytes)
+        position_int = 0
+    #
+    if position_int is None and buffer_length_int > 0:
+        # Legacy repr() segments shorter than the segment header.
+        yield from decode_segment(b"".join(chunk_bytes_list), topic_str, partition_int)
+
+#
+
+def find_position_by_offset(index_bytes, relative_offset_int):
+    # Byte position of the last indexed record at or before relative_offset_int (None to scan from the start).
+    i = bisect_index(index_bytes, relative_offset_int, 0, True) - 1
+    #
+    return index_entry_struct.unpack_from(index_bytes, i * index_entry_struct.size)[1] if i >= 0 else None
+
+
+def find_position_by_timestamp(index_bytes, timestamp_int):
+    # Byte position of the last indexed record before which all timestamps are < timestamp_int (None to scan from the start).
+    i = bisect_index(index_bytes, timestamp_int, 2, False) - 1
+    #
+    return index_entry_struct.unpack_from(index_bytes, i * index_entry_struct.size)[1] if i >= 0 else None
+
+
+def bisect_index(index_bytes, value_int, field_int, right_bool):
+    # Binary search directly over the fixed-size entries of the sparse index (only unpacking the visited entries): the number of entries whose field field_int is < value_int (<= value_int if right_bool).
+    low_int = 0
+    high_int = len(index_bytes) // index_entry_struct.size
+    while low_int < high_int:
+        middle_int = (low_int + high_int) // 2
+        field_value_int = index_entry_struct.unpack_from(index_bytes, middle_int * index_entry_struct.size)[field_int]
+        if field_value_int < value_int or (right_bool and field_value_int == value_int):
+            low_int = middle_int + 1
+        else:
+            high_int = middle_int
+    #
+    return low_int
@@ -1,4 +1,17 @@
+import mmap
 import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    # Windows (no fcntl).
+    import msvcrt
+except ImportError:
+    msvcrt = None
 
 from kafi.fs.fs_admin import FSAdmin
 
@@ -7,6 +20,8 @@ from kafi.fs.fs_admin import FSAdmin
 class LocalAdmin(FSAdmin):
     def __init__(self, local_obj, **kwargs):
         super().__init__(local_obj, **kwargs)
+        #
+        self.append_bool = True
 
     # Topics/Files
 
@@ -41,6 +56,9 @@ class LocalAdmin(FSAdmin):
     def exists_file(self, abs_path_file_str):
         return os.path.exists(abs_path_file_str)
 
+    def size_file(self, abs_path_file_str):
+        return os.path.getsize(abs_path_file_str)
+
     # Metadata
     
     def read_str(self, abs_path_file_str):
@@ -54,20 +72,178 @@ class LocalAdmin(FSAdmin):
 
     def write_str(self, abs_path_file_str, data_str):
         os.makedirs(os.path.dirname(abs_path_file_str), exist_ok=True)
-        #
-        with open(abs_path_file_str, "w") as bufferedWriter:
+        # Write to a hidden temporary file first and replace the file by renaming it (readers never see a partially written group, manifest or metadata file).
+        tmp_abs_path_file_str = get_tmp_abs_path_file_str(abs_path_file_str)
+        with open(tmp_abs_path_file_str, "w") as bufferedWriter:
             bufferedWriter.write(data_str)
+        #
+        os.replace(tmp_abs_path_file_str, abs_path_file_str)
+
+    def read_bytes_etag(self, abs_path_file_str):
+        try:
+            with open(abs_path_file_str, "rb") as bufferedReader:
+                data_bytes = bufferedReader.read()
+                etag = get_etag(os.fstat(bufferedReader.fileno()))
+        except FileNotFoundError:
+            return (None, None)
+        #
+        return (data_bytes, etag)
 
     #
 
-    def read_bytes(self, abs_path_file_str):
+    def read_bytes(self, abs_path_file_str, start_int=0):
         with open(abs_path_file_str, "rb") as bufferedReader:
+            bufferedReader.seek(start_int)
             bytes = bufferedReader.read()
         #
         return bytes
 
+    def read_bytes_chunks(self, abs_path_file_str, start_int, chunk_size_int):
+        with open(abs_path_file_str, "rb") as bufferedReader:
+            bufferedReader.seek(start_int)
+            while True:
+                chunk_bytes = bufferedReader.read(chunk_size_int)
+                if chunk_bytes == b"":
+                    break
+                #
+                yield chunk_bytes
+
+    def read_bytes_mmap(self, abs_path_file_str, start_int=0):
+        # Map the file into memory instead of reading it (the pages are only loaded on access and can be dropped again by the OS, i.e. they do not count against the resident memory of the process like a copy would).
+        with open(abs_path_file_str, "rb") as bufferedReader:
+            size_int = os.fstat(bufferedReader.fileno()).st_size
+            if size_int <= start_int:
+                return b""
+            #
+            mmap_obj = mmap.mmap(bufferedReader.fileno(), 0, access=mmap.ACCESS_READ)
+        # The mapping is closed as soon as there is no reference to it (or to a memoryview slice of it) anymore.
+        return memoryview(mmap_obj)[start_int:]
+
     def write_bytes(self, abs_path_file_str, data_bytes):
         os.makedirs(os.path.dirname(abs_path_file_str), exist_ok=True)
         #
         with open(abs_path_file_str, "wb") as bufferedWriter:
             bufferedWriter.write(data_bytes)
+
+    def write_bytes_if_match(self, abs_path_file_str, data_bytes, etag):
+        os.makedirs(os.path.dirname(abs_path_file_str), exist_ok=True)
+        #
+        tmp_abs_path_file_str = get_tmp_abs_path_file_str(abs_path_file_str)
+        with open(tmp_abs_path_file_str, "wb") as bufferedWriter:
+            bufferedWriter.write(data_bytes)
+            # Flush first (the ETag includes the size and modification time of the written file).
+            bufferedWriter.flush()
+            new_etag = get_etag(os.fstat(bufferedWriter.fileno()))
+        #
+        if etag is None:
+            # Create the file only if it does not exist yet (link() fails atomically if it does).
+            try:
+                os.link(tmp_abs_path_file_str, abs_path_file_str)
+            except FileExistsError:
+                return None
+            finally:
+                os.remove(tmp_abs_path_file_str)
+        else:
+            # Replace the file only if it has not been replaced since it has been read (the check and the replacement are serialized by an advisory lock on a hidden lock file next to it).
+            with open(os.path.join(os.path.dirname(abs_path_file_str), f".{os.path.basename(abs_path_file_str)}.lock"), "a") as lockFile:
+                lock_file(lockFile)
+                try:
+                    try:
+                        current_etag = get_etag(os.stat(abs_path_file_str))
+                    except FileNotFoundError:
+                        current_etag = None
+                    #
+                    if current_etag != etag:
+                        os.remove(tmp_abs_path_file_str)
+                        return None
+                    #
+                    os.replace(tmp_abs_path_file_str, abs_path_file_str)
+                finally:
+                    unlock_file(lockFile)
+        #
+        return new_etag
+
+    # Partition files
+
+    def read_partition_file(self, topic_str, rel_file_str, offset_int=None, timestamp_int=None, copy_bool=True):
+        # Decode directly from the memory-mapped partition file (instead of streaming it).
+        (partition_file_memoryview, ranged_bool) = self.read_partition_file_bytes(topic_str, rel_file_str, offset_int, timestamp_int)
+        #
+        return self.decode_partition_file_bytes(topic_str, rel_file_str, partition_file_memoryview, ranged_bool, copy_bool)
+
+    def read_partition_file_bytes(self, topic_str, rel_file_str, offset_int=None, timestamp_int=None):
+        abs_path_file_str = os.path.join(self.get_topic_abs_path_str(topic_str), "partitions", rel_file_str)
+        position_int = self.find_partition_file_position(topic_str, rel_file_str, offset_int, timestamp_int)
+        #
+        if position_int is None:
+            return (self.read_bytes_mmap(abs_path_file_str), False)
+        else:
+            return (self.read_bytes_mmap(abs_path_file_str, position_int), True)
+
+    def write_partition_file(self, abs_path_file_str, previous_abs_path_file_str, segment_bytes_list, appended_bytes):
+        if previous_abs_path_file_str is None:
+            if self.write_bytes_if_match(abs_path_file_str, appended_bytes, None) is None:
+                return None
+            #
+            return []
+        #
+        # Link the active segment to its new name according to its new end offset/timestamp before appending to it (link() instead of rename() so that an existing partition file of another producer is never replaced) - if this fails, nothing has been appended (and nothing has to be cut off again).
+        try:
+            os.link(previous_abs_path_file_str, abs_path_file_str)
+        except FileExistsError:
+            return None
+        #
+        try:
+            with open(abs_path_file_str, "ab") as bufferedWriter:
+                bufferedWriter.write(appended_bytes)
+        except Exception as e:
+            os.remove(abs_path_file_str)
+            raise e
+        # The previous name is still in the committed manifest (readers skip the appended records after its end offset) - it is only deleted by the producer after the manifest has been updated.
+        return [previous_abs_path_file_str]
+
+    def revert_partition_file(self, abs_path_file_str, previous_abs_path_file_str, previous_size_int):
+        if previous_abs_path_file_str is not None:
+            # Both names share the appended records: replace the previous name by a copy of its previous version (partition files are never truncated in place - consumers might have mapped them into memory, and accessing the cut off pages of a mapped file raises SIGBUS).
+            tmp_abs_path_file_str = get_tmp_abs_path_file_str(previous_abs_path_file_str)
+            with open(previous_abs_path_file_str, "rb") as bufferedReader, open(tmp_abs_path_file_str, "wb") as bufferedWriter:
+                bufferedWriter.write(bufferedReader.read(previous_size_int))
+            os.replace(tmp_abs_path_file_str, previous_abs_path_file_str)
+        #
+        os.remove(abs_path_file_str)
+
+#
+
+def get_tmp_abs_path_file_str(abs_path_file_str):
+    # Hidden temporary file next to the file (unique per process and thread).
+    return os.path.join(os.path.dirname(abs_path_file_str), f".{os.path.basename(abs_path_file_str)}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def get_etag(stat_result):
+    # Files are always replaced by new files (see write_str()/write_bytes_if_match()), i.e. the inode changes with every version.
+    return (stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size)
+
+
+def lock_file(lockFile):
+    # Exclusive lock on the (hidden) lock file, blocking until it is acquired - an advisory lock on POSIX, a lock on its first byte on Windows.
+    if fcntl is not None:
+        fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX)
+    elif msvcrt is not None:
+        lockFile.seek(0)
+        while True:
+            try:
+                # LK_LOCK gives up after 10 attempts (one per second).
+                msvcrt.locking(lockFile.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                pass
+    else:
+        raise Exception("Conditional writes require file locks (fcntl or msvcrt).")
+
+
+def unlock_file(lockFile):
+    if fcntl is not None:
+        fcntl.flock(lockFile.fileno(), fcntl.LOCK_UN)
+    elif msvcrt is not None:
+        lockFile.seek(0)
+        msvcrt.locking(lockFile.fileno(), msvcrt.LK_UNLCK, 1)
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 import io
 import os
 
@@ -11,7 +12,7 @@ class S3Admin(FSAdmin):
         #
 
         super().__init__(s3_obj)
-        #
+        # One Minio client (and hence one pooled HTTP connection manager) per S3 storage object.
         self.minio = Minio(s3_obj.s3_config_dict["endpoint"], access_key=s3_obj.s3_config_dict["access.key"], secret_key=s3_obj.s3_config_dict["secret.key"], secure=False)
 
     # Topics/Files
@@ -50,11 +51,23 @@ class S3Admin(FSAdmin):
         except MinioException:
             return False
 
+    def size_file(self, abs_path_file_str):
+        object = self.minio.stat_object(self.storage_obj.bucket_name(), abs_path_file_str)
+        #
+        return object.size
+
     # Metadata
     
     def read_str(self, abs_path_file_str):
-        response = self.minio.get_object(self.storage_obj.bucket_name(), abs_path_file_str)
-        object_bytes = response.data
+        from minio.error import S3Error
+        #
+
+        try:
+            object_bytes = self.read_bytes(abs_path_file_str)
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                return None
+            raise e
         #
         object_str = object_bytes.decode("utf-8")
         #
@@ -63,25 +76,100 @@ class S3Admin(FSAdmin):
     def write_str(self, abs_path_file_str, data_str):
         data_bytes = data_str.encode("utf-8")
         #
-        self.minio.put_object(self.storage_obj.bucket_name(), abs_path_file_str, io.BytesIO(data_bytes), length=len(data_bytes))
-
-    #
+        self.write_bytes(abs_path_file_str, data_bytes)
 
-    def read_bytes(self, abs_path_file_str):
-        from minio import Minio
+    def read_bytes_etag(self, abs_path_file_str):
+        from minio.error import S3Error
         #
 
-        self.minio = Minio(self.storage_obj.s3_config_dict["endpoint"], access_key=self.storage_obj.s3_config_dict["access.key"], secret_key=self.storage_obj.s3_config_dict["secret.key"], secure=False)
+        try:
+            response = self.minio.get_object(self.storage_obj.bucket_name(), abs_path_file_str)
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                return (None, None)
+            raise e
+        try:
+            object_bytes = response.read()
+            etag = normalize_etag(response.headers.get("ETag"))
+        finally:
+            response.close()
+            response.release_conn()
         #
-        response = self.minio.get_object(self.storage_obj.bucket_name(), abs_path_file_str)
-        object_bytes = response.data
+        return (object_bytes, etag)
+
+    #
+
+    def read_bytes(self, abs_path_file_str, start_int=0):
+        response = self.minio.get_object(self.storage_obj.bucket_name(), abs_path_file_str, offset=start_int)
+        # Always release the connection back to the pool of the (shared) Minio client.
+        try:
+            object_bytes = response.read()
+        finally:
+            response.close()
+            response.release_conn()
         #
         return object_bytes
 
+    def read_bytes_chunks(self, abs_path_file_str, start_int, chunk_size_int):
+        response = self.minio.get_object(self.storage_obj.bucket_name(), abs_path_file_str, offset=start_int)
+        try:
+            for chunk_bytes in response.stream(chunk_size_int):
+                yield chunk_bytes
+        finally:
+            response.close()
+            response.release_conn()
+
     def write_bytes(self, abs_path_file_str, data_bytes):
-        from minio import Minio
+        # Objects larger than multipart.part.size are uploaded as multipart uploads (with parallel part uploads).
+        self.minio.put_object(self.storage_obj.bucket_name(), abs_path_file_str, io.BytesIO(data_bytes), length=len(data_bytes), part_size=self.storage_obj.multipart_part_size())
+
+    def write_bytes_if_match(self, abs_path_file_str, data_bytes, etag):
+        from minio.error import S3Error
+        #
+
+        # Conditional write (If-None-Match: * = create the object only if it does not exist yet, If-Match = replace the object only if it has not been replaced since it has been read). put_object() does not support these headers (it sends them as user metadata), hence the S3 API calls of the Minio client are used directly.
+        headers_dict = {"If-None-Match": "*"} if etag is None else {"If-Match": f"\"{normalize_etag(etag)}\""}
+        try:
+            if len(data_bytes) <= self.storage_obj.multipart_part_size():
+                new_etag = self.minio._put_object(self.storage_obj.bucket_name(), abs_path_file_str, data_bytes, headers=headers_dict).etag
+            else:
+                new_etag = self.put_object_multipart_if_match(abs_path_file_str, data_bytes, headers_dict)
+        except S3Error as e:
+            if e.code in ["PreconditionFailed", "ConditionalRequestConflict", "NoSuchKey"]:
+                return None
+            raise e
+        #
+        return normalize_etag(new_etag)
+
+    def put_object_multipart_if_match(self, abs_path_file_str, data_bytes, headers_dict):
+        from minio.datatypes import CompleteMultipartUploadResult
+        from minio.helpers import md5sum_hash
+        from minio.xml import Element, SubElement, getbytes
         #
 
-        self.minio = Minio(self.storage_obj.s3_config_dict["endpoint"], access_key=self.storage_obj.s3_config_dict["access.key"], secret_key=self.storage_obj.s3_config_dict["secret.key"], secure=False)
+        # Objects larger than multipart.part.size are uploaded as multipart uploads like in write_bytes() (with parallel part uploads) - the condition is checked when the upload is completed.
+        bucket_name_str = self.storage_obj.bucket_name()
+        part_size_int = self.storage_obj.multipart_part_size()
+        upload_id_str = self.minio._create_multipart_upload(bucket_name_str, abs_path_file_str, {})
+        try:
+            with ThreadPoolExecutor(max_workers=3) as threadPoolExecutor:
+                part_etag_str_list = list(threadPoolExecutor.map(lambda part_number_int: self.minio._upload_part(bucket_name_str, abs_path_file_str, data_bytes[(part_number_int - 1) * part_size_int:part_number_int * part_size_int], None, upload_id_str, part_number_int), range(1, (len(data_bytes) + part_size_int - 1) // part_size_int + 1)))
+            #
+            element = Element("CompleteMultipartUpload")
+            for part_number_int, part_etag_str in enumerate(part_etag_str_list, start=1):
+                part_element = SubElement(element, "Part")
+                SubElement(part_element, "PartNumber", str(part_number_int))
+                SubElement(part_element, "ETag", f"\"{normalize_etag(part_etag_str)}\"")
+            body_bytes = getbytes(element)
+            response = self.minio._execute("POST", bucket_name_str, abs_path_file_str, body=body_bytes, headers={"Content-Type": "application/xml", "Content-MD5": md5sum_hash(body_bytes), **headers_dict}, query_params={"uploadId": upload_id_str})
+        except Exception as e:
+            self.minio._abort_multipart_upload(bucket_name_str, abs_path_file_str, upload_id_str)
+            raise e
         #
-        self.minio.put_object(self.storage_obj.bucket_name(), abs_path_file_str, io.BytesIO(data_bytes), length=len(data_bytes))
+        return CompleteMultipartUploadResult(response).etag
+
+#
+
+def normalize_etag(etag):
+    # ETags are returned with quotes by GetObject and without quotes by the Minio client after PutObject - always use them without quotes.
+    return etag.strip("\"") if etag is not None else None
@@ -7,5 +7,7 @@ class S3Producer(FSProducer):
     #
 
     def close(self):
+        self.write_indexes()
+        #
         return self.topic_str
 
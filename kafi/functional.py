@@ -1,3 +1,6 @@
+import multiprocessing
+import queue
+
 from tqdm.auto import tqdm
 
 from kafi.helpers import copy_kwargs
@@ -17,10 +20,14 @@ class Functional:
             foldl_fun: (acc, m) -> new acc
             initial_acc: starting accumulator value
             n: max messages to consume; ALL_MESSAGES for no limit
-            **kwargs: passed to consumer()/consumer.foldl()
+            **kwargs: passed to consumer()/consumer.foldl(); parallel (number of worker processes, see foldl_parallel()), combine_fun
 
         Returns:
             tuple: (final acc, number of messages consumed as int)"""
+        parallel_int = kwargs["parallel"] if "parallel" in kwargs else 1
+        if parallel_int > 1:
+            return self.foldl_parallel(topic, foldl_fun, initial_acc, n, **kwargs)
+        #
         verbose_int = self.verbose()
         #
         consumer = self.consumer(topic, **kwargs)
@@ -49,6 +56,158 @@ class Functional:
         #
         return acc_consume_message_counter_int_tuple
 
+    def foldl_parallel(self, topic, foldl_fun, initial_acc, n=ALL_MESSAGES, **kwargs):
+        """Fold over the partitions of a topic in parallel worker processes (each with its own consumer on an explicit partition assignment) and merge their accumulators.
+
+        The worker processes are forked (foldl_fun and initial_acc do not have to be picklable, only the accumulators), i.e. this is not supported on platforms without fork (e.g. Windows).
+
+        Args:
+            topic: topic name
+            foldl_fun: (acc, m) -> new acc
+            initial_acc: starting accumulator value (of each worker)
+            n: max messages to consume in total (shared by the workers, i.e. the workers whose partitions run dry leave the rest to the others); ALL_MESSAGES for no limit
+            **kwargs: parallel (number of worker processes), combine_fun (acc, acc) -> merged acc, partitions ({topic: [partition, ...]} to only fold over these partitions), others passed to foldl() of the workers
+
+        Returns:
+            tuple: (merged acc, number of messages consumed as int)"""
+        if "combine_fun" not in kwargs:
+            raise Exception("\"combine_fun\" is required to merge the accumulators of the worker processes.")
+        combine_fun = kwargs["combine_fun"]
+        #
+        parallel_int = kwargs["parallel"]
+        #
+        # Only the partitions given by the user (if any).
+        partition_int_list = list(range(self.partitions(topic)[topic]))
+        if "partitions" in kwargs and kwargs["partitions"] is not None:
+            if topic not in kwargs["partitions"]:
+                raise Exception(f"No partitions given for topic \"{topic}\".")
+            partition_int_list = [partition_int for partition_int in partition_int_list if partition_int in kwargs["partitions"][topic]]
+        #
+        # Assign the partitions round-robin to the workers (no more workers than partitions or messages to consume).
+        workers_int = min(parallel_int, len(partition_int_list))
+        if n != ALL_MESSAGES:
+            workers_int = min(workers_int, n)
+        if workers_int == 0:
+            return (initial_acc, 0)
+        partition_int_list_list = [partition_int_list[i::workers_int] for i in range(workers_int)]
+        #
+        context = multiprocessing.get_context("fork")
+        #
+        worker_kwargs = {key_str: value for key_str, value in kwargs.items() if key_str not in ["parallel", "combine_fun", "partitions"]}
+        # The workers take the messages to consume from a shared quota of n messages (each stops once it is used up).
+        if n != ALL_MESSAGES:
+            remaining_value = context.Value("q", n)
+            user_break_fun = kwargs["break_fun"] if "break_fun" in kwargs else None
+            #
+            def break_fun(acc, m):
+                if user_break_fun is not None and user_break_fun(acc, m):
+                    return True
+                #
+                with remaining_value.get_lock():
+                    if remaining_value.value <= 0:
+                        return True
+                    remaining_value.value -= 1
+                #
+                return False
+            worker_kwargs["break_fun"] = break_fun
+        #
+        def worker(i, partition_int_list, n_int, result_queue):
+            try:
+                # Each worker process gets its own storage object (the clients of the parent process must not be used in forked processes).
+                storage = self.__class__(self.config_dict)
+                storage.kafi_config_dict.update(self.kafi_config_dict)
+                storage.verbose(0)
+                #
+                acc_consume_message_counter_int_tuple = storage.foldl(topic, foldl_fun, initial_acc, n_int, partitions={topic: partition_int_list}, **worker_kwargs)
+                result_queue.put((i, acc_consume_message_counter_int_tuple, None))
+            except Exception as e:
+                result_queue.put((i, None, e))
+        #
+        result_queue = context.Queue()
+        process_list = [context.Process(target=worker, args=(i, partition_int_list, n, result_queue)) for i, partition_int_list in enumerate(partition_int_list_list)]
+        for process in process_list:
+            process.start()
+        # Collect the results before joining the processes (large results would block the processes otherwise).
+        i_acc_consume_message_counter_int_tuple_exception_tuple_list = []
+        while len(i_acc_consume_message_counter_int_tuple_exception_tuple_list) < len(process_list):
+            try:
+                i_acc_consume_message_counter_int_tuple_exception_tuple_list.append(result_queue.get(timeout=1))
+            except queue.Empty:
+                if not any(process.is_alive() for process in process_list) and result_queue.empty():
+                    raise Exception("Worker process terminated unexpectedly.")
+        for process in process_list:
+            process.join()
+        #
+        i_acc_consume_message_counter_int_tuple_exception_tuple_list.sort(key=lambda x: x[0])
+        for _, _, exception in i_acc_consume_message_counter_int_tuple_exception_tuple_list:
+            if exception is not None:
+                raise exception
+        #
+        acc_consume_message_counter_int_tuple_list = [acc_consume_message_counter_int_tuple for _, acc_consume_message_counter_int_tuple, _ in i_acc_consume_message_counter_int_tuple_exception_tuple_list]
+        #
+        acc = acc_consume_message_counter_int_tuple_list[0][0]
+        for acc1, _ in acc_consume_message_counter_int_tuple_list[1:]:
+            acc = combine_fun(acc, acc1)
+        #
+        return (acc, sum(consume_message_counter_int for _, consume_message_counter_int in acc_consume_message_counter_int_tuple_list))
+
+    def foldl_batch(self, topic, foldl_batch_fun, initial_acc, n=ALL_MESSAGES, **kwargs):
+        """Fold over whole batches of up to n messages of a topic with a progress bar, then close the consumer.
+
+        Args:
+            topic: topic name
+            foldl_batch_fun: (acc, list of m) -> new acc
+            initial_acc: starting accumulator value
+            n: max messages to consume; ALL_MESSAGES for no limit
+            **kwargs: passed to consumer()/consumer.foldl_batch()
+
+        Returns:
+            tuple: (final acc, number of messages consumed as int)"""
+        verbose_int = self.verbose()
+        #
+        consumer = self.consumer(topic, **kwargs)
+        #
+        progress_num_messages_int = self.progress_num_messages()
+        consume_tqdm = tqdm(disable=verbose_int <= 0, unit=" msg", desc="Consuming", miniters=progress_num_messages_int, mininterval=0)
+        #
+        def foldl_batch_fun1(acc_consume_message_counter_int_tuple, m_list):
+            (acc, consume_message_counter_int) = acc_consume_message_counter_int_tuple
+            #
+            acc = foldl_batch_fun(acc, m_list)
+            #
+            consume_message_counter_int += len(m_list)
+            #
+            consume_tqdm.update(len(m_list))
+            #
+            return (acc, consume_message_counter_int)
+        #
+        acc_consume_message_counter_int_tuple = consumer.foldl_batch(foldl_batch_fun1, (initial_acc, 0), n, **kwargs)
+        #
+        consumer.close()
+        # Finalize tqdm with a newline.
+        if (verbose_int > 0):
+            consume_tqdm.close()
+            print()
+        #
+        return acc_consume_message_counter_int_tuple
+
+    def iter(self, topic, n=ALL_MESSAGES, **kwargs):
+        """Lazily consume up to n messages of a topic batch by batch (bounded memory, e.g. for huge topics), then close the consumer.
+
+        Args:
+            topic: topic name
+            n: max messages to consume; ALL_MESSAGES for no limit
+            **kwargs: passed to consumer()/consumer.iter()
+
+        Returns:
+            generator: yields deserialized message dicts"""
+        consumer = self.consumer(topic, **kwargs)
+        #
+        try:
+            yield from consumer.iter(n, **kwargs)
+        finally:
+            consumer.close()
+
     #
 
     def flatmap(self, topic, flatmap_fun, n=ALL_MESSAGES, **kwargs):
@@ -67,6 +226,10 @@ class Functional:
             #
             return list
         #
+        # Concatenate the results of the workers if run in parallel (grouped by partition).
+        if "combine_fun" not in kwargs:
+            kwargs["combine_fun"] = lambda list1, list2: list1 + list2
+        #
         return self.foldl(topic, foldl_fun, [], n, **kwargs)
 
     def map(self, topic, map_fun, n=ALL_MESSAGES, **kwargs):
@@ -85,6 +248,24 @@ class Functional:
         #
         return self.flatmap(topic, flatmap_fun, n, **kwargs)
 
+    def map_batch(self, topic, map_batch_fun, n=ALL_MESSAGES, **kwargs):
+        """Consume a topic and transform whole batches of messages into lists of results, collected into a list.
+
+        Args:
+            topic: topic name
+            map_batch_fun: list of m -> list of results
+            n: max messages to consume; ALL_MESSAGES for no limit
+            **kwargs: passed to foldl_batch()
+
+        Returns:
+            tuple: (list of results, number of messages consumed as int)"""
+        def foldl_batch_fun(list, m_list):
+            list += map_batch_fun(m_list)
+            #
+            return list
+        #
+        return self.foldl_batch(topic, foldl_batch_fun, [], n, **kwargs)
+
     def filter(self, topic, filter_fun, n=ALL_MESSAGES, **kwargs):
         """Consume a topic and keep only messages matching a predicate, collected into a list.
 
@@ -0,0 +1,90 @@
+import asyncio
+import functools
+
+from kafi.kafka.cluster.cluster_consumer import ClusterConsumer
+
+# Constants
+
+ALL_MESSAGES = -1
+
+#
+
+# asyncio wrapper around ClusterConsumer: the blocking librdkafka calls (consume, commit, close...) are offloaded to an executor (by default the default executor of the event loop, i.e. no extra thread per consumer), so that many consumers can be driven concurrently from one event loop.
+class AIOClusterConsumer:
+    def __init__(self, cluster_obj, *topics, **kwargs):
+        self.executor = kwargs["executor"] if "executor" in kwargs else None
+        #
+        self.consumer_obj = ClusterConsumer(cluster_obj, *topics, **{key_str: value for key_str, value in kwargs.items() if key_str != "executor"})
+        #
+        self.topic_str_list = self.consumer_obj.topic_str_list
+        self.group_str = self.consumer_obj.group_str
+        #
+        # Serialize the calls on the (not thread-safe) consumer.
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def __aiter__(self):
+        return self.iter()
+
+    #
+
+    async def run(self, fun, *args, **kwargs):
+        async with self.lock:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(fun, *args, **kwargs))
+
+    #
+
+    async def close(self):
+        return await self.run(self.consumer_obj.close)
+
+    async def commit(self, offsets=None, **kwargs):
+        return await self.run(self.consumer_obj.commit, offsets, **kwargs)
+
+    async def offsets(self, **kwargs):
+        return await self.run(self.consumer_obj.offsets, **kwargs)
+
+    #
+
+    async def consume(self, n=ALL_MESSAGES, **kwargs):
+        return await self.run(self.consumer_obj.consume, n, **kwargs)
+
+    async def iter_batch(self, n=ALL_MESSAGES, commit_after_processing=None, **kwargs):
+        m_list_iterator = self.consumer_obj.iter_batch(n, commit_after_processing, **kwargs)
+        try:
+            while True:
+                # Consume the next batch (and commit the previous one) in the executor.
+                m_list = await self.run(next, m_list_iterator, None)
+                if m_list is None:
+                    break
+                #
+                yield m_list
+        finally:
+            await self.run(m_list_iterator.close)
+
+    # A batch counts as processed as soon as the first message of the next batch is requested (i.e. the offsets are committed per batch).
+    async def iter(self, n=ALL_MESSAGES, commit_after_processing=None, **kwargs):
+        m_list_iterator = self.iter_batch(n, commit_after_processing, **kwargs)
+        try:
+            async for m_list in m_list_iterator:
+                for m in m_list:
+                    yield m
+        finally:
+            await m_list_iterator.aclose()
+
+    async def foldl(self, foldl_fun, initial_acc, n=ALL_MESSAGES, commit_after_processing=None, **kwargs):
+        acc = initial_acc
+        #
+        m_list_iterator = self.iter_batch(n, commit_after_processing, **kwargs)
+        try:
+            async for m_list in m_list_iterator:
+                for m in m_list:
+                    acc = foldl_fun(acc, m)
+        finally:
+            await m_list_iterator.aclose()
+        #
+        return acc
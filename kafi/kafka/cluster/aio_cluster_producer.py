@@ -0,0 +1,60 @@
+import asyncio
+import functools
+
+from kafi.kafka.cluster.cluster_producer import ClusterProducer
+
+#
+
+# asyncio wrapper around ClusterProducer: the messages are produced in pipelined mode (see ClusterProducer.produce_impl_pipelined()) and the blocking librdkafka calls (produce, poll, flush) are offloaded to an executor (by default the default executor of the event loop, i.e. no extra thread per producer), so that many producers can be driven concurrently from one event loop.
+class AIOClusterProducer:
+    def __init__(self, cluster_obj, topic, **kwargs):
+        self.executor = kwargs["executor"] if "executor" in kwargs else None
+        #
+        self.producer_obj = ClusterProducer(cluster_obj, topic, **{key_str: value for key_str, value in kwargs.items() if key_str != "executor"})
+        #
+        self.topic_str = self.producer_obj.topic_str
+        #
+        # Serialize the calls on the producer (the bookkeeping of the messages in flight is not thread-safe).
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    #
+
+    async def run(self, fun, *args, **kwargs):
+        async with self.lock:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(fun, *args, **kwargs))
+
+    #
+
+    async def close(self):
+        return await self.run(self.producer_obj.close)
+
+    async def flush(self):
+        return await self.run(self.producer_obj.flush)
+
+    #
+
+    # Produce the messages and wait for their delivery reports (raises an exception if any message could not be delivered).
+    async def produce_list(self, m_list, **kwargs):
+        produce_result = await self.run(self.producer_obj.produce_list, m_list, pipelined=True, **kwargs)
+        #
+        return await self.wait(produce_result, **kwargs)
+
+    async def produce(self, value, **kwargs):
+        produce_result = await self.run(self.producer_obj.produce, value, pipelined=True, **kwargs)
+        #
+        return await self.wait(produce_result, **kwargs)
+
+    async def wait(self, produce_result, **kwargs):
+        timeout_float = kwargs["timeout"] if "timeout" in kwargs else None
+        #
+        exception = await self.run(produce_result.exception, timeout_float)
+        if exception is not None:
+            raise exception
+        #
+        return produce_result
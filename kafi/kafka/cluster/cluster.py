@@ -1,3 +1,5 @@
+from kafi.kafka.cluster.aio_cluster_consumer import AIOClusterConsumer
+from kafi.kafka.cluster.aio_cluster_producer import AIOClusterProducer
 from kafi.kafka.cluster.cluster_admin import ClusterAdmin
 from kafi.kafka.cluster.cluster_consumer import ClusterConsumer
 from kafi.kafka.cluster.cluster_producer import ClusterProducer
@@ -30,6 +32,10 @@ class Cluster(Kafka):
         #
         return admin
 
+    def close(self):
+        # Close the long-lived clients of the admin (e.g. its helper consumer).
+        self.admin.close()
+
     #
     def get_consumer(self, topics, **kwargs):
         consumer = ClusterConsumer(self, topics, **kwargs)
@@ -42,3 +48,15 @@ class Cluster(Kafka):
         producer = ClusterProducer(self, topic, **kwargs)
         #
         return producer
+
+    # asyncio
+
+    def aio_consumer(self, topics, **kwargs):
+        aio_consumer = AIOClusterConsumer(self, topics, **kwargs)
+        #
+        return aio_consumer
+
+    def aio_producer(self, topic, **kwargs):
+        aio_producer = AIOClusterProducer(self, topic, **kwargs)
+        #
+        return aio_producer
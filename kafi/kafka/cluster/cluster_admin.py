@@ -2,8 +2,8 @@ from fnmatch import fnmatch
 
 from kafi.kafka.kafka_admin import KafkaAdmin
 
-from confluent_kafka import Consumer, TopicPartition
-from confluent_kafka.admin import AclBinding, AclBindingFilter, AclOperation, AclPermissionType, AdminClient, AlterConfigOpType, ConfigEntry, ConfigResource, _ConsumerGroupState, _ConsumerGroupTopicPartitions, NewPartitions, NewTopic, ResourcePatternType, ResourceType
+from confluent_kafka import Consumer, IsolationLevel, TopicPartition
+from confluent_kafka.admin import AclBinding, AclBindingFilter, AclOperation, AclPermissionType, AdminClient, AlterConfigOpType, ConfigEntry, ConfigResource, _ConsumerGroupState, _ConsumerGroupTopicPartitions, NewPartitions, NewTopic, OffsetSpec, ResourcePatternType, ResourceType
 
 #
 
@@ -16,6 +16,23 @@ class ClusterAdmin(KafkaAdmin):
         super().__init__(cluster_obj, **kwargs)
         #
         self.adminClient = AdminClient(cluster_obj.kafka_config_dict)
+        #
+        # Long-lived helper consumer for metadata lookups (e.g. offsets_for_times()), created on first use.
+        self.helper_consumer = None
+
+    def close(self):
+        # Close the helper consumer explicitly (it is created again on next use).
+        if self.helper_consumer is not None:
+            self.helper_consumer.close()
+            self.helper_consumer = None
+
+    def get_helper_consumer(self):
+        if self.helper_consumer is None:
+            config_dict = self.storage_obj.kafka_config_dict.copy()
+            config_dict["group.id"] = "dummy_group_id"
+            self.helper_consumer = Consumer(config_dict)
+        #
+        return self.helper_consumer
 
     # ACLs
 
@@ -216,21 +233,17 @@ class ClusterAdmin(KafkaAdmin):
         #
         topic_str_partition_int_timestamp_int_dict_dict = self.get_topic_str_partition_int_timestamp_int_dict_dict(topic_str_list, partitions_timestamps)
         #
+        # Look up the offsets of all topics in a single request.
+        topicPartition_list = [TopicPartition(topic_str, partition_int, timestamp_int) for topic_str in topic_str_list for partition_int, timestamp_int in topic_str_partition_int_timestamp_int_dict_dict[topic_str].items()]
+        #
         topic_str_offsets_dict_dict = {}
-        for topic_str in topic_str_list:
-            offsets_dict = {}
+        if topicPartition_list:
+            topicPartition_list1 = self.get_helper_consumer().offsets_for_times(topicPartition_list, timeout=timeout_float)
             #
-            topicPartition_list = [TopicPartition(topic_str, partition_int, timestamp_int) for partition_int, timestamp_int in topic_str_partition_int_timestamp_int_dict_dict[topic_str].items()]
-            if topicPartition_list:
-                config_dict = self.storage_obj.kafka_config_dict.copy()
-                config_dict["group.id"] = "dummy_group_id"
-                consumer = Consumer(config_dict)
-                topicPartition_list1 = consumer.offsets_for_times(topicPartition_list, timeout=timeout_float)
-                #
-                for topicPartition in topicPartition_list1:
-                    offsets_dict[topicPartition.partition] = topicPartition.offset
-                #
-                topic_str_offsets_dict_dict[topic_str] = offsets_dict
+            for topicPartition in topicPartition_list1:
+                if topicPartition.topic not in topic_str_offsets_dict_dict:
+                    topic_str_offsets_dict_dict[topicPartition.topic] = {}
+                topic_str_offsets_dict_dict[topicPartition.topic][topicPartition.partition] = topicPartition.offset
         #
         if replace_not_found_bool:
             topic_str_offsets_dict_dict = self.replace_not_found(topic_str_offsets_dict_dict)
@@ -276,19 +289,38 @@ class ClusterAdmin(KafkaAdmin):
     def watermarks(self, pattern, **kwargs):
         timeout_float = kwargs["timeout"] if "timeout" in kwargs else -1.0
         #
-        config_dict = self.storage_obj.kafka_config_dict.copy()
-        config_dict["group.id"] = f"dummy_group_id"
-        consumer = Consumer(config_dict)
+        # Fetch the metadata of all topics once (instead of once per topic).
+        topic_str_topicMetadata_dict = self.adminClient.list_topics().topics
+        topic_str_list = self.storage_obj.filter_topics(list(topic_str_topicMetadata_dict.keys()), pattern)
+        #
+        topicPartition_list = [TopicPartition(topic_str, partition_int) for topic_str in topic_str_list for partition_int in range(len(topic_str_topicMetadata_dict[topic_str].partitions))]
+        #
+        # Query the low and high watermarks of all partitions in two batched requests (instead of one request per partition).
+        topic_str_partition_int_tuple_low_offset_int_dict = self.list_offsets(topicPartition_list, OffsetSpec.earliest(), timeout_float)
+        topic_str_partition_int_tuple_high_offset_int_dict = self.list_offsets(topicPartition_list, OffsetSpec.latest(), timeout_float)
+        #
+        topic_str_partition_int_offsets_tuple_dict_dict = {topic_str: {partition_int: (topic_str_partition_int_tuple_low_offset_int_dict[(topic_str, partition_int)], topic_str_partition_int_tuple_high_offset_int_dict[(topic_str, partition_int)]) for partition_int in range(len(topic_str_topicMetadata_dict[topic_str].partitions))} for topic_str in topic_str_list}
         #
-        topic_str_list = self.list_topics(pattern)
-        topic_str_partition_int_offsets_tuple_dict_dict = {}
-        for topic_str in topic_str_list:
-            partitions_int = self.partitions(topic_str)[topic_str]
-            partition_int_offsets_tuple_dict = {partition_int: consumer.get_watermark_offsets(TopicPartition(topic_str, partition=partition_int), timeout_float) for partition_int in range(partitions_int)}
-            topic_str_partition_int_offsets_tuple_dict_dict[topic_str] = partition_int_offsets_tuple_dict
-        consumer.close()
         return topic_str_partition_int_offsets_tuple_dict_dict
 
+    def list_offsets(self, topicPartition_list, offsetSpec, timeout_float=-1.0):
+        if not topicPartition_list:
+            return {}
+        #
+        # Use the same isolation level as the consumers of librdkafka (i.e. read_committed unless configured otherwise) such that the high watermarks are the same as returned by Consumer.get_watermark_offsets().
+        isolation_level_str = self.storage_obj.kafka_config_dict["isolation.level"] if "isolation.level" in self.storage_obj.kafka_config_dict else "read_committed"
+        isolationLevel = IsolationLevel.READ_COMMITTED if isolation_level_str == "read_committed" else IsolationLevel.READ_UNCOMMITTED
+        #
+        topicPartition_offsetSpec_dict = {topicPartition: offsetSpec for topicPartition in topicPartition_list}
+        if timeout_float > 0:
+            topicPartition_future_dict = self.adminClient.list_offsets(topicPartition_offsetSpec_dict, isolation_level=isolationLevel, request_timeout=timeout_float)
+        else:
+            topicPartition_future_dict = self.adminClient.list_offsets(topicPartition_offsetSpec_dict, isolation_level=isolationLevel)
+        #
+        topic_str_partition_int_tuple_offset_int_dict = {(topicPartition.topic, topicPartition.partition): future.result().offset for topicPartition, future in topicPartition_future_dict.items()}
+        #
+        return topic_str_partition_int_tuple_offset_int_dict
+
     def delete_records(self, pattern_or_offsets, **kwargs):
         request_timeout_float = kwargs["request_timeout"] if "request_timeout" in kwargs else None
         operation_timeout_float = kwargs["operation_timeout"] if "operation_timeout" in kwargs else None
@@ -299,11 +331,16 @@ class ClusterAdmin(KafkaAdmin):
             topicPartition_list = [TopicPartition(topic_str, partition_int, offset_int) for topic_str, offsets_dict in topic_str_offsets_dict_dict.items() for partition_int, offset_int in offsets_dict.items()]
         else:
             pattern = pattern_or_offsets
-            topic_str_list = self.list_topics(pattern)
+            # Fetch the metadata of all topics once (instead of once per topic).
+            topic_str_topicMetadata_dict = self.adminClient.list_topics().topics
+            topic_str_list = self.storage_obj.filter_topics(list(topic_str_topicMetadata_dict.keys()), pattern)
             for topic_str in topic_str_list:
-                partitions_int = self.partitions(topic_str)[topic_str]
+                partitions_int = len(topic_str_topicMetadata_dict[topic_str].partitions)
                 for partition_int in range(0, partitions_int):
                     topicPartition_list.append(TopicPartition(topic_str, partition_int, OFFSET_END))
+        # Nothing to delete (e.g. the pattern does not match any topic).
+        if not topicPartition_list:
+            return
         #
         if request_timeout_float is not None and operation_timeout_float is not None:
             self.adminClient.delete_records(topicPartition_list, request_timeout=request_timeout_float, operation_timeout=operation_timeout_float)
@@ -4,6 +4,8 @@ from kafi.kafka.kafka_producer import KafkaProducer
 
 from kafi.helpers import get_millis
 
+import time
+
 # Constants
 
 CURRENT_TIME = 0
@@ -11,6 +13,87 @@ RD_KAFKA_PARTITION_UA = -1
 
 #
 
+# The delivery reports of the messages produced by one (pipelined) produce call (future-style).
+class ProduceResult:
+    def __init__(self, cluster_producer_obj, on_delivery_fun=None):
+        self.cluster_producer_obj = cluster_producer_obj
+        # Optional on_delivery function of the user (called after the delivery report has been recorded).
+        self.on_delivery_fun = on_delivery_fun
+        #
+        self.produced_int = 0
+        self.delivered_int = 0
+        self.failed_int = 0
+        # List of (KafkaError, partition, key) tuples.
+        self.kafkaError_partition_int_key_tuple_list = []
+        # Offsets of the last delivered messages per partition.
+        self.partition_int_offset_int_dict = {}
+
+    def __repr__(self):
+        return f"ProduceResult(produced={self.produced_int}, delivered={self.delivered_int}, failed={self.failed_int}, in_flight={self.in_flight()})"
+
+    #
+
+    def on_delivery(self, kafka_error, message):
+        if kafka_error is not None:
+            self.failed_int += 1
+            self.kafkaError_partition_int_key_tuple_list.append((kafka_error, message.partition(), message.key()))
+        else:
+            self.delivered_int += 1
+            partition_int = message.partition()
+            offset_int = message.offset()
+            if partition_int not in self.partition_int_offset_int_dict or offset_int > self.partition_int_offset_int_dict[partition_int]:
+                self.partition_int_offset_int_dict[partition_int] = offset_int
+        #
+        self.cluster_producer_obj.in_flight_int -= 1
+        #
+        if self.on_delivery_fun is not None:
+            self.on_delivery_fun(kafka_error, message)
+
+    #
+
+    def in_flight(self):
+        return self.produced_int - self.delivered_int - self.failed_int
+
+    def done(self):
+        return self.in_flight() == 0
+
+    def errors(self):
+        return self.kafkaError_partition_int_key_tuple_list
+
+    def wait(self, timeout=None):
+        timeout_float = timeout if timeout is not None else self.cluster_producer_obj.storage_obj.flush_timeout()
+        #
+        start_float = time.monotonic()
+        while not self.done():
+            if timeout_float >= 0:
+                remaining_float = timeout_float - (time.monotonic() - start_float)
+                if remaining_float <= 0:
+                    break
+                self.cluster_producer_obj.producer.poll(min(remaining_float, 0.1))
+            else:
+                self.cluster_producer_obj.producer.poll(0.1)
+        #
+        return self.done()
+
+    def exception(self, timeout=None):
+        if not self.wait(timeout):
+            return Exception(f"Timed out waiting for the delivery of {self.in_flight()} messages.")
+        #
+        if self.failed_int > 0:
+            (kafka_error, partition_int, _) = self.kafkaError_partition_int_key_tuple_list[0]
+            return Exception(f"Delivery of {self.failed_int} messages failed (first error on partition {partition_int}: {kafka_error}).")
+        #
+        return None
+
+    def result(self, timeout=None):
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        #
+        return self.partition_int_offset_int_dict
+
+#
+
 class ClusterProducer(KafkaProducer):
     def __init__(self, cluster_obj, topic, **kwargs):
         # The default partitioner function for confluent-kafka is None.
@@ -22,6 +105,13 @@ class ClusterProducer(KafkaProducer):
             if kafka_error is not None:
                 raise Exception(kafka_error)
         self.on_delivery_fun = kwargs["on_delivery"] if "on_delivery" in kwargs else on_delivery
+        # The on_delivery function of the user (if any) is also called in pipelined mode (chained from the delivery report bookkeeping of the ProduceResult).
+        self.user_on_delivery_fun = kwargs["on_delivery"] if "on_delivery" in kwargs else None
+        #
+        # Pipelined produce (produce_async(), produce(..., pipelined=True)): bound for the messages not yet delivered and number of messages to produce between two polls for delivery reports.
+        self.max_in_flight_int = kwargs["max_in_flight"] if "max_in_flight" in kwargs else cluster_obj.max_in_flight()
+        self.poll_batch_size_int = kwargs["poll_batch_size"] if "poll_batch_size" in kwargs else cluster_obj.poll_batch_size()
+        self.in_flight_int = 0
         #
         # Producer config
         #
@@ -52,7 +142,16 @@ class ClusterProducer(KafkaProducer):
 
     #
 
+    def produce_async(self, value, **kwargs):
+        return self.produce(value, pipelined=True, **kwargs)
+
+    #
+
     def produce_impl(self, m_list, **kwargs):
+        pipelined_bool = kwargs["pipelined"] if "pipelined" in kwargs else False
+        if pipelined_bool:
+            return self.produce_impl_pipelined(m_list, **kwargs)
+        #
         flush_bool = kwargs["flush"] if "flush" in kwargs else False
         #
         counter_int = 0
@@ -79,6 +178,50 @@ class ClusterProducer(KafkaProducer):
         #
         return self.written_counter_int
 
+    def produce_impl_pipelined(self, m_list, **kwargs):
+        flush_bool = kwargs["flush"] if "flush" in kwargs else False
+        #
+        on_delivery_fun = kwargs["on_delivery"] if "on_delivery" in kwargs else self.user_on_delivery_fun
+        #
+        produce_result = ProduceResult(self, on_delivery_fun)
+        #
+        counter_int = 0
+        for m in m_list:
+            timestamp = m["timestamp"]
+            timestamp_int = timestamp[1] if isinstance(timestamp, tuple) else timestamp
+            #
+            partition_int = m["partition"]
+            if partition_int == RD_KAFKA_PARTITION_UA and self.partitioner_fun is not None:
+                partition_int = self.partitioner_fun(m, counter_int, self.partitions_int, self.projection_fun)
+            #
+            # Wait for delivery reports if too many messages are in flight.
+            while self.in_flight_int >= self.max_in_flight_int:
+                self.producer.poll(0.1)
+            #
+            while True:
+                try:
+                    self.producer.produce(self.topic_str, m["value"], m["key"], partition=partition_int, timestamp=timestamp_int, headers=m["headers"], on_delivery=produce_result.on_delivery)
+                    break
+                except BufferError:
+                    # The local queue of librdkafka is full.
+                    self.producer.poll(0.1)
+            #
+            produce_result.produced_int += 1
+            self.in_flight_int += 1
+            self.written_counter_int += 1
+            #
+            # Serve the delivery reports in batches (instead of after each message).
+            counter_int += 1
+            if counter_int % self.poll_batch_size_int == 0:
+                self.producer.poll(0)
+        #
+        self.producer.poll(0)
+        #
+        if flush_bool:
+            self.flush()
+        #
+        return produce_result
+
     #
 
     def init_transactions(self, **kwargs):
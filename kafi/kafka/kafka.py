@@ -47,6 +47,16 @@ class Kafka(Storage):
         else:
             self.session_timeout_ms(int(self.kafi_config_dict["session.timeout.ms"]))
         #
+        if "max.in.flight" not in self.kafi_config_dict:
+            self.max_in_flight(100000)
+        else:
+            self.max_in_flight(int(self.kafi_config_dict["max.in.flight"]))
+        #
+        if "poll.batch.size" not in self.kafi_config_dict:
+            self.poll_batch_size(1000)
+        else:
+            self.poll_batch_size(int(self.kafi_config_dict["poll.batch.size"]))
+        #
         # both cluster and restproxy kafi section
         #
         if "fetch.min.bytes" not in self.kafi_config_dict:
@@ -86,6 +96,12 @@ class Kafka(Storage):
     def session_timeout_ms(self, new_value=None): # int
         return self.get_set_config("session.timeout.ms", new_value)
 
+    def max_in_flight(self, new_value=None): # int
+        return self.get_set_config("max.in.flight", new_value)
+
+    def poll_batch_size(self, new_value=None): # int
+        return self.get_set_config("poll.batch.size", new_value)
+
     # RestProxy
 
     def fetch_min_bytes(self, new_value=None): # int
@@ -153,6 +153,16 @@ class RestProxyConsumer(KafkaConsumer):
 
     #
 
+    def seek(self, topic_str, partition_int, offset_int):
+        (rest_proxy_url_str, auth_str_tuple) = self.storage_obj.get_url_str_auth_str_tuple_tuple()
+        #
+        url_str = f"{rest_proxy_url_str}/consumers/{self.group_str}/instances/{self.instance_id_str}/positions"
+        headers_dict = {"Content-Type": "application/vnd.kafka.v2+json"}
+        payload_dict = {"offsets": [{"topic": topic_str, "partition": partition_int, "offset": offset_int}]}
+        post(url_str, headers_dict, payload_dict, auth_str_tuple=auth_str_tuple, retries_int=self.storage_obj.requests_num_retries(), debug_bool=self.storage_obj.verbose() >= 2)
+
+    #
+
     def commit(self, offsets=None, **kwargs):
         offsets_dict = offsets
         #
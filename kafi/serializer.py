@@ -27,6 +27,11 @@ class Serializer(SchemaRegistry):
         #
         self.key_serializer = self.get_serializer(True)
         self.value_serializer = self.get_serializer(False)
+        #
+        # Resolved serialization functions per (type, key/value).
+        self.type_str_key_bool_tuple_serialize_fun_dict = {}
+        self.key_serialize_fun = self.get_serialize_fun(True)
+        self.value_serialize_fun = self.get_serialize_fun(False)
 
 
     def serialize(self, payload, key_bool):
@@ -38,44 +43,52 @@ class Serializer(SchemaRegistry):
 
         Returns:
             bytes: serialized payload (None if payload was None)"""
+        serialize_fun = self.get_serialize_fun(key_bool)
+        #
+        return serialize_fun(payload)
+
+    def get_serialize_fun(self, key_bool):
+        """Resolve the configured type into a serialization function (once per producer instead of once per payload).
+
+        Args:
+            key_bool: True for the key serialization function, False for the value serialization function
+
+        Returns:
+            function: payload -> serialized payload bytes (None if payload is None)"""
         type_str = self.key_type_str if key_bool else self.value_type_str
-        messageField = MessageField.KEY if key_bool else MessageField.VALUE
+        type_str_key_bool_tuple = (type_str.lower(), key_bool)
+        if type_str_key_bool_tuple in self.type_str_key_bool_tuple_serialize_fun_dict:
+            return self.type_str_key_bool_tuple_serialize_fun_dict[type_str_key_bool_tuple]
+        #
         serializer = self.key_serializer if key_bool else self.value_serializer
+        serializationContext = SerializationContext(self.topic_str, MessageField.KEY if key_bool else MessageField.VALUE)
         #
-        def payload_to_serializer_payload():
-            try:
-                if isinstance(payload, bytes):
-                    serializer_payload = json.loads(payload)
-                elif isinstance(payload, str):
-                    serializer_payload = json.loads(payload)
-                else:
-                    serializer_payload = payload
-            except (json.JSONDecodeError, TypeError):
-                serializer_payload = payload
+        if type_str.lower() in ["bytes", "str", "string", "json"]:
+            def serialize_fun(payload):
+                return None if payload is None else to_bytes(payload)
+        elif type_str.lower() in ["avro", "jsonschema", "json_sr"]:
+            def serialize_fun(payload):
+                return None if payload is None else serializer(payload_to_serializer_payload(payload), serializationContext)
+        elif type_str.lower() in ["pb", "protobuf"]:
+            generalizedProtocolMessageType = self.key_generalizedProtocolMessageType if key_bool else self.value_generalizedProtocolMessageType
             #
-            return serializer_payload
-        #
-        if payload == None:
-            serialized_payload_bytes = None
-        else:
-            if type_str.lower() in ["bytes", "str", "string", "json"]:
-                serialized_payload_bytes = to_bytes(payload)
-            elif type_str.lower() == "avro":
-                payload_dict = payload_to_serializer_payload()
-                serialized_payload_bytes = serializer(payload_dict, SerializationContext(self.topic_str, messageField))
-            elif type_str.lower() in ["jsonschema", "json_sr"]:
-                payload_dict = payload_to_serializer_payload()
-                serialized_payload_bytes = serializer(payload_dict, SerializationContext(self.topic_str, messageField))
-            elif type_str.lower() in ["pb", "protobuf"]:
-                generalizedProtocolMessageType = self.key_generalizedProtocolMessageType if key_bool else self.value_generalizedProtocolMessageType
-                payload_dict = payload_to_serializer_payload()
+            def serialize_fun(payload):
+                if payload is None:
+                    return None
+                #
                 protobuf_message = generalizedProtocolMessageType()
-                ParseDict(payload_dict, protobuf_message)
-                serialized_payload_bytes = serializer(protobuf_message, SerializationContext(self.topic_str, messageField))
-            else:
+                ParseDict(payload_to_serializer_payload(payload), protobuf_message)
+                return serializer(protobuf_message, serializationContext)
+        else:
+            def serialize_fun(payload):
+                if payload is None:
+                    return None
+                #
                 raise Exception("Only \"bytes\", \"str\", \"json\", \"avro\", \"protobuf\" (\"pb\") and \"jsonschema\" (\"json_sr\") supported.")
         #
-        return serialized_payload_bytes
+        self.type_str_key_bool_tuple_serialize_fun_dict[type_str_key_bool_tuple] = serialize_fun
+        #
+        return serialize_fun
 
     # Helpers
 
@@ -256,3 +269,25 @@ class Serializer(SchemaRegistry):
             self.key_normalize_schemas = kwargs["key_normalize_schemas"]
         if "value_normalize_schemas" in kwargs:
             self.value_normalize_schemas = kwargs["value_normalize_schemas"]
+
+#
+
+def payload_to_serializer_payload(payload):
+    """Parse bytes/str payloads as JSON for the schema registry serializers (other payloads are passed through).
+
+    Args:
+        payload: value to serialize
+
+    Returns:
+        any: parsed payload (or payload itself if it is not valid JSON)"""
+    try:
+        if isinstance(payload, bytes):
+            serializer_payload = json.loads(payload)
+        elif isinstance(payload, str):
+            serializer_payload = json.loads(payload)
+        else:
+            serializer_payload = payload
+    except (json.JSONDecodeError, TypeError):
+        serializer_payload = payload
+    #
+    return serializer_payload
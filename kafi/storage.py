@@ -1,6 +1,7 @@
 import glob
 import os
 from pathlib import Path
+import time
 
 from piny import YamlLoader
 
@@ -103,6 +104,14 @@ class Storage(Shell, Files, AddOns, SchemaRegistry):
             self.topic_ignore_patterns(["_*"])
         else:
             self.topic_ignore_patterns(list(self.kafi_config_dict["topic.ignore.patterns"]))
+        #
+        if "metadata.cache.ttl.ms" not in self.kafi_config_dict:
+            self.metadata_cache_ttl_ms(1000)
+        else:
+            self.metadata_cache_ttl_ms(int(self.kafi_config_dict["metadata.cache.ttl.ms"]))
+        #
+        # Cache for the topic metadata (e.g. the number of partitions looked up by every consumer/producer): {key: (monotonic time in ms, value)}.
+        self.metadata_cache_dict = {}
 
     #
 
@@ -204,6 +213,47 @@ class Storage(Shell, Files, AddOns, SchemaRegistry):
             list of str: current value"""
         return self.get_set_config("topic.ignore.patterns", new_value)
 
+    def metadata_cache_ttl_ms(self, new_value=None): # int
+        """Get/set how long (in ms) topic metadata like the number of partitions is cached; 0 disables the cache (int).
+
+        Returns:
+            int: current value"""
+        return self.get_set_config("metadata.cache.ttl.ms", new_value)
+
+    #
+
+    def get_cached_metadata(self, key, fun, is_cacheable_fun=lambda _: True):
+        """Look up topic metadata in the metadata cache, calling fun on a miss or after metadata_cache_ttl_ms().
+
+        Args:
+            key: hashable cache key, e.g. ("partitions", ("topic1", "topic2"))
+            fun: () -> value, fetches the metadata from the storage
+            is_cacheable_fun: value -> bool, whether to cache a freshly fetched value
+
+        Returns:
+            any: the (cached or freshly fetched) value"""
+        ttl_ms_int = self.metadata_cache_ttl_ms()
+        if ttl_ms_int <= 0:
+            return fun()
+        #
+        now_ms_int = int(time.monotonic() * 1000)
+        if key in self.metadata_cache_dict:
+            (cached_ms_int, value) = self.metadata_cache_dict[key]
+            if now_ms_int - cached_ms_int < ttl_ms_int:
+                return value
+        #
+        value = fun()
+        if is_cacheable_fun(value):
+            self.metadata_cache_dict[key] = (now_ms_int, value)
+        else:
+            self.metadata_cache_dict.pop(key, None)
+        #
+        return value
+
+    def invalidate_metadata_cache(self):
+        """Drop all cached topic metadata (e.g. after creating/deleting topics or changing their partitions)."""
+        self.metadata_cache_dict = {}
+
     #
 
     def get_set_config(self, config_key_str, new_value=None, dict=None):
@@ -451,6 +501,8 @@ class Storage(Shell, Files, AddOns, SchemaRegistry):
 
         Returns:
             as returned by admin.create()"""
+        self.invalidate_metadata_cache()
+        #
         return self.admin.create(topic, partitions, **kwargs)
     
     touch = create
@@ -464,6 +516,8 @@ class Storage(Shell, Files, AddOns, SchemaRegistry):
 
         Returns:
             as returned by admin.delete()"""
+        self.invalidate_metadata_cache()
+        #
         return self.admin.delete(pattern, **kwargs)
 
     rm = delete
@@ -481,7 +535,7 @@ class Storage(Shell, Files, AddOns, SchemaRegistry):
         return self.admin.offsets_for_times(pattern, partitions_timestamps, **kwargs)
 
     def partitions(self, pattern, partitions=None, verbose=False, **kwargs):
-        """Get or set the number of partitions, delegating to the admin client.
+        """Get or set the number of partitions, delegating to the admin client (the number of partitions is cached for metadata_cache_ttl_ms()).
 
         Args:
             pattern: glob pattern(s) matching topic names
@@ -491,7 +545,20 @@ class Storage(Shell, Files, AddOns, SchemaRegistry):
 
         Returns:
             as returned by admin.partitions()"""
-        return self.admin.partitions(pattern, partitions, verbose, **kwargs)
+        if partitions is not None:
+            self.invalidate_metadata_cache()
+            #
+            return self.admin.partitions(pattern, partitions, verbose, **kwargs)
+        elif verbose:
+            return self.admin.partitions(pattern, partitions, verbose, **kwargs)
+        #
+        pattern_str_list = [pattern] if pattern is None or isinstance(pattern, str) else list(pattern)
+        # Do not cache the result if an explicitly named topic is missing (e.g. it might be created by another process soon).
+        topic_str_list = [pattern_str for pattern_str in pattern_str_list if pattern_str is not None and not any(c in pattern_str for c in "*?[")]
+        #
+        topic_str_partitions_int_dict = self.get_cached_metadata(("partitions", tuple(pattern_str_list)), lambda: self.admin.partitions(pattern, partitions, verbose, **kwargs), lambda topic_str_partitions_int_dict: all(topic_str in topic_str_partitions_int_dict for topic_str in topic_str_list))
+        #
+        return dict(topic_str_partitions_int_dict)
 
     # Groups
 
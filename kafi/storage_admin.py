@@ -87,17 +87,18 @@ class StorageAdmin():
         #
         return topic_str_partition_int_timestamp_int_dict_dict 
 
-    def replace_not_found(self, topic_str_offsets_dict_dict):
+    def replace_not_found(self, topic_str_offsets_dict_dict, **kwargs):
         """Replace not-found (-1) offsets with the topic's high watermark minus one.
 
         Args:
             topic_str_offsets_dict_dict: {topic: {partition: offset}}, possibly containing -1 entries
+            **kwargs: passed to watermarks() (e.g. manifests already read by file-based storages)
 
         Returns:
             dict: {topic: {partition: offset}} with -1 entries replaced"""
         for topic_str, offsets_dict in topic_str_offsets_dict_dict.items():
             if any(offset_int == -1 for offset_int in offsets_dict.values()):
-                partition_int_offsets_tuple_dict = self.storage_obj.watermarks(topic_str)[topic_str]
+                partition_int_offsets_tuple_dict = self.storage_obj.watermarks(topic_str, **kwargs)[topic_str]
                 for partition_int, offset_int in offsets_dict.items():
                     if offset_int == -1:
                         high_watermark_int = partition_int_offsets_tuple_dict[partition_int][1]
@@ -1,7 +1,7 @@
 from kafi.dechunker import Dechunker
 from kafi.helpers import get_millis
 
-import copy, sys
+import copy, queue, sys, threading
 
 from tqdm.auto import tqdm
 
@@ -72,6 +72,10 @@ class StorageConsumer(Dechunker):
         self.schema_id_int_generalizedProtocolMessageType_protobuf_schema_str_tuple_dict = {}
         #
         super().__init__(storage_obj.schema_registry_config_dict, **kwargs)
+        #
+        # Resolve the key and value types into deserialization functions once per topic (instead of per message).
+        self.topic_str_key_deserialize_fun_dict = {topic_str: self.get_consumer_deserialize_fun(key_type_str, topic_str, True) for topic_str, key_type_str in self.topic_str_key_type_str_dict.items()}
+        self.topic_str_value_deserialize_fun_dict = {topic_str: self.get_consumer_deserialize_fun(value_type_str, topic_str, False) for topic_str, value_type_str in self.topic_str_value_type_str_dict.items()}
 
     #
 
@@ -83,14 +87,171 @@ class StorageConsumer(Dechunker):
             initial_acc: starting accumulator value
             n: max messages to consume; ALL_MESSAGES for no limit
             commit_after_processing: override the storage default for when offsets are committed
-            **kwargs: last_n, consume_batch_size, break_fun (acc, m) -> bool to stop early, dechunk
+            **kwargs: last_n, consume_batch_size, break_fun (acc, m) -> bool to stop early (before folding m), dechunk, prefetch_batches, project, prefilter
 
         Returns:
             any: final accumulated value"""
+        break_fun = kwargs["break_fun"] if "break_fun" in kwargs else lambda _, _1: False
+        #
+        acc = initial_acc
+        #
+        m_iterator = self.iter(n, commit_after_processing, **kwargs)
+        try:
+            for m in m_iterator:
+                if break_fun(acc, m):
+                    break
+                #
+                acc = foldl_fun(acc, m)
+        finally:
+            m_iterator.close()
+        #
+        return acc
+
+    def foldl_batch(self, foldl_batch_fun, initial_acc, n=ALL_MESSAGES, commit_after_processing=None, **kwargs):
+        """Consume and fold over whole batches of messages (amortizes the per-message overhead of foldl()).
+
+        Args:
+            foldl_batch_fun: (acc, list of m) -> new acc
+            initial_acc: starting accumulator value
+            n: max messages to consume; ALL_MESSAGES for no limit
+            commit_after_processing: override the storage default for when offsets are committed
+            **kwargs: last_n, consume_batch_size, dechunk, prefetch_batches, project, prefilter
+
+        Returns:
+            any: final accumulated value"""
+        acc = initial_acc
+        #
+        for m_list in self.iter_batch(n, commit_after_processing, **kwargs):
+            acc = foldl_batch_fun(acc, m_list)
+        #
+        return acc
+
+    def iter(self, n=ALL_MESSAGES, commit_after_processing=None, **kwargs):
+        """Lazily consume messages batch by batch (with dechunking, deserialization, offset tracking, commits), i.e. only one batch is kept in memory.
+
+        A message counts as processed as soon as the next message is requested. The offsets of the processed messages are committed whenever a batch is exhausted and when the iterator is closed early (e.g. by a break), without consuming another batch. If closed early, the consumer is rewound to the unprocessed messages of the batch.
+
+        Args:
+            n: max messages to consume; ALL_MESSAGES for no limit
+            commit_after_processing: override the storage default for when offsets are committed
+            **kwargs: last_n, consume_batch_size, dechunk, prefetch_batches, project, prefilter
+
+        Returns:
+            generator: yields deserialized message dicts"""
+        commit_bool = self.is_commit_after_processing(commit_after_processing)
+        #
+        topic_str_offsets_dict_dict = self.create_offsets_to_commit()
+        uncommitted_bool = False
+        # Messages dropped by the prefilter (their offsets are committed as soon as the messages before them have been processed).
+        prefiltered_m_list = []
+        #
+        m_list = []
+        processed_int = 0
+        m_list_iterator = self.consume_batches(n, prefiltered_m_list, **kwargs)
+        try:
+            for m_list in m_list_iterator:
+                processed_int = 0
+                for m in m_list:
+                    yield m
+                    # The caller has asked for the next message, i.e. m has been processed.
+                    topic_str_offsets_dict_dict[m["topic"]][m["partition"]] = m["offset"] + 1
+                    processed_int += 1
+                    uncommitted_bool = True
+                #
+                if self.skip_prefiltered(topic_str_offsets_dict_dict, prefiltered_m_list, []):
+                    uncommitted_bool = True
+                #
+                if commit_bool and uncommitted_bool:
+                    self.commit(topic_str_offsets_dict_dict)
+                    uncommitted_bool = False
+        finally:
+            # Closed early (e.g. break in the loop of the caller)? Do not skip the unprocessed messages of the batch if the consumer is used again (rewound after consume_batches() has rewound to the messages after them).
+            m_list_iterator.close()
+            if m_list[processed_int:]:
+                self.rewind(m_list[processed_int:])
+            # Only skip the prefiltered messages before the unprocessed ones.
+            if self.skip_prefiltered(topic_str_offsets_dict_dict, prefiltered_m_list, m_list[processed_int:]):
+                uncommitted_bool = True
+            #
+            if commit_bool and uncommitted_bool:
+                self.commit(topic_str_offsets_dict_dict)
+
+    def iter_batch(self, n=ALL_MESSAGES, commit_after_processing=None, **kwargs):
+        """Lazily consume whole batches of messages (with dechunking, deserialization, offset tracking, commits).
+
+        A batch counts as processed as soon as the next batch is requested (its offsets are committed then).
+
+        Args:
+            n: max messages to consume; ALL_MESSAGES for no limit
+            commit_after_processing: override the storage default for when offsets are committed
+            **kwargs: last_n, consume_batch_size, dechunk, prefetch_batches, project, prefilter
+
+        Returns:
+            generator: yields lists of deserialized message dicts"""
+        commit_bool = self.is_commit_after_processing(commit_after_processing)
+        #
+        topic_str_offsets_dict_dict = self.create_offsets_to_commit()
+        # Messages dropped by the prefilter (their offsets are committed together with the next processed batch).
+        prefiltered_m_list = []
+        #
+        for m_list in self.consume_batches(n, prefiltered_m_list, **kwargs):
+            yield m_list
+            #
+            for m in m_list:
+                topic_str_offsets_dict_dict[m["topic"]][m["partition"]] = m["offset"] + 1
+            self.skip_prefiltered(topic_str_offsets_dict_dict, prefiltered_m_list, [])
+            #
+            if commit_bool:
+                self.commit(topic_str_offsets_dict_dict)
+        #
+        # Messages dropped by the prefilter after the last batch.
+        if self.skip_prefiltered(topic_str_offsets_dict_dict, prefiltered_m_list, []) and commit_bool:
+            self.commit(topic_str_offsets_dict_dict)
+
+    def skip_prefiltered(self, topic_str_offsets_dict_dict, prefiltered_m_list, unprocessed_m_list):
+        """Advance the offsets to commit over the messages dropped by the prefilter, unless there is an unprocessed message before them on their partition.
+
+        Args:
+            topic_str_offsets_dict_dict: offsets to commit (updated in place)
+            prefiltered_m_list: messages dropped by the prefilter (the skipped ones are removed)
+            unprocessed_m_list: messages yielded by consume_batches() but not processed yet
+
+        Returns:
+            bool: True if any offsets have been advanced"""
+        topic_str_partition_int_tuple_offset_int_dict = {}
+        for m in unprocessed_m_list:
+            topic_str_partition_int_tuple = (m["topic"], m["partition"])
+            if topic_str_partition_int_tuple not in topic_str_partition_int_tuple_offset_int_dict or m["offset"] < topic_str_partition_int_tuple_offset_int_dict[topic_str_partition_int_tuple]:
+                topic_str_partition_int_tuple_offset_int_dict[topic_str_partition_int_tuple] = m["offset"]
+        #
+        advanced_bool = False
+        remaining_m_list = []
+        for m in prefiltered_m_list:
+            topic_str_partition_int_tuple = (m["topic"], m["partition"])
+            if topic_str_partition_int_tuple in topic_str_partition_int_tuple_offset_int_dict and m["offset"] > topic_str_partition_int_tuple_offset_int_dict[topic_str_partition_int_tuple]:
+                remaining_m_list.append(m)
+            else:
+                offsets_dict = topic_str_offsets_dict_dict[m["topic"]]
+                offsets_dict[m["partition"]] = max(offsets_dict[m["partition"]], m["offset"] + 1)
+                advanced_bool = True
+        prefiltered_m_list[:] = remaining_m_list
+        #
+        return advanced_bool
+
+    def consume_batches(self, n=ALL_MESSAGES, prefiltered_m_list=None, **kwargs):
+        """Consume, dechunk and deserialize batch by batch, checking the end offsets and n once per batch (not per message).
+
+        Args:
+            n: max messages to consume; ALL_MESSAGES for no limit
+            prefiltered_m_list: optional list extended by the (raw) messages dropped by the prefilter, so that the caller can commit their offsets as well
+            **kwargs: last_n, consume_batch_size, dechunk, prefetch_batches (number of raw batches to prefetch in a background thread; 0 = no prefetching), project (list of "key", "value" and/or "headers" to return - the others are not deserialized and set to None; the metadata is always returned), prefilter (raw message dict with the key and value not yet deserialized -> bool; only the messages passing it are deserialized and counted for n)
+
+        Returns:
+            generator: yields (non-empty) lists of deserialized message dicts"""
         n_int = n
         #
         if n_int == 0:
-            return initial_acc
+            return
         #
         # Get last_n (to read n messages from the end of the topic).
         last_n_int = kwargs["last_n"] if "last_n" in kwargs else None
@@ -98,87 +259,201 @@ class StorageConsumer(Dechunker):
             self.topic_str_next_offsets_dict_dict = self.get_last_n_start_offsets(self.topic_str_list, last_n_int)
             n_int = last_n_int
         #
-        commit_after_processing_bool = self.storage_obj.commit_after_processing() if commit_after_processing is None else commit_after_processing
-        #
         consume_batch_size_int = kwargs["consume_batch_size"] if "consume_batch_size" in kwargs else self.storage_obj.consume_batch_size()
         if n_int != ALL_MESSAGES and consume_batch_size_int > n_int:
             consume_batch_size_int = n_int
         #
-        break_fun = kwargs["break_fun"] if "break_fun" in kwargs else lambda _, _1: False
-        #
         dechunk_bool = kwargs["dechunk"] if "dechunk" in kwargs else False
         #
-        topic_str_partitions_int_dict = self.storage_obj.partitions(self.topic_str_list)
-        topic_str_offsets_dict_dict = {topic_str: {partition_int: 0 for partition_int in range(partitions_int)} for topic_str, partitions_int in topic_str_partitions_int_dict.items()}
+        prefetch_batches_int = kwargs["prefetch_batches"] if "prefetch_batches" in kwargs else 0
+        #
+        project_str_list = kwargs["project"] if "project" in kwargs else ["key", "value", "headers"]
+        if isinstance(project_str_list, str):
+            project_str_list = [project_str_list]
+        for project_str in project_str_list:
+            if project_str not in ["key", "value", "headers"]:
+                raise Exception(f"Unknown field \"{project_str}\" to project (use \"key\", \"value\" and/or \"headers\").")
+        project_headers_bool = "headers" in project_str_list
+        #
+        prefilter_fun = kwargs["prefilter"] if "prefilter" in kwargs else None
+        #
+        # Only filter by end offsets if there are any.
+        topic_str_end_offsets_dict_dict = {topic_str: end_offsets_dict for topic_str, end_offsets_dict in self.topic_str_end_offsets_dict_dict.items() if any(end_offset_int != sys.maxsize for end_offset_int in end_offsets_dict.values())}
+        topic_str_positions_dict_dict = {topic_str: {partition_int: 0 for partition_int in end_offsets_dict.keys()} for topic_str, end_offsets_dict in topic_str_end_offsets_dict_dict.items()}
         #
         message_counter_int = 0
         #
-        acc = initial_acc
-        break_bool = False
+        # Do not deserialize the keys/values which are not projected.
+        topic_str_key_deserialize_fun_dict = self.topic_str_key_deserialize_fun_dict if "key" in project_str_list else {topic_str: lambda _: None for topic_str in self.topic_str_list}
+        topic_str_value_deserialize_fun_dict = self.topic_str_value_deserialize_fun_dict if "value" in project_str_list else {topic_str: lambda _: None for topic_str in self.topic_str_list}
         #
-        def deserialize(payload_bytes, type_str, topic_str, key_bool):
-            # Do not deserialize if this is a RestProxyConsumer object (deserialization has already taken place on the REST Proxy). 
-            if self.__class__.__name__ == "RestProxyConsumer":
-                return payload_bytes
-            else:
-                return self.deserialize(payload_bytes, type_str, topic_str, key_bool)
+        # Messages which have been consumed from the storage but not yielded (prefetched or cut off by n) - the consumer is rewound to them when done.
+        unprocessed_m_list = []
         #
-        while True:
-            m_list1 = self.consume_impl(n=consume_batch_size_int, **kwargs)
-            if not m_list1:
-                break
-            #
-            # Dechunk if necessary/enabled.
-            if dechunk_bool:
-                m_list2 = self.dechunk(m_list1)
-            else:
-                m_list2 = m_list1
-            #
-            for m in m_list2:
-                topic_str = m["topic"]
-                partition_int = m["partition"]
-                offset_int = m["offset"]
-                #
-                offsets_dict = topic_str_offsets_dict_dict[topic_str]
+        if prefetch_batches_int > 0:
+            m_list_iterator = self.prefetch_batches(consume_batch_size_int, prefetch_batches_int, unprocessed_m_list, **kwargs)
+        else:
+            m_list_iterator = iter(lambda: self.consume_impl(n=consume_batch_size_int, **kwargs), None)
+        #
+        try:
+            for m_list1 in m_list_iterator:
+                if not m_list1:
+                    break
                 #
-                offsets_dict[partition_int] = offset_int + 1
+                # Dechunk if necessary/enabled.
+                if dechunk_bool:
+                    m_list2 = self.dechunk(m_list1)
+                else:
+                    m_list2 = m_list1
                 #
-                end_offsets_dict = self.topic_str_end_offsets_dict_dict[topic_str]
-                if offset_int > end_offsets_dict[partition_int]:
-                    continue
+                # Skip the messages after the end offsets.
+                if topic_str_end_offsets_dict_dict != {}:
+                    for m in m_list2:
+                        if m["topic"] in topic_str_positions_dict_dict:
+                            topic_str_positions_dict_dict[m["topic"]][m["partition"]] = m["offset"] + 1
+                    #
+                    m_list2 = [m for m in m_list2 if m["topic"] not in topic_str_end_offsets_dict_dict or m["offset"] <= topic_str_end_offsets_dict_dict[m["topic"]][m["partition"]]]
                 #
-                headers_str_bytes_tuple_list = m["headers"]
-                m1 = {"value": deserialize(m["value"], self.topic_str_value_type_str_dict[topic_str], topic_str=topic_str, key_bool=False),
-                                 "key": deserialize(m["key"], self.topic_str_key_type_str_dict[topic_str], topic_str=topic_str, key_bool=True),
-                                 "headers": headers_str_bytes_tuple_list,
-                                 "timestamp": m["timestamp"],
-                                 "partition": m["partition"],
-                                 "offset": m["offset"],
-                                 "topic": m["topic"]}
+                # Skip the messages not passing the prefilter (before deserializing them). Stop at the n-th passing message, the messages after it are unprocessed.
+                if prefilter_fun is not None:
+                    m_list3 = []
+                    for i, m in enumerate(m_list2):
+                        if n_int != ALL_MESSAGES and message_counter_int + len(m_list3) >= n_int:
+                            unprocessed_m_list += m_list2[i:]
+                            break
+                        #
+                        if prefilter_fun(m):
+                            m_list3.append(m)
+                        elif prefiltered_m_list is not None:
+                            prefiltered_m_list.append(m)
+                    m_list2 = m_list3
                 #
-                if break_fun(acc, m1):
-                    break_bool = True
-                    break
+                if n_int != ALL_MESSAGES and message_counter_int + len(m_list2) > n_int:
+                    unprocessed_m_list += m_list2[n_int - message_counter_int:]
+                    m_list2 = m_list2[:n_int - message_counter_int]
+                message_counter_int += len(m_list2)
                 #
-                acc = foldl_fun(acc, m1)
-                message_counter_int += 1
+                if m_list2 != []:
+                    yield [{"value": topic_str_value_deserialize_fun_dict[m["topic"]](m["value"]),
+                            "key": topic_str_key_deserialize_fun_dict[m["topic"]](m["key"]),
+                            "headers": m["headers"] if project_headers_bool else None,
+                            "timestamp": m["timestamp"],
+                            "partition": m["partition"],
+                            "offset": m["offset"],
+                            "topic": m["topic"]} for m in m_list2]
                 #
-                end_offsets_dict = self.topic_str_end_offsets_dict_dict[topic_str]
-                if all(offsets_dict[partition_int] > end_offset_int for partition_int, end_offset_int in end_offsets_dict.items()):
-                    break_bool = True
+                if n_int != ALL_MESSAGES and message_counter_int >= n_int:
                     break
                 #
-                if n_int != ALL_MESSAGES and message_counter_int >= n_int:
-                    break_bool = True
+                # Stop if all partitions of a topic have been consumed up to their end offsets.
+                if any(all(topic_str_positions_dict_dict[topic_str][partition_int] > end_offset_int for partition_int, end_offset_int in end_offsets_dict.items()) for topic_str, end_offsets_dict in topic_str_end_offsets_dict_dict.items()):
                     break
+        finally:
+            # Stop prefetching (e.g. when n has been reached or the caller has stopped early).
+            if prefetch_batches_int > 0:
+                m_list_iterator.close()
+            # Do not skip the unprocessed messages if the consumer is used again.
+            if unprocessed_m_list:
+                self.rewind(unprocessed_m_list)
+
+    def rewind(self, m_list):
+        """Seek the consumer back to the first of the given (consumed but unprocessed) messages on each partition.
+
+        Args:
+            m_list: consumed but unprocessed messages (in consumption order)"""
+        topic_str_partition_int_tuple_offset_int_dict = {}
+        for m in m_list:
+            topic_str_partition_int_tuple = (m["topic"], m["partition"])
+            if topic_str_partition_int_tuple not in topic_str_partition_int_tuple_offset_int_dict or m["offset"] < topic_str_partition_int_tuple_offset_int_dict[topic_str_partition_int_tuple]:
+                topic_str_partition_int_tuple_offset_int_dict[topic_str_partition_int_tuple] = m["offset"]
+        #
+        for (topic_str, partition_int), offset_int in topic_str_partition_int_tuple_offset_int_dict.items():
+            self.seek(topic_str, partition_int, offset_int)
+
+    def prefetch_batches(self, consume_batch_size_int, prefetch_batches_int, unprocessed_m_list, **kwargs):
+        """Consume raw batches in a background thread, keeping up to prefetch_batches_int batches queued (overlaps fetching with deserialization and processing in the foreground).
+
+        Args:
+            consume_batch_size_int: max messages per batch
+            prefetch_batches_int: max number of queued batches
+            unprocessed_m_list: list extended by the messages of the batches prefetched but not yielded when the generator is closed
+            **kwargs: passed to consume_impl()
+
+        Returns:
+            generator: yields raw batches (lists of message dicts); the background thread is stopped when the generator is closed"""
+        batch_queue = queue.Queue(maxsize=prefetch_batches_int)
+        stop_event = threading.Event()
+        #
+        def put(m_list_or_exception):
+            # Wait for a free slot in the queue unless prefetching has been stopped.
+            while not stop_event.is_set():
+                try:
+                    batch_queue.put(m_list_or_exception, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
             #
-            if not self.enable_auto_commit_bool and commit_after_processing_bool:
-                self.commit(topic_str_offsets_dict_dict)
-            #
-            if break_bool:
-                break
+            return False
+        #
+        def fetch():
+            try:
+                while not stop_event.is_set():
+                    m_list = self.consume_impl(n=consume_batch_size_int, **kwargs)
+                    if not put(m_list):
+                        # Prefetching has been stopped while this batch was being consumed - hand it back as well.
+                        unprocessed_m_list.extend(m_list)
+                        break
+                    #
+                    if not m_list:
+                        break
+            except Exception as e:
+                # Re-raised in the foreground thread.
+                put(e)
+        #
+        thread = threading.Thread(target=fetch, daemon=True)
+        thread.start()
+        #
+        try:
+            while True:
+                m_list_or_exception = batch_queue.get()
+                if isinstance(m_list_or_exception, Exception):
+                    raise m_list_or_exception
+                #
+                yield m_list_or_exception
+        finally:
+            stop_event.set()
+            thread.join()
+            # Hand back the prefetched batches which have not been yielded.
+            while not batch_queue.empty():
+                m_list_or_exception = batch_queue.get()
+                if not isinstance(m_list_or_exception, Exception):
+                    unprocessed_m_list += m_list_or_exception
+
+    def is_commit_after_processing(self, commit_after_processing):
+        """Decide whether offsets are committed explicitly after processing (i.e. auto commit is disabled and commit after processing is enabled).
+
+        Args:
+            commit_after_processing: override the storage default, or None
+
+        Returns:
+            bool: True if offsets are committed after processing"""
+        commit_after_processing_bool = self.storage_obj.commit_after_processing() if commit_after_processing is None else commit_after_processing
         #
-        return acc
+        return not self.enable_auto_commit_bool and commit_after_processing_bool
+
+    def create_offsets_to_commit(self):
+        """Create the dict of offsets to commit for the (assigned) partitions of the subscribed topics.
+
+        Returns:
+            dict: {topic: {partition: 0}}"""
+        topic_str_partitions_int_dict = self.storage_obj.partitions(self.topic_str_list)
+        # Only the assigned partitions (other consumers of the same group might consume the other partitions, e.g. parallel foldl()).
+        if self.topic_str_partition_int_list_dict is not None:
+            topic_str_offsets_dict_dict = {topic_str: {partition_int: 0 for partition_int in self.topic_str_partition_int_list_dict[topic_str]} if topic_str in self.topic_str_partition_int_list_dict else {partition_int: 0 for partition_int in range(partitions_int)} for topic_str, partitions_int in topic_str_partitions_int_dict.items()}
+        else:
+            topic_str_offsets_dict_dict = {topic_str: {partition_int: 0 for partition_int in range(partitions_int)} for topic_str, partitions_int in topic_str_partitions_int_dict.items()}
+        #
+        return topic_str_offsets_dict_dict
 
     #
 
@@ -259,19 +534,32 @@ class StorageConsumer(Dechunker):
         topic_str_start_offsets_dict_dict = {}
         #
         for topic_str, partition_int_offset_int_tuple_dict in topic_str_partition_int_offset_int_tuple_dict_dict.items():
-            # state = partition_int_low_watermark_int_high_watermark_int_start_offset_int_tuple_dict - start_offset_int starts with high_watermark_int.
-            state = {partition_int: [low_watermark_int, high_watermark_int, high_watermark_int] for partition_int, (low_watermark_int, high_watermark_int) in partition_int_offset_int_tuple_dict.items()}
-            for _ in range(last_n_int):
-                # Find the partition with the most remaining messages.
-                best_partition_int = max(state.keys(), key=lambda partition_int: state[partition_int][2] - state[partition_int][0])
-                if state[best_partition_int][2] == state[best_partition_int][0]:
-                    # If not even that partition doesn't carry enough remaining messages, stop.
+            # Taking the messages one by one from the partition with the most remaining messages levels the remaining messages of the fullest partitions down to a common level. Hence, find the lowest level level_int such that leveling all partitions down to it does not take more than last_n_int messages (water-filling over the partitions sorted by their number of messages).
+            partition_int_remaining_int_dict = {partition_int: high_watermark_int - low_watermark_int for partition_int, (low_watermark_int, high_watermark_int) in partition_int_offset_int_tuple_dict.items()}
+            remaining_int_list = sorted(partition_int_remaining_int_dict.values(), reverse=True)
+            #
+            level_int = 0
+            sum_int = 0
+            for i, remaining_int in enumerate(remaining_int_list):
+                sum_int += remaining_int
+                next_remaining_int = remaining_int_list[i + 1] if i + 1 < len(remaining_int_list) else 0
+                if sum_int - (i + 1) * next_remaining_int > last_n_int:
+                    # Leveling the i + 1 fullest partitions down to the next partition takes too many messages - the level is between the two (rounded up).
+                    level_int = -((last_n_int - sum_int) // (i + 1))
                     break
-                else:
-                    # Else "consume" a message from that partition.
-                    state[best_partition_int][2] -= 1
             #
-            topic_str_start_offsets_dict_dict[topic_str] = {partition_int: start_offset_int for partition_int, (_, _, start_offset_int) in state.items()}
+            start_offset_int_dict = {partition_int: low_watermark_int + min(partition_int_remaining_int_dict[partition_int], level_int) for partition_int, (low_watermark_int, _) in partition_int_offset_int_tuple_dict.items()}
+            # Take the messages still missing one by one from the partitions at the level (in partition order, like taking them one by one would do).
+            if level_int > 0:
+                missing_int = last_n_int - sum(max(0, remaining_int - level_int) for remaining_int in remaining_int_list)
+                for partition_int, remaining_int in partition_int_remaining_int_dict.items():
+                    if missing_int == 0:
+                        break
+                    if remaining_int >= level_int:
+                        start_offset_int_dict[partition_int] -= 1
+                        missing_int -= 1
+            #
+            topic_str_start_offsets_dict_dict[topic_str] = start_offset_int_dict
         #
         return topic_str_start_offsets_dict_dict
 
@@ -291,6 +579,22 @@ class StorageConsumer(Dechunker):
         #
         return (topic_str_key_type_str_dict, topic_str_value_type_str_dict)
 
+    def get_consumer_deserialize_fun(self, type_str, topic_str, key_bool):
+        """Resolve a key or value type into the deserialization function used by this consumer.
+
+        Args:
+            type_str: key or value type, e.g. "avro", "json", "bytes"
+            topic_str: topic the messages come from
+            key_bool: True for the key, False for the value
+
+        Returns:
+            function: payload bytes -> deserialized payload"""
+        # Do not deserialize if this is a RestProxyConsumer object (deserialization has already taken place on the REST Proxy).
+        if self.__class__.__name__ == "RestProxyConsumer":
+            return lambda payload_bytes: payload_bytes
+        else:
+            return self.get_deserialize_fun(type_str, topic_str, key_bool)
+
     def get_partitions_from_kwargs(self, partitions_key_str, **kwargs):
         """Resolve an explicit per-topic partition assignment from kwargs, if given.
 
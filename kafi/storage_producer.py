@@ -32,12 +32,15 @@ class StorageProducer(Chunker):
         self.schema_hash_int_generalizedProtocolMessageType_dict = {}
         #
         # Cache the number of partitions of the topic (e.g. for custom partitioner functions).
-        if len(self.storage_obj.admin.list_topics(self.topic_str)) > 0:
-            self.partitions_int = self.storage_obj.partitions(self.topic_str)[self.topic_str]
-        else:
-            self.partitions_int = 1
+        topic_str_partitions_int_dict = self.storage_obj.partitions(self.topic_str)
+        self.partitions_int = topic_str_partitions_int_dict[self.topic_str] if self.topic_str in topic_str_partitions_int_dict else 1
         #
         super().__init__(storage_obj.schema_registry_config_dict, **kwargs)
+        #
+        # Do not serialize if this is a RestProxyProducer object (serialization takes place later on the REST Proxy).
+        if self.__class__.__name__ == "RestProxyProducer":
+            self.key_serialize_fun = lambda payload: payload
+            self.value_serialize_fun = lambda payload: payload
 
     #
 
@@ -54,16 +57,12 @@ class StorageProducer(Chunker):
 
         Returns:
             the result of produce_impl() (implementation-specific: e.g. per-message delivery info)"""
+        # The serialization functions have been resolved when the producer was created.
+        key_serialize_fun = self.key_serialize_fun
+        value_serialize_fun = self.value_serialize_fun
         #
-        def serialize(payload, key_bool):
-            # Do not serialize if this is a RestProxyProducer object (serialization takes place later on the REST Proxy). 
-            if self.__class__.__name__ == "RestProxyProducer":
-                return payload
-            else:
-                return self.serialize(payload, key_bool)
-        #
-        m_list1 = [{"value": serialize(m["value"], False),
-                    "key": serialize(m["key"] if "key" in m else None, True),
+        m_list1 = [{"value": value_serialize_fun(m["value"]),
+                    "key": key_serialize_fun(m["key"] if "key" in m else None),
                     "partition": m["partition"] if "partition" in m and self.keep_partitions_bool else RD_KAFKA_PARTITION_UA,
                     "timestamp": m["timestamp"] if "timestamp" in m and self.keep_timestamps_bool else CURRENT_TIME,
                     "headers": self.storage_obj.headers_to_headers_str_bytes_tuple_list(m["headers"]) if "headers" in m and self.keep_headers_bool else None} for m in m_list]
@@ -6,7 +6,7 @@ import uuid
 
 import cloudpickle
 
-from kafi.helpers import get_millis, compress, decompress
+from kafi.helpers import get_millis, compress, decompress, key_to_chunk_key, split_bytes
 from kafi.streams.topologynode import TopologyNode
 
 #
@@ -22,6 +22,17 @@ default_checkpoint_interval_float = 1.0
 streams_prefix_str = "streams_thread_"
 checkpoint_suffix_str = "_checkpoint"
 
+def get_chunks_int(value_bytes, chunk_size_bytes_int):
+    """Number of chunks a value is split into by the Chunker.
+
+    Args:
+        value_bytes: value to chunk
+        chunk_size_bytes_int: chunk size
+
+    Returns:
+        int: number of chunks (0 if the value is not chunked)"""
+    return len(split_bytes(value_bytes, chunk_size_bytes_int)) if len(value_bytes) > chunk_size_bytes_int else 0
+
 def create_name():
     """Generate a unique thread name for this Streams instance.
     
@@ -161,6 +172,83 @@ class Streams(TopologyNode):
 
     #
 
+    @staticmethod
+    def save_checkpoint(built_tn, checkpoint_storage, checkpoint_topic_str, source_str_offsets_dict_dict, previous_chunks_int=0, **kwargs):
+        """Produce a checkpoint (the state of the topology and the source offsets) to the checkpoint topic.
+
+        Checkpoints are chunked with one key per chunk index. If the previous checkpoint had more chunks, the keys of its surplus chunks are deleted with tombstones (a compacted checkpoint topic would keep them forever otherwise).
+
+        Args:
+            built_tn: built tn to checkpoint
+            checkpoint_storage: storage backend for checkpoints
+            checkpoint_topic_str: topic name used to store checkpoints
+            source_str_offsets_dict_dict: dict, source_str -> partition -> next offset
+            previous_chunks_int: number of chunks of the previous checkpoint
+            **kwargs: passed through to storage.producer(); chunk_size_bytes (default 1000)
+
+        Returns:
+            int: number of chunks of the checkpoint (0 if it has not been chunked)"""
+        checkpoint_dict = {"state": built_tn.get_state(),
+                           "offsets": source_str_offsets_dict_dict}
+        checkpoint_dict_bytes = cloudpickle.dumps(checkpoint_dict)
+        compressed_checkpoint_dict_bytes = compress(checkpoint_dict_bytes)
+        #
+        logger.info("Saving checkpoint...")
+        chunk_size_bytes_int = kwargs["chunk_size_bytes"] if "chunk_size_bytes" in kwargs else 1000
+        producer_kwargs = {key_str: value for key_str, value in kwargs.items() if key_str != "chunk_size_bytes"}
+        producer = checkpoint_storage.producer(checkpoint_topic_str, type="bytes", chunk_size_bytes=chunk_size_bytes_int, **producer_kwargs)
+        producer.produce(compressed_checkpoint_dict_bytes, key=built_tn.get_id())
+        producer.close()
+        #
+        chunks_int = get_chunks_int(compressed_checkpoint_dict_bytes, chunk_size_bytes_int)
+        if chunks_int < previous_chunks_int:
+            producer = checkpoint_storage.producer(checkpoint_topic_str, type="bytes", **producer_kwargs)
+            producer.produce([None] * (previous_chunks_int - chunks_int), key=[key_to_chunk_key(built_tn.get_id().encode("utf-8"), chunk_int) for chunk_int in range(chunks_int, previous_chunks_int)])
+            producer.close()
+        logger.info("...saving checkpoint done (%d KB compressed, %d uncompressed).", len(compressed_checkpoint_dict_bytes) / 1024, len(checkpoint_dict_bytes) / 1024)
+        #
+        return chunks_int
+
+    @staticmethod
+    def load_checkpoint(built_tn, checkpoint_storage, checkpoint_topic_str, checkpoint_group_str, **kwargs):
+        """Restore the state of the topology from the latest checkpoint in the checkpoint topic.
+
+        Args:
+            built_tn: built tn to restore
+            checkpoint_storage: storage backend for checkpoints
+            checkpoint_topic_str: topic name used to store checkpoints
+            checkpoint_group_str: consumer group for the checkpoint topic
+            **kwargs: passed through to storage.consumer(); chunk_size_bytes (default 1000)
+
+        Returns:
+            tuple: (dict, source_str -> partition -> next offset, or None if there is no checkpoint; number of chunks of the checkpoint)"""
+        checkpoint_kwargs = kwargs.copy()
+        checkpoint_kwargs["group"] = checkpoint_group_str
+        #
+        logger.debug("Checkpoint consumer group ('%s') offsets for topic '%s': %s", checkpoint_group_str, checkpoint_topic_str, checkpoint_storage.group_offsets(checkpoint_group_str).get(checkpoint_group_str, {}).get(checkpoint_topic_str, {}))
+        #
+        m_list = checkpoint_storage.compact(checkpoint_topic_str, value_type="bytes", dechunk=True, **checkpoint_kwargs)
+        #
+        source_str_offsets_dict_dict = None
+        chunks_int = 0
+        if len(m_list) > 0:
+            checkpoint_m = m_list[-1]
+            compressed_checkpoint_dict_bytes = checkpoint_m["value"]
+            #
+            logger.info("Loading checkpoint...")
+            checkpoint_dict_bytes = decompress(compressed_checkpoint_dict_bytes)
+            checkpoint_dict = cloudpickle.loads(checkpoint_dict_bytes)
+            built_tn.set_state(checkpoint_dict["state"])
+            source_str_offsets_dict_dict = checkpoint_dict["offsets"]
+            #
+            checkpoint_storage.group_offsets(checkpoint_group_str, {checkpoint_topic_str: {checkpoint_m["partition"]: checkpoint_m["offset"] + 1}})
+            #
+            chunks_int = get_chunks_int(compressed_checkpoint_dict_bytes, kwargs["chunk_size_bytes"] if "chunk_size_bytes" in kwargs else 1000)
+            #
+            logger.info("...loading checkpoint done (%d KB compressed, %d uncompressed).", len(compressed_checkpoint_dict_bytes) / 1024, len(checkpoint_dict_bytes) / 1024)
+        #
+        return (source_str_offsets_dict_dict, chunks_int)
+
     @staticmethod
     def streams_fun(built_tn, sink_str_foreach_fun_finally_fun_tuple_dict, checkpoint_storage=None, checkpoint_topic=None, checkpoint_interval=default_checkpoint_interval_float, stop_event=None, **kwargs):
         """Main streams loop: consume, push through the topology, produce, checkpoint, repeat.
@@ -186,51 +274,13 @@ class Streams(TopologyNode):
         #
         initial_time_int = get_millis()
         #
-        def save_checkpoint(source_str_offsets_dict_dict):
-            checkpoint_dict = {"state": built_tn.get_state(),
-                               "offsets": source_str_offsets_dict_dict}
-            checkpoint_dict_bytes = cloudpickle.dumps(checkpoint_dict)
-            compressed_checkpoint_dict_bytes = compress(checkpoint_dict_bytes)
-            #
-            logger.info("Saving checkpoint...")
-            chunk_size_bytes_int = kwargs["chunk_size_bytes"] if "chunk_size_bytes" in kwargs else 1000
-            producer = checkpoint_storage.producer(checkpoint_topic_str, type="bytes", chunk_size_bytes=chunk_size_bytes_int, **kwargs)
-            producer.produce(compressed_checkpoint_dict_bytes, key=built_tn.get_id())
-            producer.close()
-            logger.info("...saving checkpoint done (%d KB compressed, %d uncompressed).", len(compressed_checkpoint_dict_bytes) / 1024, len(checkpoint_dict_bytes) / 1024)
-        #
-        def load_checkpoint(built_tn):
-            checkpoint_group_str = group_str + checkpoint_suffix_str
-            checkpoint_kwargs = kwargs.copy()
-            checkpoint_kwargs["group"] = checkpoint_group_str
-            #
-            logger.debug("Checkpoint consumer group ('%s') offsets for topic '%s': %s", checkpoint_group_str, checkpoint_topic_str, checkpoint_storage.group_offsets(checkpoint_group_str).get(checkpoint_group_str, {}).get(checkpoint_topic_str, {}))
-            #
-            m_list = checkpoint_storage.compact(checkpoint_topic_str, value_type="bytes", dechunk=True, **checkpoint_kwargs)
-            #
-            source_str_offsets_dict_dict = None
-            if len(m_list) > 0:
-                checkpoint_m = m_list[-1]
-                compressed_checkpoint_dict_bytes = checkpoint_m["value"]
-                #
-                logger.info("Loading checkpoint...")
-                checkpoint_dict_bytes = decompress(compressed_checkpoint_dict_bytes)
-                checkpoint_dict = cloudpickle.loads(checkpoint_dict_bytes)
-                built_tn.set_state(checkpoint_dict["state"])
-                source_str_offsets_dict_dict = checkpoint_dict["offsets"]
-                #
-                checkpoint_offsets = {checkpoint_topic_str: {"partition": checkpoint_m["partition"], "offset": checkpoint_m["offset"] + 1}}
-                checkpoint_storage.commit(checkpoint_offsets)
-                #
-                logger.info("...loading checkpoint done (%d KB compressed, %d uncompressed).", len(compressed_checkpoint_dict_bytes) / 1024, len(checkpoint_dict_bytes) / 1024)
-            #
-            return source_str_offsets_dict_dict
-        #
         group_str = kwargs["group"] if "group" in kwargs else f"streams_{get_millis()}"
         #
         source_str_topic_dict_dict = built_tn.get_source_str_topic_dict_dict()
         #
         source_str_offsets_dict_dict = None
+        # Number of chunks of the last saved or loaded checkpoint (see save_checkpoint()).
+        checkpoint_chunks_int = 0
         if checkpoint_storage is not None:
             initial_time_int = get_millis()
             #
@@ -241,9 +291,13 @@ class Streams(TopologyNode):
                 if checkpoint_storage.partitions(checkpoint_topic_str)[checkpoint_topic_str] > 1:
                     raise Exception("The checkpoint topic must have only one partition.")
                 #
-                source_str_offsets_dict_dict = load_checkpoint(built_tn)
+                (source_str_offsets_dict_dict, checkpoint_chunks_int) = Streams.load_checkpoint(built_tn, checkpoint_storage, checkpoint_topic_str, group_str + checkpoint_suffix_str, **kwargs)
             else:
-                checkpoint_storage.create(checkpoint_topic_str)
+                # Only the latest checkpoint is needed (see load_checkpoint()), i.e. the checkpoint topic can be compacted - but only on FS storages where all chunks of a checkpoint are written atomically (on Kafka, compaction could remove the chunks of the previous checkpoint while the next one has only been written partially).
+                if checkpoint_storage.__class__.__bases__[0].__name__ == "FS":
+                    checkpoint_storage.create(checkpoint_topic_str, config={"cleanup.policy": "compact"})
+                else:
+                    checkpoint_storage.create(checkpoint_topic_str)
         #
         source_str_consumer_dict = {}
         for source_str, topic_dict in source_str_topic_dict_dict.items():
@@ -316,7 +370,7 @@ class Streams(TopologyNode):
                 #
                 if source_str_offsets_dict_dict and source_str_offsets_dict_dict != last_committed_source_str_offsets_dict_dict:
                     if checkpoint_storage is not None and (time_int - initial_time_int) > checkpoint_interval_float * 1000:
-                        save_checkpoint(source_str_offsets_dict_dict)
+                        checkpoint_chunks_int = Streams.save_checkpoint(built_tn, checkpoint_storage, checkpoint_topic_str, source_str_offsets_dict_dict, checkpoint_chunks_int, **kwargs)
                         #
                         for source_str, offsets_dict in source_str_offsets_dict_dict.items():
                             if offsets_dict:
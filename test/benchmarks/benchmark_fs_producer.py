@@ -0,0 +1,70 @@
+import shutil
+import sys
+import tempfile
+import time
+
+#
+
+from pathlib import Path
+this_dir = Path(__file__).parent
+sys.path.insert(0, str(this_dir / ".." / ".."))
+
+#
+
+from kafi.fs.local.local import Local
+
+# Produce batches of increasing size to a local topic and write the topic to a ".bytes" file. The time per message should stay (roughly) constant, i.e. both write paths scale linearly with the batch size.
+#
+# e.g.:
+#
+# python benchmark_fs_producer.py
+# python benchmark_fs_producer.py 10000 100000
+
+n_int_list = [int(arg_str) for arg_str in sys.argv[1:]] if len(sys.argv) > 1 else [10000, 100000, 1000000]
+
+#
+
+def get_storage(root_dir_str):
+    l = Local({"local": {"root.dir": root_dir_str}})
+    #
+    return l
+
+
+def benchmark_produce(l, topic_str, n_int):
+    m_list = [{"key": f"key {i}".encode("utf-8"), "value": f"value {i}".encode("utf-8")} for i in range(n_int)]
+    #
+    producer = l.producer(topic_str, type="bytes")
+    start_float = time.perf_counter()
+    producer.produce_list(m_list)
+    end_float = time.perf_counter()
+    producer.close()
+    #
+    return end_float - start_float
+
+
+def benchmark_topic_to_file(l, topic_str, n_int):
+    start_float = time.perf_counter()
+    l.topic_to_file(topic_str, l, f"{topic_str}.bytes", n=n_int)
+    end_float = time.perf_counter()
+    #
+    return end_float - start_float
+
+#
+
+root_dir_str = tempfile.mkdtemp(prefix="kafi_benchmark_")
+try:
+    l = get_storage(root_dir_str)
+    #
+    print(f"{'messages':>10} {'produce (s)':>12} {'us/message':>11} {'topic_to_file (s)':>18} {'us/message':>11}")
+    for n_int in n_int_list:
+        topic_str = f"benchmark_{n_int}"
+        l.create(topic_str)
+        #
+        produce_seconds_float = benchmark_produce(l, topic_str, n_int)
+        topic_to_file_seconds_float = benchmark_topic_to_file(l, topic_str, n_int)
+        #
+        print(f"{n_int:>10} {produce_seconds_float:>12.3f} {produce_seconds_float / n_int * 1000000:>11.2f} {topic_to_file_seconds_float:>18.3f} {topic_to_file_seconds_float / n_int * 1000000:>11.2f}")
+        #
+        l.delete(topic_str)
+finally:
+    shutil.rmtree(root_dir_str)
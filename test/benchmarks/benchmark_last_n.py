@@ -0,0 +1,70 @@
+import random
+import sys
+import time
+
+#
+
+from pathlib import Path
+this_dir = Path(__file__).parent
+sys.path.insert(0, str(this_dir / ".." / ".."))
+
+#
+
+from kafi.storage_consumer import StorageConsumer
+
+# Compare the computation of the start offsets for last_n (e.g. tail()) by taking the messages one by one from the partition with the most remaining messages (like formerly done in get_last_n_start_offsets()) with the water-filling computation over the sorted watermarks, for a topic with (by default) 100 partitions of random sizes.
+#
+# e.g.:
+#
+# python benchmark_last_n.py
+# python benchmark_last_n.py 1000
+
+partitions_int = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+#
+
+class Watermarks:
+    def __init__(self, partition_int_offset_int_tuple_dict):
+        self.partition_int_offset_int_tuple_dict = partition_int_offset_int_tuple_dict
+
+    def watermarks(self, topic_str_list):
+        return {topic_str: self.partition_int_offset_int_tuple_dict for topic_str in topic_str_list}
+
+
+def get_last_n_start_offsets_one_by_one(partition_int_offset_int_tuple_dict, last_n_int):
+    state = {partition_int: [low_watermark_int, high_watermark_int, high_watermark_int] for partition_int, (low_watermark_int, high_watermark_int) in partition_int_offset_int_tuple_dict.items()}
+    for _ in range(last_n_int):
+        best_partition_int = max(state.keys(), key=lambda partition_int: state[partition_int][2] - state[partition_int][0])
+        if state[best_partition_int][2] == state[best_partition_int][0]:
+            break
+        else:
+            state[best_partition_int][2] -= 1
+    #
+    return {partition_int: start_offset_int for partition_int, (_, _, start_offset_int) in state.items()}
+
+
+def benchmark(fun):
+    start_float = time.perf_counter()
+    result = fun()
+    end_float = time.perf_counter()
+    #
+    return (result, end_float - start_float)
+
+#
+
+random.seed(42)
+partition_int_offset_int_tuple_dict = {}
+for partition_int in range(partitions_int):
+    low_watermark_int = random.randint(0, 100000)
+    partition_int_offset_int_tuple_dict[partition_int] = (low_watermark_int, low_watermark_int + random.randint(0, 200000))
+#
+consumer = StorageConsumer.__new__(StorageConsumer)
+consumer.storage_obj = Watermarks(partition_int_offset_int_tuple_dict)
+#
+print(f"{'last_n':>10} {'one by one (s)':>15} {'water-filling (s)':>18} {'speedup':>8}")
+for last_n_int in [1000, 10000, 100000, 1000000]:
+    (start_offsets_dict1, one_by_one_seconds_float) = benchmark(lambda: get_last_n_start_offsets_one_by_one(partition_int_offset_int_tuple_dict, last_n_int))
+    (topic_str_start_offsets_dict_dict, water_filling_seconds_float) = benchmark(lambda: consumer.get_last_n_start_offsets(["benchmark"], last_n_int))
+    if start_offsets_dict1 != topic_str_start_offsets_dict_dict["benchmark"]:
+        raise Exception("Start offsets differ.")
+    print(f"{last_n_int:>10} {one_by_one_seconds_float:>15.3f} {water_filling_seconds_float:>18.6f} {one_by_one_seconds_float / water_filling_seconds_float:>7.0f}x")
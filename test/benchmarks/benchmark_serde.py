@@ -0,0 +1,118 @@
+import shutil
+import sys
+import tempfile
+import time
+
+#
+
+from pathlib import Path
+this_dir = Path(__file__).parent
+sys.path.insert(0, str(this_dir / ".." / ".."))
+
+#
+
+import json
+
+from kafi.fs.local.local import Local
+from kafi.helpers import to_bytes
+
+# Compare the type dispatch formerly done in deserialize()/serialize() for every payload (copied below) with the functions resolved once per topic (as used by consumers/producers) for "str", "bytes" and "json" topics.
+#
+# e.g.:
+#
+# python benchmark_serde.py
+# python benchmark_serde.py 100000
+
+n_int = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+#
+
+def get_storage(root_dir_str):
+    l = Local({"local": {"root.dir": root_dir_str}})
+    #
+    return l
+
+
+# Copies of the former per-payload type dispatch of Serializer.serialize() and Deserializer.deserialize() (only the "str", "bytes" and "json" branches, which come first).
+
+def dispatch_serialize(serializer_obj, payload, key_bool):
+    type_str = serializer_obj.key_type_str if key_bool else serializer_obj.value_type_str
+    #
+    def payload_to_serializer_payload():
+        try:
+            if isinstance(payload, bytes):
+                serializer_payload = json.loads(payload)
+            elif isinstance(payload, str):
+                serializer_payload = json.loads(payload)
+            else:
+                serializer_payload = payload
+        except (json.JSONDecodeError, TypeError):
+            serializer_payload = payload
+        #
+        return serializer_payload
+    #
+    if payload == None:
+        serialized_payload_bytes = None
+    else:
+        if type_str.lower() in ["bytes", "str", "string", "json"]:
+            serialized_payload_bytes = to_bytes(payload)
+        else:
+            raise Exception("Only \"bytes\", \"str\" and \"json\" supported.")
+    #
+    return serialized_payload_bytes
+
+
+def dispatch_deserialize(deserializer_obj, payload_bytes, type_str, topic_str, key_bool):
+    if isinstance(payload_bytes, memoryview) and type_str.lower() not in ["bytes", "str", "string"]:
+        payload_bytes = payload_bytes.tobytes()
+    #
+    if type_str.lower() == "bytes":
+        deserialized_payload = deserializer_obj.bytes_to_bytes(payload_bytes)
+    elif type_str.lower() in ["str", "string"]:
+        deserialized_payload = deserializer_obj.bytes_to_str(payload_bytes)
+    elif type_str.lower() == "json":
+        deserialized_payload = deserializer_obj.bytes_to_dict(payload_bytes)
+    else:
+        raise Exception("Only \"str\", \"bytes\" and \"json\" supported.")
+    #
+    return deserialized_payload
+
+
+def benchmark(fun, payload_list):
+    start_float = time.perf_counter()
+    for payload in payload_list:
+        fun(payload)
+    end_float = time.perf_counter()
+    #
+    return end_float - start_float
+
+#
+
+root_dir_str = tempfile.mkdtemp(prefix="kafi_benchmark_")
+try:
+    l = get_storage(root_dir_str)
+    #
+    print(f"{'type':>6} {'':>12} {'per message (s)':>16} {'resolved (s)':>13} {'speedup':>8}")
+    for type_str in ["str", "bytes", "json"]:
+        topic_str = f"benchmark_{type_str}"
+        l.create(topic_str)
+        #
+        payload_list = [{"id": i, "name": "cookie"} for i in range(n_int)] if type_str == "json" else [f"value {i}" for i in range(n_int)]
+        #
+        producer = l.producer(topic_str, type=type_str)
+        dispatch_seconds_float = benchmark(lambda payload: dispatch_serialize(producer, payload, False), payload_list)
+        resolved_seconds_float = benchmark(producer.value_serialize_fun, payload_list)
+        producer.close()
+        print(f"{type_str:>6} {'serialize':>12} {dispatch_seconds_float:>16.3f} {resolved_seconds_float:>13.3f} {dispatch_seconds_float / resolved_seconds_float:>7.2f}x")
+        #
+        payload_bytes_list = [producer.value_serialize_fun(payload) for payload in payload_list]
+        #
+        consumer = l.consumer(topic_str, type=type_str)
+        dispatch_seconds_float = benchmark(lambda payload_bytes: dispatch_deserialize(consumer, payload_bytes, type_str, topic_str, False), payload_bytes_list)
+        resolved_seconds_float = benchmark(consumer.topic_str_value_deserialize_fun_dict[topic_str], payload_bytes_list)
+        consumer.close()
+        print(f"{type_str:>6} {'deserialize':>12} {dispatch_seconds_float:>16.3f} {resolved_seconds_float:>13.3f} {dispatch_seconds_float / resolved_seconds_float:>7.2f}x")
+        #
+        l.delete(topic_str)
+finally:
+    shutil.rmtree(root_dir_str)
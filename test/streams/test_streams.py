@@ -8,7 +8,8 @@ from streams.wc.topologies import get_built_tn_wc
 
 #
 
-from kafi.kafi import Cluster
+from kafi.helpers import get_millis
+from kafi.kafi import Cluster, Local
 from kafi.streams.streams import Streams
 
 #
@@ -227,4 +228,48 @@ class TestStreams(TestStreamsBase, TestGenerate, TestBase):
         #
         self.assert_wc(source_str, sink_topic_str)
 
-
+    def test_checkpoint_restart_shrinking(self):
+        import os, tempfile
+        #
+        class CheckpointTn:
+            def __init__(self, state):
+                self.state = state
+            def get_id(self):
+                return "checkpoint_tn"
+            def get_state(self):
+                return self.state
+            def set_state(self, state):
+                self.state = state
+        #
+        checkpoint_storage = Local({"local": {"root.dir": tempfile.mkdtemp()}})
+        checkpoint_topic_str = "shrinking_checkpoint"
+        # Every checkpoint is written to its own segment (only closed segments are compacted).
+        checkpoint_storage.create(checkpoint_topic_str, config={"cleanup.policy": "compact", "segment.bytes": 1})
+        # Checkpoints of shrinking size (5, 3 and 2 chunks of 1000 bytes; random bytes do not compress).
+        chunks_int = 0
+        for state_size_int in [4500, 2500, 1500]:
+            state_bytes = os.urandom(state_size_int)
+            chunks_int = Streams.save_checkpoint(CheckpointTn(state_bytes), checkpoint_storage, checkpoint_topic_str, {"source": {0: state_size_int}}, chunks_int)
+        self.assertEqual(chunks_int, 2)
+        checkpoint_storage.admin.compact_log(checkpoint_topic_str)
+        # Only the chunks of the last checkpoint survive compaction (the stale chunk keys of the previous checkpoints have been deleted).
+        m_list = checkpoint_storage.cat(checkpoint_topic_str, type="bytes", group=f"test_{get_millis()}")
+        self.assertEqual(sorted(m["key"] for m in m_list if m["value"] is not None), [b"checkpoint_tn_000000", b"checkpoint_tn_000001"])
+        # Restart from the checkpoint.
+        tn = CheckpointTn(None)
+        (source_str_offsets_dict_dict, chunks_int) = Streams.load_checkpoint(tn, checkpoint_storage, checkpoint_topic_str, f"test_{get_millis()}_checkpoint")
+        self.assertEqual(tn.get_state(), state_bytes)
+        self.assertEqual(source_str_offsets_dict_dict, {"source": {0: 1500}})
+        self.assertEqual(chunks_int, 2)
+        # A checkpoint which is not chunked at all.
+        state_bytes = os.urandom(100)
+        chunks_int = Streams.save_checkpoint(CheckpointTn(state_bytes), checkpoint_storage, checkpoint_topic_str, {"source": {0: 100}}, chunks_int)
+        self.assertEqual(chunks_int, 0)
+        checkpoint_storage.admin.compact_log(checkpoint_topic_str)
+        m_list = checkpoint_storage.cat(checkpoint_topic_str, type="bytes", group=f"test_{get_millis()}")
+        self.assertEqual([m["key"] for m in m_list if m["value"] is not None], [b"checkpoint_tn"])
+        #
+        tn = CheckpointTn(None)
+        (source_str_offsets_dict_dict, chunks_int) = Streams.load_checkpoint(tn, checkpoint_storage, checkpoint_topic_str, f"test_{get_millis()}_checkpoint")
+        self.assertEqual(tn.get_state(), state_bytes)
+        self.assertEqual(source_str_offsets_dict_dict, {"source": {0: 100}})
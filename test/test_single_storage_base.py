@@ -1,4 +1,6 @@
+import asyncio
 import math
+import os
 import time
 import unittest
 import warnings
@@ -14,6 +16,7 @@ sys.path.insert(0, str(this_dir / ".."))
 
 from kafi.storage import *
 from kafi.helpers import *
+from kafi.fs.fs_segment import decode_segment_chunks, encode_segment
 
 #
 
@@ -359,6 +362,81 @@ class TestSingleStorageBase(unittest.TestCase):
         #
         consumer.close()
 
+    def test_auto_commit_interval(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__bases__[0].__name__ == "FS":
+            topic_str = self.create_test_topic_name()
+            s.create(topic_str)
+            producer = s.producer(topic_str, type="str")
+            producer.produce([f"message {i}" for i in range(4)])
+            producer.close()
+            # The offsets are auto-committed at most every auto.commit.interval.ms (and on close()).
+            group_str = self.create_test_group_name()
+            consumer = s.consumer(topic_str, group=group_str, type="str", enable_auto_commit=True, config={"auto.commit.interval.ms": 3600000})
+            self.assertEqual(len(consumer.consume(n=2)), 2)
+            self.assertEqual(s.group_offsets(group_str)[group_str][topic_str], {0: OFFSET_INVALID})
+            consumer.close()
+            self.assertEqual(s.group_offsets(group_str)[group_str][topic_str], {0: 2})
+            #
+            consumer = s.consumer(topic_str, group=group_str, type="str", enable_auto_commit=True, config={"auto.commit.interval.ms": 0})
+            self.assertEqual([m["value"] for m in consumer.consume(n=1)], ["message 2"])
+            self.assertEqual(s.group_offsets(group_str)[group_str][topic_str], {0: 3})
+            consumer.close()
+
+    def test_group_store(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__bases__[0].__name__ == "FS":
+            topic_str = self.create_test_topic_name()
+            s.create(topic_str, partitions=2)
+            producer = s.producer(topic_str, type="str")
+            producer.produce([f"message {i}" for i in range(4)], partition=[0, 1, 0, 1])
+            producer.close()
+            # Consumer groups are stored in a compact binary format.
+            group_str = self.create_test_group_name()
+            consumer = s.consumer(topic_str, group=group_str, type="str", partitions={topic_str: [0]})
+            self.assertEqual(len(consumer.consume(n=1)), 1)
+            group_abs_path_file_str = os.path.join(s.root_dir(), "groups", group_str)
+            self.assertTrue(s.admin.read_bytes(group_abs_path_file_str).startswith(b"KGRP"))
+            # Committing offsets does not read the group first.
+            read_bytes_etag = s.admin.read_bytes_etag
+            read_counter_int_list = [0]
+            def read_bytes_etag1(abs_path_file_str):
+                read_counter_int_list[0] += 1
+                return read_bytes_etag(abs_path_file_str)
+            s.admin.read_bytes_etag = read_bytes_etag1
+            consumer.commit({topic_str: {0: 1}})
+            consumer.commit({topic_str: {0: 2}})
+            self.assertEqual(read_counter_int_list[0], 0)
+            # Commits of another consumer of the group (with its own storage object) in the meantime are kept.
+            s1 = self.get_storage()
+            consumer1 = s1.consumer(topic_str, group=group_str, type="str", partitions={topic_str: [1]})
+            consumer1.commit({topic_str: {1: 1}})
+            consumer1.close()
+            consumer.commit({topic_str: {0: 3}})
+            self.assertEqual(read_counter_int_list[0], 1)
+            s.admin.read_bytes_etag = read_bytes_etag
+            consumer.close()
+            self.assertEqual(s.group_offsets(group_str)[group_str][topic_str], {0: 3, 1: 1})
+            # Groups written before the binary format was introduced can still be read.
+            group_str1 = self.create_test_group_name()
+            s.admin.write_str(os.path.join(s.root_dir(), "groups", group_str1), str({"offsets": {topic_str: {0: 2, 1: 1}}, "last_update": 0, "state": "empty"}))
+            self.assertEqual(s.group_offsets(group_str1)[group_str1][topic_str], {0: 2, 1: 1})
+            s.group_offsets(group_str1, {topic_str: {0: 4}})
+            self.assertEqual(s.group_offsets(group_str1)[group_str1][topic_str], {0: 4, 1: 1})
+            # Groups committed before any state has been set.
+            group_str2 = self.create_test_group_name()
+            s.admin.set_group_dict(group_str2, {"offsets": {topic_str: {0: 1}}})
+            self.assertEqual(s.admin.get_group_state(group_str2), "")
+            self.assertEqual(s.groups(group_str2, state=True), {group_str2: ""})
+
     def test_lags(self):
         if self.__class__.__name__ == "TestSingleStorageBase":
             return
@@ -522,6 +600,39 @@ class TestSingleStorageBase(unittest.TestCase):
         self.assertEqual(0, found_message1_offset_int5)
 
 
+    def test_offsets_for_times_batched(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__name__ == "Cluster":
+            timestamp_int = get_millis() - 10000
+            topic_str1 = self.create_test_topic_name()
+            s.create(topic_str1, partitions=2)
+            topic_str2 = self.create_test_topic_name()
+            s.create(topic_str2, partitions=2)
+            for topic_str in [topic_str1, topic_str2]:
+                producer = s.producer(topic_str, value_type="str")
+                producer.produce([f"message {i}" for i in range(6)], partition=[0, 0, 0, 1, 1, 1], timestamp=[timestamp_int + 1000 * (i % 3) for i in range(6)])
+                producer.close()
+            # The offsets of several topics and partitions are looked up in a single request (with the helper consumer of the admin).
+            topic_str_offsets_dict_dict = s.offsets_for_times([topic_str1, topic_str2], {topic_str1: {0: timestamp_int + 1000, 1: timestamp_int}, topic_str2: {0: timestamp_int + 2000, 1: timestamp_int + 5000}})
+            self.assertEqual(topic_str_offsets_dict_dict, {topic_str1: {0: 1, 1: 0}, topic_str2: {0: 2, 1: -1}})
+            helper_consumer = s.admin.helper_consumer
+            self.assertIsNotNone(helper_consumer)
+            #
+            topic_str_offsets_dict_dict = s.offsets_for_times([topic_str1, topic_str2], {0: timestamp_int + 1000})
+            self.assertEqual(topic_str_offsets_dict_dict, {topic_str1: {0: 1}, topic_str2: {0: 1}})
+            self.assertIs(s.admin.helper_consumer, helper_consumer)
+            # A pattern which does not match any topic.
+            self.assertEqual(s.offsets_for_times(f"{topic_str1}_no_such_topic*", {0: timestamp_int}), {})
+            # The helper consumer is closed explicitly (and created again on next use).
+            s.close()
+            self.assertIsNone(s.admin.helper_consumer)
+            self.assertEqual(s.offsets_for_times(topic_str1, {0: timestamp_int})[topic_str1], {0: 0})
+            s.close()
+
     def test_partitions_set_partitions(self):
         if self.__class__.__name__ == "TestSingleStorageBase":
             return
@@ -567,6 +678,40 @@ class TestSingleStorageBase(unittest.TestCase):
                 self.assertEqual(topic_str_partition_int_partition_dict_dict_dict[1]["isrs"], [1])
                 
 
+    def test_metadata_cache(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        s.metadata_cache_ttl_ms(60000)
+        #
+        topic_str1 = self.create_test_topic_name()
+        s.create(topic_str1, partitions=2)
+        self.assertEqual(s.partitions(topic_str1), {topic_str1: 2})
+        # The cached metadata cannot be modified by the caller.
+        s.partitions(topic_str1)[topic_str1] = 42
+        self.assertEqual(s.partitions(topic_str1), {topic_str1: 2})
+        # Missing topics are not cached.
+        topic_str2 = self.create_test_topic_name()
+        self.assertEqual(s.partitions(topic_str2), {})
+        s1 = self.get_storage()
+        s1.create(topic_str2)
+        self.assertEqual(s.partitions(topic_str2), {topic_str2: 1})
+        #
+        if s.__class__.__bases__[0].__name__ == "FS":
+            # Changes by others are only seen after the TTL...
+            s1.partitions(topic_str1, 3)
+            self.assertEqual(s.partitions(topic_str1), {topic_str1: 2})
+            s.metadata_cache_ttl_ms(0)
+            self.assertEqual(s.partitions(topic_str1), {topic_str1: 3})
+            s.metadata_cache_ttl_ms(60000)
+            # ...but own changes immediately.
+            s.partitions(topic_str1, 4)
+            self.assertEqual(s.partitions(topic_str1), {topic_str1: 4})
+        #
+        s.delete(topic_str2)
+        self.assertEqual(s.partitions(topic_str2), {})
+
     def test_exists(self):
         if self.__class__.__name__ == "TestSingleStorageBase":
             return
@@ -747,6 +892,75 @@ class TestSingleStorageBase(unittest.TestCase):
         # else:
         producer.close()
 
+    def test_produce_async(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if not s.__class__.__name__ == "Cluster":
+            return
+        #
+        topic_str = self.create_test_topic_name()
+        s.create(topic_str, partitions=2)
+        #
+        producer = s.producer(topic_str, type="str", max_in_flight=10, poll_batch_size=5)
+        produce_result1 = producer.produce_async([f"message {i}" for i in range(100)], partition=0)
+        produce_result2 = producer.produce_async([f"message {i}" for i in range(50)], partition=1)
+        self.assertEqual(produce_result2.result(), {1: 49})
+        self.assertEqual(produce_result1.result(), {0: 99})
+        self.assertEqual(100, produce_result1.delivered_int)
+        self.assertEqual(0, produce_result1.failed_int)
+        self.assertEqual([], produce_result1.errors())
+        self.assertTrue(produce_result1.done())
+        producer.close()
+        #
+        self.assertEqual(s.topics(topic_str, size=True, partitions=True)[topic_str]["size"], 150)
+        # The on_delivery function of the user is chained in pipelined mode (set on the producer or per call).
+        offset_int_list1 = []
+        producer = s.producer(topic_str, type="str", on_delivery=lambda kafka_error, message: offset_int_list1.append(message.offset()))
+        produce_result = producer.produce_async([f"message {i}" for i in range(10)], partition=0)
+        self.assertEqual(produce_result.result(), {0: 109})
+        self.assertEqual(offset_int_list1, list(range(100, 110)))
+        #
+        offset_int_list2 = []
+        produce_result = producer.produce_async([f"message {i}" for i in range(10)], partition=1, on_delivery=lambda kafka_error, message: offset_int_list2.append(message.offset()))
+        self.assertEqual(produce_result.result(), {1: 59})
+        self.assertEqual(offset_int_list2, list(range(50, 60)))
+        producer.close()
+
+    def test_aio(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if not s.__class__.__name__ == "Cluster":
+            return
+        #
+        topic_str1 = self.create_test_topic_name()
+        s.create(topic_str1)
+        topic_str2 = self.create_test_topic_name()
+        s.create(topic_str2)
+        #
+        async def produce(topic_str):
+            async with s.aio_producer(topic_str, type="str") as aio_producer:
+                produce_result = await aio_producer.produce([f"message {i}" for i in range(10)])
+                return produce_result.delivered_int
+        #
+        async def consume(topic_str):
+            async with s.aio_consumer(topic_str, group=self.create_test_group_name(), type="str") as aio_consumer:
+                return [m["value"] async for m in aio_consumer.iter(n=10)]
+        #
+        async def main():
+            delivered_int_list = await asyncio.gather(produce(topic_str1), produce(topic_str2))
+            value_str_list_list = await asyncio.gather(consume(topic_str1), consume(topic_str2))
+            return delivered_int_list, value_str_list_list
+        #
+        (delivered_int_list, value_str_list_list) = asyncio.run(main())
+        self.assertEqual(delivered_int_list, [10, 10])
+        self.assertEqual(value_str_list_list, [[f"message {i}" for i in range(10)], [f"message {i}" for i in range(10)]])
+
     def test_consume_from_offsets(self):
         if self.__class__.__name__ == "TestSingleStorageBase":
             return
@@ -788,6 +1002,9 @@ class TestSingleStorageBase(unittest.TestCase):
         self.assertEqual(sorted_m_list3[1]["value"], "message 3")
         self.assertEqual(sorted_m_list3[2]["value"], "message 5")
         self.assertEqual(sorted_m_list3[3]["value"], "message 6")
+        # The last messages are taken evenly from the partitions with the most remaining messages (and not more than all messages).
+        self.assertEqual(consumer3.get_last_n_start_offsets([topic_str], 5)[topic_str], {0: 0, 1: 0, 2: 1})
+        self.assertEqual(consumer3.get_last_n_start_offsets([topic_str], 10)[topic_str], {0: 0, 1: 0, 2: 0})
         consumer3.close()
 
     def test_commit(self):
@@ -839,7 +1056,143 @@ class TestSingleStorageBase(unittest.TestCase):
         self.assertEqual(offsets_dict1[topic_str][0], 3)
         #
         consumer.close()
-    
+
+    def test_iter(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        s.enable_auto_commit(False)
+        s.commit_after_processing(True)
+        #
+        topic_str = self.create_test_topic_name()
+        s.create(topic_str)
+        producer = s.producer(topic_str, type="str")
+        producer.produce([f"message {i}" for i in range(5)])
+        producer.close()
+        # Break after processing three messages (the fourth message has been handed out but not processed, i.e. its offset is not committed).
+        group_str = self.create_test_group_name()
+        consumer = s.consumer(topic_str, group=group_str, type="str")
+        value_str_list = []
+        for m in consumer.iter(consume_batch_size=2):
+            if len(value_str_list) == 3:
+                break
+            value_str_list.append(m["value"])
+        consumer.close()
+        self.assertEqual(value_str_list, ["message 0", "message 1", "message 2"])
+        # Continue with the same consumer group.
+        m_iterator = s.iter(topic_str, group=group_str, type="str")
+        self.assertEqual([m["value"] for m in m_iterator], ["message 3", "message 4"])
+        #
+        self.assertEqual([m["value"] for m in s.iter(topic_str, type="str", n=2)], ["message 0", "message 1"])
+
+    def test_iter_break_rewind(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        s.create(topic_str)
+        producer = s.producer(topic_str, type="str")
+        producer.produce([f"message {i}" for i in range(10)])
+        producer.close()
+        # Break in the middle of a batch - the same consumer continues with the unprocessed messages of the batch.
+        consumer = s.consumer(topic_str, group=self.create_test_group_name(), type="str")
+        value_str_list = []
+        for m in consumer.iter(consume_batch_size=4):
+            if len(value_str_list) == 2:
+                break
+            value_str_list.append(m["value"])
+        self.assertEqual(value_str_list, ["message 0", "message 1"])
+        # Stop early by break_fun (in the middle of the second batch).
+        value_str_list = consumer.foldl(lambda acc, m: acc + [m["value"]], [], consume_batch_size=4, break_fun=lambda acc, _: len(acc) == 5)
+        self.assertEqual(value_str_list, [f"message {i}" for i in range(2, 7)])
+        #
+        self.assertEqual([m["value"] for m in consumer.consume(n=100)], [f"message {i}" for i in range(7, 10)])
+        consumer.close()
+
+    def test_iter_prefilter_commit(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        s.enable_auto_commit(False)
+        s.commit_after_processing(True)
+        #
+        topic_str = self.create_test_topic_name()
+        s.create(topic_str)
+        producer = s.producer(topic_str, type="str")
+        producer.produce([f"message {i}" for i in range(10)])
+        producer.close()
+        # The messages dropped by the prefilter are committed as well (here: the last three).
+        group_str1 = self.create_test_group_name()
+        consumer = s.consumer(topic_str, group=group_str1, type="str")
+        value_str_list = [m["value"] for m in consumer.iter(consume_batch_size=3, prefilter=lambda m: m["value"] < b"message 7")]
+        consumer.close()
+        self.assertEqual(value_str_list, [f"message {i}" for i in range(7)])
+        self.assertEqual(s.group_offsets(group_str1)[group_str1][topic_str][0], 10)
+        # Break after processing message 4 - the dropped messages before it are committed, the ones after the unprocessed message 6 are not.
+        group_str2 = self.create_test_group_name()
+        consumer = s.consumer(topic_str, group=group_str2, type="str")
+        value_str_list = []
+        for m in consumer.iter(consume_batch_size=10, prefilter=lambda m: m["value"] in [b"message 2", b"message 4", b"message 6"]):
+            if len(value_str_list) == 2:
+                break
+            value_str_list.append(m["value"])
+        consumer.close()
+        self.assertEqual(value_str_list, ["message 2", "message 4"])
+        self.assertEqual(s.group_offsets(group_str2)[group_str2][topic_str][0], 6)
+        # With n, the dropped messages after the n-th passing message are neither committed nor skipped.
+        group_str3 = self.create_test_group_name()
+        consumer = s.consumer(topic_str, group=group_str3, type="str")
+        value_str_list = [m["value"] for m in consumer.iter(n=1, consume_batch_size=10, prefilter=lambda m: m["value"] in [b"message 2", b"message 4"])]
+        self.assertEqual(value_str_list, ["message 2"])
+        self.assertEqual(s.group_offsets(group_str3)[group_str3][topic_str][0], 3)
+        self.assertEqual([m["value"] for m in consumer.iter()], [f"message {i}" for i in range(3, 10)])
+        consumer.close()
+        # Batches: dropped messages after the last batch are committed as well.
+        group_str4 = self.create_test_group_name()
+        consumer = s.consumer(topic_str, group=group_str4, type="str")
+        m_list_list = list(consumer.iter_batch(consume_batch_size=2, prefilter=lambda m: m["value"] == b"message 1"))
+        consumer.close()
+        self.assertEqual([[m["value"] for m in m_list] for m_list in m_list_list], [["message 1"]])
+        self.assertEqual(s.group_offsets(group_str4)[group_str4][topic_str][0], 10)
+
+    def test_prefetch_batches(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        s.enable_auto_commit(False)
+        s.commit_after_processing(True)
+        #
+        topic_str = self.create_test_topic_name()
+        s.create(topic_str)
+        producer = s.producer(topic_str, type="str")
+        producer.produce([f"message {i}" for i in range(10)])
+        producer.close()
+        #
+        (value_str_list, message_counter_int) = s.map(topic_str, lambda m: m["value"], group=self.create_test_group_name(), type="str", consume_batch_size=2, prefetch_batches=2)
+        self.assertEqual(value_str_list, [f"message {i}" for i in range(10)])
+        self.assertEqual(10, message_counter_int)
+        # Only the processed messages are committed (not the prefetched ones).
+        group_str = self.create_test_group_name()
+        m_list = s.cat(topic_str, group=group_str, type="str", n=3, consume_batch_size=2, prefetch_batches=3)
+        self.assertEqual([m["value"] for m in m_list], ["message 0", "message 1", "message 2"])
+        m_list = s.cat(topic_str, group=group_str, type="str", n=2)
+        self.assertEqual([m["value"] for m in m_list], ["message 3", "message 4"])
+        # A reused consumer continues after the processed messages (not after the prefetched ones).
+        consumer = s.consumer(topic_str, group=self.create_test_group_name(), type="str")
+        self.assertEqual([m["value"] for m in consumer.foldl(lambda acc, m: acc + [m], [], n=2, consume_batch_size=2, prefetch_batches=3)], ["message 0", "message 1"])
+        self.assertEqual([m["value"] for m in consumer.foldl(lambda acc, m: acc + [m], [], n=2, consume_batch_size=2, prefetch_batches=3)], ["message 2", "message 3"])
+        self.assertEqual([m["value"] for m in consumer.foldl(lambda acc, m: acc + [m], [], n=3, consume_batch_size=2)], ["message 4", "message 5", "message 6"])
+        self.assertEqual([m["value"] for m in consumer.foldl(lambda acc, m: acc + [m], [], n=2, consume_batch_size=2)], ["message 7", "message 8"])
+        consumer.close()
+
     def test_error_handling(self):
         if self.__class__.__name__ == "TestSingleStorageBase":
             return
@@ -1112,6 +1465,80 @@ class TestSingleStorageBase(unittest.TestCase):
     # Shell
 
     # Shell.cat -> Functional.map -> Functional.flatmap -> Functional.foldl -> ClusterConsumer.consumer/KafkaConsumer.foldl/ClusterConsumer.close -> ClusterConsumer.consume
+    def test_watermarks_batched(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__name__ == "Cluster":
+            # The watermarks of all partitions of several topics are queried in two batched requests.
+            topic_str1 = self.create_test_topic_name()
+            s.create(topic_str1, partitions=2)
+            topic_str2 = self.create_test_topic_name()
+            s.create(topic_str2, partitions=3)
+            #
+            producer = s.producer(topic_str1, value_type="str")
+            producer.produce(["message 0", "message 1", "message 2", "message 3"], partition=[0, 0, 0, 1])
+            producer.close()
+            producer = s.producer(topic_str2, value_type="str")
+            producer.produce(["message 0", "message 1", "message 2", "message 3", "message 4", "message 5"], partition=[0, 0, 2, 2, 2, 2])
+            producer.close()
+            #
+            topic_str_partition_int_offsets_tuple_dict_dict = s.watermarks([topic_str1, topic_str2])
+            self.assertEqual(topic_str_partition_int_offsets_tuple_dict_dict, {topic_str1: {0: (0, 3), 1: (0, 1)}, topic_str2: {0: (0, 2), 1: (0, 0), 2: (0, 4)}})
+            # A pattern which does not match any topic.
+            self.assertEqual(s.watermarks(f"{topic_str1}_no_such_topic*"), {})
+            # The high watermarks depend on the isolation level (read_committed: the last stable offset, i.e. not after an open transaction).
+            transactional_id_str = f"test_transactional_id_{get_millis()}"
+            producer = s.producer(topic_str1, value_type="str", config={"transactional.id": transactional_id_str})
+            producer.init_transactions()
+            producer.begin_transaction()
+            producer.produce("message 4", partition=1)
+            producer.flush()
+            self.assertEqual(s.watermarks(topic_str1)[topic_str1][1], (0, 1))
+            isolation_level_str = s.kafka_config_dict.get("isolation.level")
+            s.kafka_config_dict["isolation.level"] = "read_uncommitted"
+            try:
+                self.assertEqual(s.watermarks(topic_str1)[topic_str1][1], (0, 2))
+            finally:
+                if isolation_level_str is None:
+                    del s.kafka_config_dict["isolation.level"]
+                else:
+                    s.kafka_config_dict["isolation.level"] = isolation_level_str
+            producer.abort_transaction()
+            producer.close()
+
+    def test_delete_records_batched(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__name__ == "Cluster":
+            topic_str1 = self.create_test_topic_name()
+            s.create(topic_str1, partitions=2)
+            topic_str2 = self.create_test_topic_name()
+            s.create(topic_str2, partitions=2)
+            for topic_str in [topic_str1, topic_str2]:
+                producer = s.producer(topic_str, value_type="str")
+                producer.produce(["message 0", "message 1", "message 2"], partition=[0, 0, 1])
+                producer.close()
+            # Delete all records of several topics (with the metadata fetched once).
+            s.delete_records([topic_str1, topic_str2])
+            time.sleep(1)
+            self.assertEqual(s.watermarks([topic_str1, topic_str2]), {topic_str1: {0: (2, 2), 1: (1, 1)}, topic_str2: {0: (2, 2), 1: (1, 1)}})
+            # A pattern which does not match any topic deletes nothing.
+            s.delete_records(f"{topic_str1}_no_such_topic*")
+            # Delete the records before the given offsets of several topics and partitions.
+            for topic_str in [topic_str1, topic_str2]:
+                producer = s.producer(topic_str, value_type="str")
+                producer.produce(["message 3", "message 4", "message 5"], partition=[0, 0, 1])
+                producer.close()
+            s.delete_records({topic_str1: {0: 3, 1: 1}, topic_str2: {1: 2}})
+            time.sleep(1)
+            self.assertEqual(s.watermarks([topic_str1, topic_str2]), {topic_str1: {0: (3, 4), 1: (1, 2)}, topic_str2: {0: (2, 4), 1: (2, 2)}})
+
     def test_cat(self):
         if self.__class__.__name__ == "TestSingleStorageBase":
             return
@@ -1391,6 +1818,101 @@ class TestSingleStorageBase(unittest.TestCase):
         self.assertEqual(2, len(m_list))
         self.assertEqual(3, message_counter_int)
 
+    def test_map_batch(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        s.create(topic_str)
+        producer = s.producer(topic_str, type="str")
+        producer.produce([f"message {i}" for i in range(10)])
+        producer.close()
+        #
+        (value_str_list, message_counter_int) = s.map_batch(topic_str, lambda m_list: [m["value"] for m in m_list], group=self.create_test_group_name(), type="str", consume_batch_size=3)
+        self.assertEqual(value_str_list, [f"message {i}" for i in range(10)])
+        self.assertEqual(10, message_counter_int)
+        # n and the end offsets are applied to whole batches.
+        (batch_size_int_list, message_counter_int) = s.foldl_batch(topic_str, lambda acc, m_list: acc + [len(m_list)], [], n=7, group=self.create_test_group_name(), type="str", consume_batch_size=3)
+        self.assertEqual(batch_size_int_list, [3, 3, 1])
+        self.assertEqual(7, message_counter_int)
+        #
+        (offset_int_list, _) = s.map_batch(topic_str, lambda m_list: [m["offset"] for m in m_list], group=self.create_test_group_name(), type="str", consume_batch_size=3, offsets={0: 2}, end_offsets={0: 5})
+        self.assertEqual(offset_int_list, [2, 3, 4, 5])
+
+    def test_parallel_foldl(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        s.create(topic_str, partitions=4)
+        producer = s.producer(topic_str, type="str")
+        for partition_int in range(4):
+            producer.produce([f"message {partition_int} {i}" for i in range(5)], partition=partition_int)
+        producer.close()
+        #
+        (sum_int, message_counter_int) = s.foldl(topic_str, lambda acc, m: acc + m["offset"], 0, group=self.create_test_group_name(), type="str", parallel=2, combine_fun=lambda acc1, acc2: acc1 + acc2)
+        self.assertEqual(sum_int, 4 * sum(range(5)))
+        self.assertEqual(20, message_counter_int)
+        # The results of map() are concatenated per partition group (partitions 0 and 2 for the first worker, 1 and 3 for the second).
+        (value_str_list, message_counter_int) = s.map(topic_str, lambda m: m["value"], group=self.create_test_group_name(), type="str", parallel=2)
+        self.assertEqual(sorted(value_str_list), sorted([f"message {partition_int} {i}" for partition_int in range(4) for i in range(5)]))
+        self.assertEqual(20, message_counter_int)
+        #
+        with self.assertRaises(Exception):
+            s.foldl(topic_str, lambda acc, m: acc + 1, 0, group=self.create_test_group_name(), type="str", parallel=2)
+        # Only the given partitions are folded over, and n is shared by the workers (partitions 1 and 3 for the first worker, 2 for the second).
+        (partition_int_list, message_counter_int) = s.foldl(topic_str, lambda acc, m: acc + [m["partition"]], [], n=6, partitions={topic_str: [1, 2, 3]}, group=self.create_test_group_name(), type="str", parallel=2, combine_fun=lambda acc1, acc2: acc1 + acc2)
+        self.assertEqual(6, message_counter_int)
+        self.assertEqual(6, len(partition_int_list))
+        self.assertTrue(set(partition_int_list) <= {1, 2, 3})
+        # Uneven partitions: the worker of partition 0 (2 messages) leaves the rest of n to the worker of partition 1 (10 messages).
+        topic_str1 = self.create_test_topic_name()
+        s.create(topic_str1, partitions=2)
+        producer = s.producer(topic_str1, type="str")
+        producer.produce([f"message 0 {i}" for i in range(2)], partition=0)
+        producer.produce([f"message 1 {i}" for i in range(10)], partition=1)
+        producer.close()
+        (partition_int_list, message_counter_int) = s.foldl(topic_str1, lambda acc, m: acc + [m["partition"]], [], n=8, group=self.create_test_group_name(), type="str", parallel=2, combine_fun=lambda acc1, acc2: acc1 + acc2)
+        self.assertEqual(8, message_counter_int)
+        self.assertEqual(sorted(partition_int_list), [0] * 2 + [1] * 6)
+        #
+        (partition_int_list, message_counter_int) = s.foldl(topic_str, lambda acc, m: acc + [m["partition"]], [], partitions={topic_str: [2]}, group=self.create_test_group_name(), type="str", parallel=2, combine_fun=lambda acc1, acc2: acc1 + acc2)
+        self.assertEqual(partition_int_list, [2] * 5)
+
+    def test_project_prefilter(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        s.create(topic_str)
+        producer = s.producer(topic_str, key_type="str", value_type="json")
+        for i, value_dict in enumerate(self.value_snack_dict_list):
+            producer.produce(value_dict, key=f"key{i}", headers={"index": f"{i}"})
+        producer.close()
+        # Only the keys are deserialized.
+        (m_list, message_counter_int) = s.map(topic_str, lambda m: m, group=self.create_test_group_name(), key_type="str", value_type="json", project=["key"])
+        self.assertEqual(3, message_counter_int)
+        self.assertEqual([m["key"] for m in m_list], ["key0", "key1", "key2"])
+        self.assertEqual([m["value"] for m in m_list], [None, None, None])
+        self.assertEqual([m["offset"] for m in m_list], [0, 1, 2])
+        #
+        if not s.__class__.__name__ == "RestProxy":
+            self.assertEqual([m["headers"] for m in m_list], [None, None, None])
+            # Only the messages passing the prefilter on the raw headers are deserialized (and counted).
+            (m_list, message_counter_int) = s.map(topic_str, lambda m: m, group=self.create_test_group_name(), key_type="str", value_type="json", prefilter=lambda m: ("index", b"1") in m["headers"])
+            self.assertEqual(1, message_counter_int)
+            self.assertEqual(m_list[0]["value"], self.value_snack_dict_list[1])
+            self.assertEqual(m_list[0]["headers"], [("index", b"1")])
+        #
+        with self.assertRaises(Exception):
+            s.map(topic_str, lambda m: m, group=self.create_test_group_name(), project=["timestamp"])
+
     def test_filter_to(self):
         if self.__class__.__name__ == "TestSingleStorageBase":
             return
@@ -2074,3 +2596,623 @@ class TestSingleStorageBase(unittest.TestCase):
         self.assertEqual(len(m_list), 2)
         self.assertEqual(m_list[0]["value"], "message 1")
         self.assertEqual(m_list[1]["value"], "message 2")
+
+    ### FS
+    # Segments
+
+    def test_segment_format(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__bases__[0].__name__ == "FS":
+            topic_str = self.create_test_topic_name()
+            s.create(topic_str)
+            # Values with newlines, None keys/values and headers must survive the binary segment format.
+            producer = s.producer(topic_str, type="bytes")
+            producer.produce([b"line 1\nline 2", None, b"\x00\xff"], key=[None, b"key 1", b"key\n2"], headers=self.headers_str_bytes_tuple_list)
+            producer.close()
+            #
+            group_str1 = self.create_test_group_name()
+            consumer = s.consumer(topic_str, group=group_str1, type="bytes")
+            m_list1 = consumer.consume(n=3)
+            consumer.close()
+            self.assertEqual([m["value"] for m in m_list1], [b"line 1\nline 2", None, b"\x00\xff"])
+            self.assertEqual([m["key"] for m in m_list1], [None, b"key 1", b"key\n2"])
+            self.assertEqual(m_list1[0]["headers"], self.headers_str_bytes_tuple_list)
+            # Legacy repr() segments stay readable.
+            legacy_m = {"topic": topic_str, "value": b"legacy", "key": None, "timestamp": (1, get_millis()), "headers": None, "partition": 0, "offset": 3}
+            legacy_rel_file_str = f"{0:09},{3:021},{3:021},{legacy_m['timestamp'][1]},{legacy_m['timestamp'][1]}"
+            s.admin.write_bytes(os.path.join(s.admin.get_topic_abs_path_str(topic_str), "partitions", legacy_rel_file_str), str(legacy_m).encode("utf-8") + b"\n")
+            # Legacy topics do not have a manifest yet (it is rebuilt from the partition files).
+            s.admin.delete_file(os.path.join(s.admin.get_topic_abs_path_str(topic_str), "manifest"))
+            #
+            group_str2 = self.create_test_group_name()
+            consumer = s.consumer(topic_str, group=group_str2, type="bytes")
+            m_list2 = consumer.consume(n=4)
+            consumer.close()
+            self.assertEqual([m["offset"] for m in m_list2], [0, 1, 2, 3])
+            self.assertEqual(m_list2[3]["value"], b"legacy")
+
+    def test_segment_index(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__bases__[0].__name__ == "FS":
+            s.index_interval_bytes(64)
+            #
+            topic_str = self.create_test_topic_name()
+            s.create(topic_str)
+            producer = s.producer(topic_str, value_type="str")
+            producer.produce([f"message {i}" for i in range(100)], timestamp=[1000 + i for i in range(100)])
+            producer.close()
+            #
+            rel_file_str_list = s.admin.list_partition_files(topic_str)
+            self.assertEqual(len(rel_file_str_list), 1)
+            abs_path_file_str = os.path.join(s.admin.get_topic_abs_path_str(topic_str), "partitions", rel_file_str_list[0])
+            self.assertTrue(s.admin.exists_file(abs_path_file_str + ".index"))
+            # Seek via the offset index.
+            group_str = self.create_test_group_name()
+            consumer = s.consumer(topic_str, group=group_str, value_type="str", offsets={0: 57})
+            m_list = consumer.consume(n=3)
+            consumer.close()
+            self.assertEqual([m["value"] for m in m_list], ["message 57", "message 58", "message 59"])
+            # Seek via the time index.
+            self.assertEqual(s.offsets_for_times(topic_str, {0: 1042})[topic_str][0], 42)
+            self.assertEqual(s.offsets_for_times(topic_str, {0: 999})[topic_str][0], 0)
+
+    def test_write_bytes_if_match(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__bases__[0].__name__ == "FS":
+            topic_str = self.create_test_topic_name()
+            s.create(topic_str)
+            abs_path_file_str = os.path.join(s.admin.get_topic_abs_path_str(topic_str), "cas")
+            # Create only if the file does not exist yet.
+            etag1 = s.admin.write_bytes_if_match(abs_path_file_str, b"version 1", None)
+            self.assertIsNotNone(etag1)
+            self.assertIsNone(s.admin.write_bytes_if_match(abs_path_file_str, b"version 1b", None))
+            # The ETag returned by the write is the same as the one returned by the read.
+            self.assertEqual(s.admin.read_bytes_etag(abs_path_file_str), (b"version 1", etag1))
+            # Replace only if the file has not been replaced in the meantime.
+            etag2 = s.admin.write_bytes_if_match(abs_path_file_str, b"version 2", etag1)
+            self.assertIsNotNone(etag2)
+            self.assertIsNone(s.admin.write_bytes_if_match(abs_path_file_str, b"version 3", etag1))
+            self.assertEqual(s.admin.read_bytes_etag(abs_path_file_str), (b"version 2", etag2))
+
+    def test_segment_manifest(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__bases__[0].__name__ == "FS":
+            topic_str = self.create_test_topic_name()
+            s.create(topic_str, partitions=2)
+            # A new producer starts a new segment.
+            producer = s.producer(topic_str, value_type="str")
+            producer.produce([f"message {i}" for i in range(4)], partition=[0, 1, 0, 1], timestamp=[1000, 1001, 1002, 1003])
+            producer.close()
+            producer = s.producer(topic_str, value_type="str")
+            producer.produce([f"message {i}" for i in range(4, 6)], partition=0, timestamp=[1004, 1005])
+            producer.close()
+            #
+            manifest_dict = s.admin.get_manifest(topic_str)
+            self.assertEqual({partition_int: [segment_tuple[:4] for segment_tuple in segment_tuple_list] for partition_int, segment_tuple_list in manifest_dict["partitions"].items()}, {0: [(0, 1, 1000, 1002), (2, 3, 1004, 1005)], 1: [(0, 1, 1001, 1003)]})
+            self.assertEqual(manifest_dict["log_start_offsets"], {})
+            # The size of each segment is kept in the manifest (for retention.bytes).
+            self.assertEqual(manifest_dict["partitions"][0][0][4], len(s.admin.read_bytes(os.path.join(s.admin.get_topic_abs_path_str(topic_str), "partitions", "000000000,000000000000000000000,000000000000000000001,1000,1002"))))
+            self.assertEqual(s.watermarks(topic_str)[topic_str], {0: (0, 4), 1: (0, 2)})
+            # The manifest is rebuilt from the partition files if it is missing.
+            s.admin.delete_file(os.path.join(s.admin.get_topic_abs_path_str(topic_str), "manifest"))
+            self.assertEqual(s.admin.get_manifest(topic_str), manifest_dict)
+            #
+            self.assertEqual(s.offsets_for_times(topic_str, {0: 1003, 1: 1003})[topic_str], {0: 2, 1: 1})
+            #
+            group_str = self.create_test_group_name()
+            consumer = s.consumer(topic_str, group=group_str, value_type="str")
+            m_list = consumer.consume(n=6)
+            consumer.close()
+            self.assertEqual(len(m_list), 6)
+
+    def test_manifest_reads(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__bases__[0].__name__ == "FS":
+            topic_str = self.create_test_topic_name()
+            s.create(topic_str, partitions=2)
+            producer = s.producer(topic_str, value_type="str")
+            producer.produce([f"message {i}" for i in range(4)], partition=[0, 0, 0, 1], timestamp=[1000, 2000, 3000, 1000])
+            producer.close()
+            # Count the reads of the manifest.
+            get_manifest_fun = s.admin.get_manifest
+            topic_str_list = []
+            def get_manifest(topic_str):
+                topic_str_list.append(topic_str)
+                return get_manifest_fun(topic_str)
+            s.admin.get_manifest = get_manifest
+            try:
+                # The manifest is read once (and reused for replacing the offsets not found).
+                self.assertEqual(s.offsets_for_times(topic_str, {0: 2000, 1: 2000}, replace_not_found=True), {topic_str: {0: 1, 1: 0}})
+                self.assertEqual(len(topic_str_list), 1)
+                # Callers can pass the manifests they have read already.
+                manifest_dict = get_manifest_fun(topic_str)
+                self.assertEqual(s.watermarks(topic_str, manifests={topic_str: manifest_dict}), {topic_str: {0: (0, 3), 1: (0, 1)}})
+                self.assertEqual(s.offsets_for_times(topic_str, {0: 3000, 1: 3000}, replace_not_found=True, manifests={topic_str: manifest_dict}), {topic_str: {0: 2, 1: 0}})
+                self.assertEqual(len(topic_str_list), 1)
+            finally:
+                s.admin.get_manifest = get_manifest_fun
+
+    def test_prefetch(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__bases__[0].__name__ == "FS":
+            topic_str = self.create_test_topic_name()
+            s.create(topic_str, partitions=2)
+            producer = s.producer(topic_str, value_type="str")
+            for i in range(10):
+                producer.produce([f"message {i} {j}" for j in range(4)], partition=[0, 1, 0, 1])
+            producer.close()
+            # Without prefetching, with a prefetch depth and with a memory cap smaller than a single partition file.
+            for prefetch_depth_int, prefetch_max_bytes_int in [(0, 67108864), (3, 67108864), (3, 1)]:
+                s.prefetch_depth(prefetch_depth_int)
+                s.prefetch_max_bytes(prefetch_max_bytes_int)
+                #
+                group_str = self.create_test_group_name()
+                consumer = s.consumer(topic_str, group=group_str, value_type="str")
+                m_list = consumer.consume(n=15) + consumer.consume(n=100)
+                consumer.close()
+                #
+                self.assertEqual(len(m_list), 40)
+                for partition_int in range(2):
+                    self.assertEqual([m["offset"] for m in m_list if m["partition"] == partition_int], list(range(20)))
+                    self.assertEqual([m["value"] for m in m_list if m["partition"] == partition_int], [f"message {i} {j}" for i in range(10) for j in range(partition_int, 4, 2)])
+
+    def test_prefetch_across_batches(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__bases__[0].__name__ == "FS":
+            topic_str = self.create_test_topic_name()
+            s.create(topic_str, partitions=2)
+            producer = s.producer(topic_str, value_type="str")
+            producer.produce([f"message {i}" for i in range(40)], partition=[i % 2 for i in range(40)])
+            producer.close()
+            #
+            s.prefetch_depth(4)
+            # Count the partition files read (downloaded on object stores).
+            read_partition_file_bytes_fun = s.admin.read_partition_file_bytes
+            rel_file_str_list = []
+            def read_partition_file_bytes(topic_str, rel_file_str, offset_int=None, timestamp_int=None):
+                rel_file_str_list.append(rel_file_str)
+                return read_partition_file_bytes_fun(topic_str, rel_file_str, offset_int, timestamp_int)
+            s.admin.read_partition_file_bytes = read_partition_file_bytes
+            try:
+                consumer = s.consumer(topic_str, group=self.create_test_group_name(), value_type="str")
+                # The partition files prefetched for the first batch are decoded further by the following batches (instead of being read again).
+                m_list = []
+                for _ in range(6):
+                    m_list += consumer.consume(n=5)
+                self.assertEqual(len(m_list), 30)
+                self.assertEqual(len(rel_file_str_list), 2)
+                # The prefetched partition files of the topic are dropped (and read again) if the consumer is moved.
+                consumer.seek(topic_str, 0, 0)
+                m_list = consumer.consume(n=5)
+                self.assertEqual([(m["partition"], m["offset"]) for m in m_list], [(0, i) for i in range(5)])
+                self.assertEqual(len(rel_file_str_list), 4)
+                consumer.close()
+            finally:
+                s.admin.read_partition_file_bytes = read_partition_file_bytes_fun
+
+    def test_segment_streaming(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__bases__[0].__name__ == "FS":
+            # Records split across arbitrary chunk boundaries are decoded incrementally.
+            m_list = [{"value": f"message {i}".encode("utf-8") * i, "key": None, "timestamp": (1, 1000 + i), "headers": None, "offset": i} for i in range(20)]
+            (segment_bytes, _) = encode_segment(m_list, 4096)
+            for chunk_size_int in [1, 7, len(segment_bytes)]:
+                chunk_bytes_generator = (segment_bytes[i:i + chunk_size_int] for i in range(0, len(segment_bytes), chunk_size_int))
+                self.assertEqual([m["value"] for m in decode_segment_chunks(chunk_bytes_generator, "topic", 0)], [m["value"] for m in m_list])
+
+            # Records much larger than the chunks are only joined once all their chunks have been read.
+            m_list = [{"value": bytes([i]) * 4194304, "key": None, "timestamp": (1, 1000 + i), "headers": None, "offset": i} for i in range(3)]
+            (segment_bytes, _) = encode_segment(m_list, 4096)
+            chunk_bytes_generator = (segment_bytes[i:i + 4096] for i in range(0, len(segment_bytes), 4096))
+            self.assertEqual([m["value"] for m in decode_segment_chunks(chunk_bytes_generator, "topic", 0)], [m["value"] for m in m_list])
+            #
+            topic_str = self.create_test_topic_name()
+            s.create(topic_str)
+            producer = s.producer(topic_str, value_type="str")
+            producer.produce([f"message {i}" for i in range(10)])
+            producer.close()
+            # Without prefetching, the partition files are streamed.
+            s.prefetch_depth(0)
+            group_str = self.create_test_group_name()
+            consumer = s.consumer(topic_str, group=group_str, value_type="str", offsets={0: 5})
+            m_list = consumer.consume(n=10)
+            consumer.close()
+            self.assertEqual([m["value"] for m in m_list], [f"message {i}" for i in range(5, 10)])
+
+    def test_segment_rolling(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__bases__[0].__name__ == "FS":
+            s.index_interval_bytes(64)
+            # Many small batches are appended to the active segment of the partition.
+            topic_str1 = self.create_test_topic_name()
+            s.create(topic_str1)
+            producer = s.producer(topic_str1, value_type="str")
+            for i in range(20):
+                producer.produce(f"message {i}")
+            producer.close()
+            #
+            # Without appends (S3, Azure Blob Storage), the active segment is rolled after segment.rewrite.appends (16) produces.
+            self.assertEqual(len(s.admin.list_partition_files(topic_str1)), 1 if s.admin.append_bool else 2)
+            self.assertEqual(s.watermarks(topic_str1)[topic_str1], {0: (0, 20)})
+            #
+            topic_str5 = self.create_test_topic_name()
+            s.create(topic_str5, config={"segment.rewrite.appends": 4})
+            producer = s.producer(topic_str5, value_type="str")
+            for i in range(20):
+                producer.produce(f"message {i}")
+            producer.close()
+            #
+            self.assertEqual(len(s.admin.list_partition_files(topic_str5)), 1 if s.admin.append_bool else 5)
+            group_str = self.create_test_group_name()
+            consumer = s.consumer(topic_str5, group=group_str, value_type="str", offsets={0: 5})
+            m_list = consumer.consume(n=100)
+            consumer.close()
+            self.assertEqual([m["value"] for m in m_list], [f"message {i}" for i in range(5, 20)])
+            # The active segment is rolled when it reaches segment.bytes (topic configuration overrides the kafi configuration).
+            topic_str2 = self.create_test_topic_name()
+            s.create(topic_str2, config={"segment.bytes": 100})
+            producer = s.producer(topic_str2, value_type="str")
+            for i in range(10):
+                producer.produce([f"message {i} {j}" for j in range(3)])
+            producer.close()
+            #
+            manifest_dict = s.admin.get_manifest(topic_str2)
+            self.assertGreater(len(manifest_dict["partitions"][0]), 1)
+            self.assertEqual(sorted(s.admin.list_partition_files(topic_str2)), sorted([rel_file_str for rel_file_str_list in s.admin.get_partition_files(topic_str2, [0]).values() for rel_file_str in rel_file_str_list]))
+            self.assertEqual([segment_tuple[0] for segment_tuple in manifest_dict["partitions"][0][1:]], [segment_tuple[1] + 1 for segment_tuple in manifest_dict["partitions"][0][:-1]])
+            #
+            group_str = self.create_test_group_name()
+            consumer = s.consumer(topic_str2, group=group_str, value_type="str", offsets={0: 13})
+            m_list = consumer.consume(n=100)
+            consumer.close()
+            self.assertEqual([m["value"] for m in m_list], [f"message {i} {j}" for i in range(10) for j in range(3)][13:])
+            # The active segment is rolled after segment.ms.
+            s.segment_ms(0)
+            topic_str3 = self.create_test_topic_name()
+            s.create(topic_str3)
+            producer = s.producer(topic_str3, value_type="str")
+            for i in range(3):
+                producer.produce(f"message {i}")
+            producer.close()
+            #
+            self.assertEqual(len(s.admin.list_partition_files(topic_str3)), 3)
+            # A consumer with a cached manifest finds the renamed active segment.
+            s.segment_ms(604800000)
+            topic_str4 = self.create_test_topic_name()
+            s.create(topic_str4)
+            producer = s.producer(topic_str4, value_type="str")
+            producer.produce("message 0")
+            group_str = self.create_test_group_name()
+            consumer = s.consumer(topic_str4, group=group_str, value_type="str")
+            self.assertEqual([m["value"] for m in consumer.consume(n=1)], ["message 0"])
+            producer.produce(["message 1", "message 2"])
+            consumer.topic_str_manifest_dict_dict[topic_str4]["partitions"][0] = [(0, 1, 0, 0, 0)]
+            consumer.topic_str_next_offsets_dict_dict[topic_str4][0] = 0
+            self.assertEqual([m["value"] for m in consumer.consume(n=3)], ["message 0", "message 1", "message 2"])
+            consumer.close()
+            producer.close()
+
+    def test_segment_retention(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__bases__[0].__name__ == "FS":
+            # One segment per producer (each with two messages).
+            def produce(topic_str, i_list, timestamp=0):
+                for i in i_list:
+                    producer = s.producer(topic_str, value_type="str")
+                    producer.produce([f"message {2 * i}", f"message {2 * i + 1}"], timestamp=timestamp)
+                    producer.close()
+            # delete_records() only deletes whole segments and moves the low watermark forward.
+            topic_str1 = self.create_test_topic_name()
+            s.create(topic_str1)
+            produce(topic_str1, range(3))
+            self.assertEqual(len(s.admin.list_partition_files(topic_str1)), 3)
+            #
+            group_str = self.create_test_group_name()
+            consumer = s.consumer(topic_str1, group=group_str, value_type="str")
+            self.assertEqual(len(consumer.consume(n=1)), 1)
+            #
+            s.delete_records({topic_str1: {0: 3}})
+            self.assertEqual(s.watermarks(topic_str1)[topic_str1], {0: (3, 6)})
+            self.assertEqual(len(s.admin.list_partition_files(topic_str1)), 2)
+            self.assertEqual(s.l(topic_str1)[topic_str1], 3)
+            self.assertEqual([m["value"] for m in s.cat(topic_str1, value_type="str")], ["message 3", "message 4", "message 5"])
+            # A consumer with a cached manifest skips the deleted segment.
+            self.assertEqual([m["value"] for m in consumer.consume(n=100)], ["message 3", "message 4", "message 5"])
+            consumer.close()
+            # The last segment is never deleted (only the low watermark moves forward).
+            s.delete_records(topic_str1)
+            self.assertEqual(s.watermarks(topic_str1)[topic_str1], {0: (6, 6)})
+            self.assertEqual(len(s.admin.list_partition_files(topic_str1)), 1)
+            self.assertEqual(s.cat(topic_str1), [])
+            # New messages continue after the high watermark.
+            produce(topic_str1, [3])
+            self.assertEqual(s.watermarks(topic_str1)[topic_str1], {0: (6, 8)})
+            self.assertEqual([m["value"] for m in s.cat(topic_str1, value_type="str")], ["message 6", "message 7"])
+            # retention.ms deletes the segments with expired timestamps (on produce or via enforce_retention()).
+            topic_str2 = self.create_test_topic_name()
+            s.create(topic_str2)
+            produce(topic_str2, range(2), timestamp=1000)
+            s.config(topic_str2, {"retention.ms": 60000})
+            self.assertEqual(s.admin.enforce_retention(topic_str2), {topic_str2: {0: 2}})
+            produce(topic_str2, [2], timestamp=1000)
+            produce(topic_str2, [3])
+            self.assertEqual(s.watermarks(topic_str2)[topic_str2], {0: (6, 8)})
+            self.assertEqual(len(s.admin.list_partition_files(topic_str2)), 1)
+            # retention.bytes keeps (at least) retention.bytes of the newest segments.
+            topic_str3 = self.create_test_topic_name()
+            s.create(topic_str3)
+            produce(topic_str3, range(4))
+            segment_size_int = s.admin.get_manifest(topic_str3)["partitions"][0][0][4]
+            s.config(topic_str3, {"retention.bytes": 2 * segment_size_int})
+            self.assertEqual(s.admin.enforce_retention(topic_str3), {topic_str3: {0: 4}})
+            self.assertEqual(s.offsets_for_times(topic_str3, {0: 0})[topic_str3], {0: 4})
+
+    def test_segment_compaction(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__bases__[0].__name__ == "FS":
+            topic_str = self.create_test_topic_name()
+            s.create(topic_str, config={"cleanup.policy": "compact"})
+            # One segment per producer (the closed segments are compacted in the background whenever a new segment is started).
+            def produce(key_str_value_str_tuple_list):
+                producer = s.producer(topic_str, key_type="str", value_type="str")
+                producer.produce([value_str for _, value_str in key_str_value_str_tuple_list], key=[key_str for key_str, _ in key_str_value_str_tuple_list])
+                producer.close()
+                s.admin.topic_str_compaction_future_dict[topic_str].result()
+            #
+            produce([("a", "1"), ("b", "1")])
+            produce([("a", "2"), ("c", "1")])
+            produce([("b", None), ("d", "1")])
+            # The first segment is left empty and removed, the tombstone is kept for delete.retention.ms.
+            self.assertEqual([(m["offset"], m["key"], m["value"]) for m in s.cat(topic_str, key_type="str", value_type="str")], [(2, "a", "2"), (3, "c", "1"), (4, "b", None), (5, "d", "1")])
+            self.assertEqual(s.watermarks(topic_str)[topic_str], {0: (2, 6)})
+            self.assertEqual(len(s.admin.list_partition_files(topic_str)), 2)
+            #
+            group_str = self.create_test_group_name()
+            consumer = s.consumer(topic_str, group=group_str, key_type="str", value_type="str")
+            m_list = consumer.consume(n=1)
+            #
+            s.config(topic_str, {"cleanup.policy": "compact", "delete.retention.ms": 0})
+            time.sleep(0.01)
+            produce([("c", "2")])
+            # The compacted segments are rewritten under a new name (keeping their offsets), the tombstone is dropped.
+            self.assertEqual([(m["offset"], m["key"], m["value"]) for m in s.cat(topic_str, key_type="str", value_type="str")], [(2, "a", "2"), (5, "d", "1"), (6, "c", "2")])
+            self.assertEqual(s.watermarks(topic_str)[topic_str], {0: (2, 7)})
+            self.assertEqual(sorted(rel_file_str.split(",")[5] for rel_file_str in s.admin.list_partition_files(topic_str) if len(rel_file_str.split(",")) > 5), ["1", "1"])
+            # A consumer with a cached manifest finds the compacted segments.
+            m_list += consumer.consume(n=100)
+            m_list += consumer.consume(n=100)
+            consumer.close()
+            self.assertEqual([(m["offset"], m["key"], m["value"]) for m in m_list], [(2, "a", "2"), (5, "d", "1"), (6, "c", "2")])
+            # The manifest is rebuilt with the compacted segments.
+            manifest_dict = s.admin.get_manifest(topic_str)
+            s.admin.delete_file(os.path.join(s.admin.get_topic_abs_path_str(topic_str), "manifest"))
+            self.assertEqual(s.admin.get_manifest(topic_str), manifest_dict)
+            # Committed offsets in gaps left by compaction continue with the next segment.
+            consumer = s.consumer(topic_str, group=self.create_test_group_name(), key_type="str", value_type="str", offsets={0: 3})
+            self.assertEqual([m["offset"] for m in consumer.consume(n=100)], [5, 6])
+            consumer.close()
+            #
+            self.assertEqual(s.admin.compact_log(topic_str), {topic_str: {0: 0}})
+
+    def test_zero_copy(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__bases__[0].__name__ == "FS":
+            topic_str = self.create_test_topic_name()
+            s.create(topic_str)
+            producer = s.producer(topic_str, key_type="str", value_type="json")
+            producer.produce([{"message": i} for i in range(10)], key=[f"key {i}" for i in range(10)])
+            producer.close()
+            # Keys and values are handed out as memoryview slices of the partition files (memory-mapped for local topics).
+            consumer = s.consumer(topic_str, group=self.create_test_group_name(), type="bytes", zero_copy=True)
+            m_list = consumer.consume(n=10)
+            consumer.close()
+            self.assertIsInstance(m_list[0]["value"], memoryview)
+            self.assertEqual([bytes(m["key"]) for m in m_list], [f"key {i}".encode("utf-8") for i in range(10)])
+            # "str" is decoded from the memoryview slices directly, other types are copied.
+            consumer = s.consumer(topic_str, group=self.create_test_group_name(), key_type="str", value_type="json", zero_copy=True)
+            m_list = consumer.consume(n=10)
+            consumer.close()
+            self.assertEqual([(m["key"], m["value"]) for m in m_list], [(f"key {i}", {"message": i}) for i in range(10)])
+            # Without zero_copy, keys and values are bytes.
+            consumer = s.consumer(topic_str, group=self.create_test_group_name(), type="bytes", offsets={0: 5})
+            m_list = consumer.consume(n=10)
+            consumer.close()
+            self.assertIsInstance(m_list[0]["value"], bytes)
+            self.assertEqual([m["offset"] for m in m_list], list(range(5, 10)))
+
+    def test_serde_fun_cache(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        s.create(topic_str)
+        producer = s.producer(topic_str, key_type="str", value_type="json")
+        # The serialization functions are resolved once per type and reused for every message.
+        self.assertIs(producer.get_serialize_fun(False), producer.get_serialize_fun(False))
+        self.assertIs(producer.get_serialize_fun(True), producer.key_serialize_fun)
+        producer.produce([{"message": i} for i in range(10)], key=[f"key {i}" for i in range(10)])
+        producer.close()
+        #
+        consumer = s.consumer(topic_str, group=self.create_test_group_name(), key_type="str", value_type="json")
+        m_list = consumer.consume(n=10)
+        # The deserialization functions are resolved once per type, topic and key/value and reused for every message.
+        self.assertIs(consumer.get_deserialize_fun("json", topic_str, False), consumer.get_deserialize_fun("JSON", topic_str, False))
+        self.assertIsNot(consumer.get_deserialize_fun("str", topic_str, True), consumer.get_deserialize_fun("str", topic_str, False))
+        consumer.close()
+        self.assertEqual([(m["key"], m["value"]) for m in m_list], [(f"key {i}", {"message": i}) for i in range(10)])
+
+    def test_segment_compression(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__bases__[0].__name__ == "FS":
+            s.index_interval_bytes(256)
+            s.batch_size(512)
+            #
+            value_dict_list = [{"id": i, "name": "cookie", "calories": 500.0, "colour": "brown"} for i in range(200)]
+            #
+            topic_str_size_int_dict = {}
+            for compression_type_str in ["none", "gzip", "lz4", "zstd"]:
+                topic_str = self.create_test_topic_name()
+                s.create(topic_str, config={"compression.type": compression_type_str})
+                self.assertEqual(s.admin.get_config(topic_str)["compression.type"], compression_type_str)
+                #
+                producer = s.producer(topic_str)
+                producer.produce(value_dict_list[:100], key=[str(i) for i in range(100)], timestamp=[1000 + i for i in range(100)])
+                producer.produce(value_dict_list[100:], key=[str(i) for i in range(100, 200)], timestamp=[1100 + i for i in range(100)])
+                producer.close()
+                #
+                rel_file_str_list = s.admin.list_files(os.path.join(s.admin.get_topic_abs_path_str(topic_str), "partitions"))
+                topic_str_size_int_dict[compression_type_str] = sum(len(s.admin.read_bytes(os.path.join(s.admin.get_topic_abs_path_str(topic_str), "partitions", rel_file_str))) for rel_file_str in rel_file_str_list if not rel_file_str.endswith(".index"))
+                # Consume from the start, from an offset (via the sparse index) and look up an offset by timestamp.
+                group_str = self.create_test_group_name()
+                consumer = s.consumer(topic_str, group=group_str)
+                m_list = consumer.consume(n=200)
+                consumer.close()
+                self.assertEqual([m["value"] for m in m_list], value_dict_list)
+                #
+                group_str = self.create_test_group_name()
+                consumer = s.consumer(topic_str, group=group_str, offsets={0: 150})
+                m_list = consumer.consume(n=200)
+                consumer.close()
+                self.assertEqual([m["value"] for m in m_list], value_dict_list[150:])
+                #
+                self.assertEqual(s.offsets_for_times(topic_str, {0: 1142})[topic_str][0], 142)
+            #
+            self.assertLess(topic_str_size_int_dict["gzip"] * 2, topic_str_size_int_dict["none"])
+            self.assertLess(topic_str_size_int_dict["lz4"] * 2, topic_str_size_int_dict["none"])
+            self.assertLess(topic_str_size_int_dict["zstd"] * 2, topic_str_size_int_dict["none"])
+            #
+            topic_str = self.create_test_topic_name()
+            s.create(topic_str, config={"compression.type": "brotli"})
+            with self.assertRaises(Exception):
+                s.producer(topic_str)
+
+    def test_revert_partition_file(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__bases__[0].__name__ == "FS" and s.admin.append_bool:
+            topic_str = self.create_test_topic_name()
+            s.create(topic_str)
+            partitions_abs_dir_str = os.path.join(s.admin.get_topic_abs_path_str(topic_str), "partitions")
+            abs_path_file_str1 = os.path.join(partitions_abs_dir_str, "segment1")
+            abs_path_file_str2 = os.path.join(partitions_abs_dir_str, "segment2")
+            self.assertEqual(s.admin.write_partition_file(abs_path_file_str1, None, None, b"0123456789"), [])
+            # A consumer maps the active segment into memory while a producer appends to it (and has to revert the append).
+            mapped_memoryview = s.admin.read_bytes_mmap(abs_path_file_str1)
+            # The previous name is returned as obsolete (it is only deleted after the manifest has been updated).
+            self.assertEqual(s.admin.write_partition_file(abs_path_file_str2, abs_path_file_str1, None, b"abcdef"), [abs_path_file_str1])
+            self.assertTrue(s.admin.exists_file(abs_path_file_str1))
+            self.assertEqual(s.admin.read_bytes(abs_path_file_str2), b"0123456789abcdef")
+            # The append is not done if the new name is already taken.
+            self.assertEqual(s.admin.write_partition_file(abs_path_file_str2, abs_path_file_str2, None, b"ghi"), None)
+            self.assertEqual(s.admin.read_bytes(abs_path_file_str2), b"0123456789abcdef")
+            #
+            s.admin.revert_partition_file(abs_path_file_str2, abs_path_file_str1, 10)
+            self.assertFalse(s.admin.exists_file(abs_path_file_str2))
+            self.assertEqual(s.admin.read_bytes(abs_path_file_str1), b"0123456789")
+            # The mapped file has not been truncated in place.
+            self.assertEqual(bytes(mapped_memoryview), b"0123456789")
+
+    def test_concurrent_producers(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        if s.__class__.__bases__[0].__name__ == "FS":
+            topic_str = self.create_test_topic_name()
+            s.create(topic_str)
+            # Two producers interleaving on the same partition: the second one starts a new segment instead of appending to the active segment of the first one.
+            producer1 = s.producer(topic_str, key_type="str", value_type="str")
+            producer2 = s.producer(topic_str, key_type="str", value_type="str")
+            producer1.produce(["a0", "a1"])
+            producer2.produce(["b0"])
+            producer1.produce(["a2"])
+            producer2.produce(["b1", "b2"])
+            producer1.close()
+            producer2.close()
+            #
+            consumer = s.consumer(topic_str, group=self.create_test_group_name(), key_type="str", value_type="str")
+            m_list = consumer.consume(n=10)
+            consumer.close()
+            self.assertEqual([(m["offset"], m["value"]) for m in m_list], list(enumerate(["a0", "a1", "b0", "a2", "b1", "b2"])))
+            # Producers in parallel threads (the manifest is updated with compare-and-swap, conflicting batches are written again with new offsets).
+            import threading
+            #
+            def produce(thread_int):
+                producer = s.producer(topic_str, key_type="str", value_type="str")
+                for i in range(20):
+                    producer.produce(f"{thread_int} {i}")
+                producer.close()
+            #
+            thread_list = [threading.Thread(target=produce, args=(thread_int,)) for thread_int in range(4)]
+            for thread in thread_list:
+                thread.start()
+            for thread in thread_list:
+                thread.join()
+            #
+            self.assertEqual(s.watermarks(topic_str)[topic_str][0], (0, 86))
+            consumer = s.consumer(topic_str, group=self.create_test_group_name(), key_type="str", value_type="str", offsets={0: 6})
+            m_list = consumer.consume(n=100)
+            consumer.close()
+            self.assertEqual([m["offset"] for m in m_list], list(range(6, 86)))
+            self.assertEqual(sorted(m["value"] for m in m_list), sorted(f"{thread_int} {i}" for thread_int in range(4) for i in range(20)))
+            # The messages of each producer are in order.
+            for thread_int in range(4):
+                self.assertEqual([m["value"] for m in m_list if m["value"].startswith(f"{thread_int} ")], [f"{thread_int} {i}" for i in range(20)])